@@ -1,8 +1,21 @@
+import argparse
 import csv
 import json
 import ast
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
 import pandas as pd
 
+# Raw export rows read (and parsed by one worker) at a time
+DEFAULT_CHUNKSIZE = 20000
+DEFAULT_INPUT = "Top 1000 Steam Games 2023 export 2025-07-09 14-37-02.csv"
+DEFAULT_TAGS_OUTPUT = "games_tags.parquet"
+# Output of --json-csv, the CSV with a tags_json column the older scripts read
+DEFAULT_JSON_CSV_OUTPUT = "Top 1000 Steam Games 2023 export 2025-07-09 14-37-02_json_tags.csv"
+
+
 def convert_tags_to_json(input_csv, output_csv):
     """
     Process a CSV file to add a new column with JSON-formatted tags.
@@ -50,9 +63,119 @@ def convert_tags_to_json(input_csv, output_csv):
     except Exception as e:
         print(f"An error occurred: {e}")
 
+
+def parse_tag_weights(tags_str):
+    """
+    Parse one tag-count dict string and normalize the counts to sum to 1.
+
+    Args:
+        tags_str (str): Python literal of a {tag: votes} dict, as in the export
+
+    Returns:
+        list: (tag, weight) pairs, empty for missing or unparsable tags
+    """
+    if not isinstance(tags_str, str) or tags_str in ('', '[]', '{}'):
+        return []
+    try:
+        tags_dict = ast.literal_eval(tags_str)
+    except (SyntaxError, ValueError):
+        print(f"Error parsing tags: {tags_str}")
+        return []
+    # Some rows hold an empty list instead of a dict
+    if not isinstance(tags_dict, dict) or not tags_dict:
+        return []
+
+    total = sum(tags_dict.values()) or 1
+    return [(str(tag), count / total) for tag, count in tags_dict.items()]
+
+
+def _parse_chunk(first_row, appids, tag_strings):
+    """
+    Parse a chunk of rows into the long format columns (runs in a worker process).
+
+    Args:
+        first_row (int): Row number of the first row of the chunk in the export
+        appids (list): appid of every row
+        tag_strings (list): Raw tags value of every row
+
+    Returns:
+        dict: Equal-length lists for the row, appid, tag and weight columns
+    """
+    columns = {'row': [], 'appid': [], 'tag': [], 'weight': []}
+    for offset, (appid, tags_str) in enumerate(zip(appids, tag_strings)):
+        for tag, weight in parse_tag_weights(tags_str):
+            columns['row'].append(first_row + offset)
+            columns['appid'].append(appid)
+            columns['tag'].append(tag)
+            columns['weight'].append(weight)
+    return columns
+
+
+def convert_tags_to_parquet(input_csv, output_parquet, chunksize=DEFAULT_CHUNKSIZE, processes=None):
+    """
+    Stream the export's tags into a long-format Parquet file of normalized weights.
+
+    The CSV is read chunksize rows at a time and every chunk is parsed in a
+    worker process. Only a few chunks are in flight at once and each one is
+    written as its own row group, so memory stays constant however large the
+    export is. The output has one row per (game, tag) with the game's 0-based
+    row in the export, its appid, the tag name and the tag's share of the
+    game's votes, which the model build reads with --tags instead of parsing
+    the tag strings again.
+
+    Args:
+        input_csv (str): Path to the raw export CSV
+        output_parquet (str): Path of the Parquet file to write
+        chunksize (int): Rows read and parsed per chunk
+        processes (int): Worker processes (default: one per CPU)
+
+    Returns:
+        int: Number of export rows processed
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([
+        ('row', pa.int64()),
+        ('appid', pa.int64()),
+        ('tag', pa.string()),
+        ('weight', pa.float64()),
+    ])
+    processes = processes or os.cpu_count() or 1
+    rows = 0
+    pending = deque()
+
+    def write_next(writer):
+        writer.write_table(pa.Table.from_pydict(pending.popleft().result(), schema=schema))
+
+    with ProcessPoolExecutor(processes) as executor, pq.ParquetWriter(output_parquet, schema) as writer:
+        for chunk in pd.read_csv(input_csv, usecols=['appid', 'tags'], chunksize=chunksize):
+            pending.append(executor.submit(_parse_chunk, rows, chunk['appid'].astype('int64').tolist(),
+                                           chunk['tags'].tolist()))
+            rows += len(chunk)
+            # Keep every worker busy while bounding the chunks held in memory
+            if len(pending) >= 2 * processes:
+                write_next(writer)
+        while pending:
+            write_next(writer)
+
+    print(f"Successfully processed {rows} rows.")
+    print(f"Output saved to {output_parquet}")
+    return rows
+
+
 if __name__ == "__main__":
-    # Replace these with your actual file paths
-    input_file = "Top 1000 Steam Games 2023 export 2025-07-09 14-37-02.csv"  # Your original CSV file
-    output_file = "Top 1000 Steam Games 2023 export 2025-07-09 14-37-02_json_tags.csv"  # The new CSV file with JSON tags
-    
-    convert_tags_to_json(input_file, output_file)
+    parser = argparse.ArgumentParser(description="Parse the tag column of the Steam export")
+    parser.add_argument('input_csv', nargs='?', default=DEFAULT_INPUT, help="Raw export CSV")
+    parser.add_argument('output', nargs='?', default=None,
+                        help=f"Output file (default: {DEFAULT_TAGS_OUTPUT}, or {DEFAULT_JSON_CSV_OUTPUT} with --json-csv)")
+    parser.add_argument('--chunksize', type=int, default=DEFAULT_CHUNKSIZE, help="Rows parsed per chunk")
+    parser.add_argument('--processes', type=int, default=None, help="Worker processes (default: one per CPU)")
+    parser.add_argument('--json-csv', action='store_true',
+                        help="Write a copy of the CSV with a tags_json column instead (older format)")
+    args = parser.parse_args()
+
+    if args.json_csv:
+        convert_tags_to_json(args.input_csv, args.output or DEFAULT_JSON_CSV_OUTPUT)
+    else:
+        convert_tags_to_parquet(args.input_csv, args.output or DEFAULT_TAGS_OUTPUT, args.chunksize, args.processes)
@@ -0,0 +1,272 @@
+"""Model-level benchmarks over synthetic catalogs of increasing size
+
+From the model directory run:
+
+    python -m benchmarks.bench_model --sizes 1000 10000 50000
+
+For every catalog size it generates a synthetic raw catalog, builds the serving
+artifacts with data_processing.build_similarity (cached in --work-dir), and for
+every backend loads RecommendationModel in a fresh process to measure load
+time, peak memory and predict_by_id/predict_by_index latency over a grid of
+n, seed counts and exclusion-list sizes. Results are written as JSON; compare
+two runs (e.g. from two commits) with:
+
+    python -m benchmarks.bench_model compare before.json after.json
+"""
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+import numpy as np
+
+DEFAULT_SIZES = [1000, 10000, 50000]
+# Dense N x N stores above this size take too much disk and memory to benchmark
+DENSE_MAX_ITEMS = 10000
+DEFAULT_N = [5, 20, 100]
+DEFAULT_SEED_COUNTS = [1, 3, 10]
+DEFAULT_EXCLUSION_SIZES = [0, 50, 500]
+QUERIES_PER_CASE = 200
+WARMUP_QUERIES = 10
+
+
+def _peak_rss_mb() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return usage / 2 ** 20 if sys.platform == 'darwin' else usage / 2 ** 10
+
+
+def _rss_mb() -> float:
+    """Current resident memory, falling back to the peak where /proc is missing"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except OSError:
+        return _peak_rss_mb()
+
+
+def build_catalog(size: int, work_dir: str, seed: int, dense: bool, rebuild: bool = False) -> Dict[str, float]:
+    """Generate and build a catalog once, reusing the artifacts of earlier runs"""
+    from benchmarks.synthetic_catalog import generate_catalog
+    from data_processing.build_similarity import build
+
+    catalog_dir = os.path.join(work_dir, f'catalog_{size}_seed{seed}')
+    marker = os.path.join(catalog_dir, 'dense.json' if dense else 'sparse.json')
+    if os.path.exists(marker) and not rebuild:
+        with open(marker) as f:
+            return json.load(f)
+
+    os.makedirs(catalog_dir, exist_ok=True)
+    csv_path = os.path.join(catalog_dir, 'raw_catalog.csv')
+    generate_catalog(size, seed).to_csv(csv_path, index=False)
+    started = time.perf_counter()
+    build(csv_path, catalog_dir, dtype='float32', dense=dense)
+    info = {'catalog_dir': catalog_dir, 'build_seconds': time.perf_counter() - started}
+    with open(marker, 'w') as f:
+        json.dump(info, f)
+    return info
+
+
+def _percentiles(latencies: List[float]) -> Dict[str, float]:
+    values = np.array(latencies) * 1000
+    return {
+        'count': len(values),
+        'mean_ms': float(values.mean()),
+        'p50_ms': float(np.percentile(values, 50)),
+        'p90_ms': float(np.percentile(values, 90)),
+        'p99_ms': float(np.percentile(values, 99)),
+        'max_ms': float(values.max()),
+    }
+
+
+def run_cases(model, cases: List[dict], queries: int, seed: int) -> List[dict]:
+    """Time predict_by_id/predict_by_index for every case with the same random queries"""
+    ids = list(model.id_to_index)
+    size = len(ids)
+    rng = np.random.default_rng(seed)
+    results = []
+    for case in cases:
+        method, n, seed_count, exclusions = case['method'], case['n'], case['seeds'], case['excluded']
+        # Every case starts cold, so cases do not benefit from each other's rankings
+        model.ranking_cache.clear()
+        latencies = []
+        for position in range(WARMUP_QUERIES + queries):
+            seeds = rng.choice(size, size=seed_count, replace=False)
+            excluded = [ids[i] for i in rng.choice(size, size=min(exclusions, size), replace=False)] or None
+            if method == 'predict_by_id':
+                args = ([ids[i] for i in seeds], n, excluded)
+            else:
+                args = (seeds.tolist(), n, excluded)
+            started = time.perf_counter()
+            getattr(model, method)(*args)
+            if position >= WARMUP_QUERIES:
+                latencies.append(time.perf_counter() - started)
+        results.append({**case, **_percentiles(latencies)})
+    return results
+
+
+def _measure(backend: str, data_dir: str, cases: List[dict], queries: int, seed: int, connection):
+    """Runs in a fresh process so peak memory covers this model only"""
+    # Silence the model's per-query prints (invalid ids, loads) while timing
+    sys.stdout = open(os.devnull, 'w')
+    from model import RecommendationModel
+
+    baseline = _rss_mb()
+    started = time.perf_counter()
+    model = RecommendationModel(backend, data_dir)
+    load_seconds = time.perf_counter() - started
+    after_load = _rss_mb()
+    peak_after_load = _peak_rss_mb()
+    latencies = run_cases(model, cases, queries, seed)
+    connection.send({
+        'load_seconds': load_seconds,
+        'rss_before_load_mb': baseline,
+        'rss_after_load_mb': after_load,
+        'peak_rss_after_load_mb': peak_after_load,
+        'peak_rss_mb': _peak_rss_mb(),
+        'model_bytes': model.memory_usage(),
+        'latency': latencies,
+    })
+    connection.close()
+
+
+def measure_backend(backend: str, data_dir: str, cases: List[dict], queries: int, seed: int) -> dict:
+    context = multiprocessing.get_context('spawn')
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=_measure, args=(backend, data_dir, cases, queries, seed, sender))
+    process.start()
+    sender.close()
+    try:
+        result = receiver.recv()
+    except EOFError:
+        process.join()
+        raise RuntimeError(f"Benchmark process for the {backend} backend exited with code {process.exitcode}")
+    process.join()
+    return result
+
+
+def build_cases(ns: List[int], seed_counts: List[int], exclusion_sizes: List[int]) -> List[dict]:
+    return [
+        {'method': method, 'n': n, 'seeds': seeds, 'excluded': excluded}
+        for method, n, seeds, excluded in itertools.product(
+            ('predict_by_id', 'predict_by_index'), ns, seed_counts, exclusion_sizes)
+    ]
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def run(args) -> dict:
+    cases = build_cases(args.n, args.seed_counts, args.excluded)
+    report = {
+        'meta': {
+            'commit': _git_commit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'queries_per_case': args.queries,
+            'seed': args.seed,
+        },
+        'results': [],
+    }
+    for size in args.sizes:
+        dense = size <= args.dense_max_items
+        backends = [backend for backend in args.backends if dense or backend == 'sparse']
+        if not backends:
+            print(f"Skipping {size} items: dense stores are capped at {args.dense_max_items} items")
+            continue
+        print(f"Building the {size}-item catalog...")
+        build_info = build_catalog(size, args.work_dir, args.seed, dense, args.rebuild)
+        for backend in backends:
+            print(f"Benchmarking {size} items on the {backend} backend...")
+            measured = measure_backend(backend, build_info['catalog_dir'], cases, args.queries, args.seed)
+            report['results'].append({
+                'size': size,
+                'backend': backend,
+                'build_seconds': build_info['build_seconds'],
+                **measured,
+            })
+            print(f"  loaded in {measured['load_seconds']:.2f}s, peak RSS {measured['peak_rss_mb']:.0f} MB")
+    return report
+
+
+def _case_key(size: int, backend: str, case: dict) -> tuple:
+    return (size, backend, case['method'], case['n'], case['seeds'], case['excluded'])
+
+
+def compare(before_path: str, after_path: str):
+    """Print the p50/p99 change of every case present in both reports"""
+    with open(before_path) as f:
+        before = json.load(f)
+    with open(after_path) as f:
+        after = json.load(f)
+
+    before_cases = {
+        _case_key(result['size'], result['backend'], case): case
+        for result in before['results'] for case in result['latency']
+    }
+    print(f"{before['meta']['commit']} -> {after['meta']['commit']}")
+    print(f"{'size':>7} {'backend':>7} {'method':>16} {'n':>4} {'seeds':>5} {'excl':>5} "
+          f"{'p50 ms':>17} {'p99 ms':>17}")
+    for result in after['results']:
+        for case in result['latency']:
+            old = before_cases.get(_case_key(result['size'], result['backend'], case))
+            if old is None:
+                continue
+            cells = []
+            for stat in ('p50_ms', 'p99_ms'):
+                change = (case[stat] / old[stat] - 1) * 100 if old[stat] else 0.0
+                cells.append(f"{old[stat]:7.3f}>{case[stat]:7.3f} {change:+4.0f}%")
+            print(f"{result['size']:>7} {result['backend']:>7} {case['method']:>16} {case['n']:>4} "
+                  f"{case['seeds']:>5} {case['excluded']:>5} {cells[0]:>17} {cells[1]:>17}")
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == 'compare':
+        parser = argparse.ArgumentParser(description="Compare two benchmark reports")
+        parser.add_argument('command')
+        parser.add_argument('before', help="Earlier report")
+        parser.add_argument('after', help="Later report")
+        args = parser.parse_args()
+        compare(args.before, args.after)
+        return
+
+    parser = argparse.ArgumentParser(description="Benchmark RecommendationModel over synthetic catalogs")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help="Catalog sizes")
+    parser.add_argument('--backends', nargs='+', choices=('dense', 'sparse'), default=['dense', 'sparse'])
+    parser.add_argument('--n', type=int, nargs='+', default=DEFAULT_N, help="Recommendations per query")
+    parser.add_argument('--seed-counts', type=int, nargs='+', default=DEFAULT_SEED_COUNTS, help="Seed items per query")
+    parser.add_argument('--excluded', type=int, nargs='+', default=DEFAULT_EXCLUSION_SIZES, help="Excluded ids per query")
+    parser.add_argument('--queries', type=int, default=QUERIES_PER_CASE, help="Timed queries per case")
+    parser.add_argument('--dense-max-items', type=int, default=DENSE_MAX_ITEMS,
+                        help="Largest catalog benchmarked on the dense backend")
+    parser.add_argument('--seed', type=int, default=0, help="Seed for the catalogs and the queries")
+    parser.add_argument('--work-dir', default=os.path.join('benchmarks', 'data'), help="Where built catalogs are kept")
+    parser.add_argument('--rebuild', action='store_true', help="Rebuild catalogs even if already built")
+    parser.add_argument('--output', default=None, help="Report path (default: benchmarks/results/<commit>.json)")
+    args = parser.parse_args()
+
+    report = run(args)
+    output = args.output or os.path.join('benchmarks', 'results', f"{report['meta']['commit']}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Saved results to {os.path.abspath(output)}")
+
+
+if __name__ == "__main__":
+    main()
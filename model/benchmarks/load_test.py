@@ -0,0 +1,388 @@
+"""End-to-end load test of the HTTP service at controlled concurrency
+
+From the model directory run:
+
+    python -m benchmarks.load_test --concurrency 1 8 32 --requests 2000
+
+By default the app from server.py runs in this process (through httpx's ASGI
+transport, with its real lifespan, middleware and threadpool), loading the
+artifacts in MODEL_DATA_DIR. Pass --url http://127.0.0.1:8000 to load-test a
+running server instead, e.g. `python server.py --workers 4` started with
+MODEL_RATE_LIMIT=0. Every concurrency level sends the same request mix:
+synthetic by default (Zipf-distributed seeds over the games ranked by
+popularity, geometric exclusion-list sizes, split between the GET, bulk POST
+and batch endpoints by --mix), or recorded traffic replayed with --replay.
+Results (throughput, latency percentiles and error rates, overall and per
+endpoint) are written as JSON; compare two runs with:
+
+    python -m benchmarks.load_test compare before.json after.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import sys
+import time
+from collections import Counter
+from typing import Dict, List
+
+import numpy as np
+
+from benchmarks.bench_model import _git_commit
+
+DEFAULT_CONCURRENCY = [1, 8, 32]
+REQUESTS_PER_LEVEL = 1000
+WARMUP_REQUESTS = 50
+# Share of the traffic sent to each endpoint
+DEFAULT_MIX = {'get_by_id': 0.4, 'get_by_index': 0.2, 'bulk_by_id': 0.2, 'bulk_by_index': 0.1, 'batch': 0.1}
+ENDPOINTS = {
+    'get_by_id': ('GET', '/model/predict_by_id'),
+    'get_by_index': ('GET', '/model/predict_by_index'),
+    'bulk_by_id': ('POST', '/model/predict_by_id_bulk'),
+    'bulk_by_index': ('POST', '/model/predict_by_index_bulk'),
+    'batch': ('POST', '/model/predict_batch'),
+}
+# Exponent of the Zipf distribution over games ranked by popularity
+ZIPF_EXPONENT = 1.1
+# Mean and cap of the number of excluded ids (e.g. owned games) per query
+EXCLUDED_MEAN = 20
+EXCLUDED_MAX = 500
+# Share of queries with a single seed; the others have 2 to MAX_SEEDS
+SINGLE_SEED_SHARE = 0.6
+MAX_SEEDS = 10
+N_CHOICES = (5, 10, 20)
+MAX_BATCH_SIZE = 8
+REQUEST_TIMEOUT = 30.0
+
+
+def load_catalog(data_dir: str):
+    """Game ids and popularity of the served catalog, from the artifacts the server loads"""
+    from model import CATALOG_FILE, SNAPSHOT_FILE
+    from snapshot import CatalogSnapshot
+
+    catalog_path = os.path.join(data_dir, CATALOG_FILE)
+    snapshot = CatalogSnapshot.load(os.path.join(data_dir, SNAPSHOT_FILE), catalog_path)
+    if snapshot is None:
+        snapshot = CatalogSnapshot.from_catalog(catalog_path)
+    return snapshot.id_index.ids.astype(str), snapshot.popularity
+
+
+class TrafficGenerator:
+    """Synthetic queries whose seeds and exclusions follow a Zipf law over popularity"""
+
+    def __init__(self, ids: np.ndarray, popularity: np.ndarray, seed: int, zipf_exponent: float = ZIPF_EXPONENT,
+                 excluded_mean: float = EXCLUDED_MEAN):
+        self.ids = ids
+        self.rng = np.random.default_rng(seed)
+        self.excluded_mean = excluded_mean
+        # Rows by decreasing popularity (stable, so ties keep catalog order); rank r has weight 1 / r ** s
+        self.ranked = np.argsort(-np.nan_to_num(popularity), kind='stable')
+        weights = 1.0 / np.arange(1, len(ids) + 1) ** zipf_exponent
+        self.probabilities = weights / weights.sum()
+
+    def _rows(self, count: int) -> np.ndarray:
+        count = min(count, len(self.ids))
+        return self.ranked[self.rng.choice(len(self.ids), size=count, replace=False, p=self.probabilities)]
+
+    def query(self, by: str) -> dict:
+        single = self.rng.random() < SINGLE_SEED_SHARE
+        seeds = self._rows(1 if single else int(self.rng.integers(2, MAX_SEEDS + 1)))
+        excluded = 0
+        if self.excluded_mean > 0:
+            excluded = min(int(self.rng.geometric(1 / (self.excluded_mean + 1))) - 1, EXCLUDED_MAX)
+        query = {
+            'ids' if by == 'id' else 'indices': self.ids[seeds].tolist() if by == 'id' else seeds.tolist(),
+            'n': int(self.rng.choice(N_CHOICES)),
+        }
+        if excluded:
+            query['excluded_ids'] = self.ids[self._rows(excluded)].tolist()
+        return query
+
+    def request(self, endpoint: str) -> dict:
+        method, path = ENDPOINTS[endpoint]
+        if endpoint == 'batch':
+            queries = [self.query('id' if self.rng.random() < 0.5 else 'index')
+                       for _ in range(int(self.rng.integers(2, MAX_BATCH_SIZE + 1)))]
+            return {'endpoint': endpoint, 'method': method, 'path': path, 'json': {'queries': queries}}
+        query = self.query('id' if endpoint.endswith('by_id') else 'index')
+        if method == 'POST':
+            return {'endpoint': endpoint, 'method': method, 'path': path, 'json': query}
+        return {'endpoint': endpoint, 'method': method, 'path': path, 'params': query}
+
+    def requests(self, count: int, mix: Dict[str, float]) -> List[dict]:
+        endpoints = list(mix)
+        shares = np.array([mix[endpoint] for endpoint in endpoints], dtype=np.float64)
+        chosen = self.rng.choice(len(endpoints), size=count, p=shares / shares.sum())
+        return [self.request(endpoints[position]) for position in chosen]
+
+
+def read_replay(path: str) -> List[dict]:
+    """Recorded requests, one JSON object per line with 'method', 'path' and 'params' or 'json'"""
+    requests = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                request = json.loads(line)
+                request.setdefault('endpoint', request['path'])
+                requests.append(request)
+    return requests
+
+
+def _latency_stats(latencies: List[float]) -> Dict[str, float]:
+    values = np.array(latencies) * 1000
+    if not len(values):
+        return {'count': 0}
+    return {
+        'count': len(values),
+        'mean_ms': float(values.mean()),
+        'p50_ms': float(np.percentile(values, 50)),
+        'p95_ms': float(np.percentile(values, 95)),
+        'p99_ms': float(np.percentile(values, 99)),
+        'max_ms': float(values.max()),
+    }
+
+
+def summarize(samples: List[tuple], duration: float) -> dict:
+    """Throughput, latency and status counts of (latency, status) samples"""
+    statuses = Counter(str(status) for _, status in samples)
+    failed = sum(count for status, count in statuses.items() if not status.startswith('2'))
+    return {
+        'requests': len(samples),
+        'throughput_rps': len(samples) / duration if duration else 0.0,
+        'error_rate': failed / len(samples) if samples else 0.0,
+        'rate_limited': statuses.get('429', 0),
+        'status_counts': dict(statuses),
+        'latency': _latency_stats([latency for latency, _ in samples]),
+    }
+
+
+async def _send(client, request: dict):
+    """Latency and status of one request; transport failures are reported as 'error'"""
+    started = time.perf_counter()
+    try:
+        response = await client.request(request['method'], request['path'], params=request.get('params'),
+                                        json=request.get('json'))
+        await response.aread()
+        status = response.status_code
+    except Exception as e:
+        status = f"error:{type(e).__name__}"
+    return time.perf_counter() - started, status
+
+
+async def run_level(client, requests: List[dict], concurrency: int) -> dict:
+    """Send every request with at most `concurrency` in flight (closed loop)"""
+    samples = {}
+    positions = iter(range(len(requests)))
+
+    async def worker():
+        for position in positions:
+            samples[position] = await _send(client, requests[position])
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    duration = time.perf_counter() - started
+
+    endpoints = {}
+    for position, sample in samples.items():
+        endpoints.setdefault(requests[position]['endpoint'], []).append(sample)
+    return {
+        'concurrency': concurrency,
+        'duration_seconds': duration,
+        **summarize(list(samples.values()), duration),
+        'endpoints': {endpoint: summarize(values, duration) for endpoint, values in sorted(endpoints.items())},
+    }
+
+
+async def _wait_ready(client, timeout: float):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get('/ready')).status_code == 200:
+                return
+        except Exception:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError(f"The service was not ready within {timeout:.0f}s")
+
+
+def level_requests(requests: List[dict], level: int, count: int) -> List[dict]:
+    """The level's own slice of the traffic, so one level does not find the previous one's results cached
+
+    Traffic shorter than every level together (e.g. a short replay) is repeated.
+    """
+    start = level * count
+    return [requests[(start + offset) % len(requests)] for offset in range(count)]
+
+
+async def _run_levels(client, requests: List[dict], args) -> List[dict]:
+    await _wait_ready(client, args.ready_timeout)
+    results = []
+    for level, concurrency in enumerate(args.concurrency):
+        traffic = level_requests(requests, level, args.warmup + args.requests)
+        # Warm-up requests come from the same mix, so caches look like a server already taking traffic
+        await run_level(client, traffic[:args.warmup], concurrency)
+        print(f"Sending {args.requests} requests at concurrency {concurrency}...")
+        result = await run_level(client, traffic[args.warmup:], concurrency)
+        cache_stats = await client.get('/cache/stats')
+        if cache_stats.status_code == 200:
+            result['cache_stats'] = cache_stats.json()
+        latency = result['latency']
+        print(f"  {result['throughput_rps']:.0f} req/s, p50 {latency.get('p50_ms', 0):.2f} ms, "
+              f"p99 {latency.get('p99_ms', 0):.2f} ms, errors {result['error_rate']:.1%}")
+        results.append(result)
+    return results
+
+
+async def run_in_process(requests: List[dict], args) -> List[dict]:
+    """Serve the app in this process, with its lifespan, middleware and threadpool"""
+    import httpx
+
+    os.environ['MODEL_RATE_LIMIT'] = str(args.rate_limit)
+    import server
+
+    # Per-request logs would dominate the measurements
+    logging.getLogger('server').setLevel(logging.WARNING)
+    transport = httpx.ASGITransport(app=server.app)
+    async with server.app.router.lifespan_context(server.app):
+        async with httpx.AsyncClient(transport=transport, base_url='http://loadtest', timeout=REQUEST_TIMEOUT) as client:
+            return await _run_levels(client, requests, args)
+
+
+async def run_remote(requests: List[dict], args) -> List[dict]:
+    import httpx
+
+    limits = httpx.Limits(max_connections=max(args.concurrency))
+    async with httpx.AsyncClient(base_url=args.url, timeout=REQUEST_TIMEOUT, limits=limits) as client:
+        return await _run_levels(client, requests, args)
+
+
+def _parse_mix(value: str) -> Dict[str, float]:
+    mix = {}
+    for part in value.split(','):
+        endpoint, _, share = part.partition('=')
+        if endpoint not in ENDPOINTS:
+            raise argparse.ArgumentTypeError(f"Unknown endpoint '{endpoint}', expected one of {list(ENDPOINTS)}")
+        mix[endpoint] = float(share)
+    return mix
+
+
+def run(args) -> dict:
+    if args.replay:
+        requests = read_replay(args.replay)
+        traffic = {'replay': args.replay}
+    else:
+        ids, popularity = load_catalog(args.data_dir)
+        generator = TrafficGenerator(ids, popularity, args.seed, args.zipf, args.excluded_mean)
+        requests = generator.requests((args.warmup + args.requests) * len(args.concurrency), args.mix)
+        traffic = {'mix': args.mix, 'zipf_exponent': args.zipf, 'excluded_mean': args.excluded_mean,
+                   'catalog_size': len(ids)}
+    if args.record:
+        with open(args.record, 'w') as f:
+            for request in requests:
+                f.write(json.dumps(request) + '\n')
+        print(f"Saved the request mix to {os.path.abspath(args.record)}")
+    if not requests or args.requests <= 0:
+        raise SystemExit("Nothing to send")
+
+    report = {
+        'meta': {
+            'commit': _git_commit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'target': args.url or 'in-process',
+            'requests_per_level': args.requests,
+            'warmup_requests': args.warmup,
+            'seed': args.seed,
+            'traffic': traffic,
+        },
+    }
+    runner = run_remote if args.url else run_in_process
+    report['results'] = asyncio.run(runner(requests, args))
+    if not args.url:
+        # Server settings that change the results, known when the server ran here
+        report['meta']['env'] = {key: value for key, value in os.environ.items() if key.startswith('MODEL_')}
+    return report
+
+
+def compare(before_path: str, after_path: str):
+    """Print the throughput and p50/p99 change per concurrency level and endpoint present in both reports"""
+    with open(before_path) as f:
+        before = json.load(f)
+    with open(after_path) as f:
+        after = json.load(f)
+
+    def rows(report):
+        for result in report['results']:
+            yield (result['concurrency'], 'all'), result
+            for endpoint, summary in result['endpoints'].items():
+                yield (result['concurrency'], endpoint), summary
+
+    before_rows = dict(rows(before))
+    print(f"{before['meta']['commit']} -> {after['meta']['commit']}")
+    print(f"{'conc':>5} {'endpoint':>14} {'req/s':>19} {'p50 ms':>19} {'p99 ms':>19} {'errors':>13}")
+    for key, new in rows(after):
+        old = before_rows.get(key)
+        if old is None:
+            continue
+        cells = []
+        for stat, old_value, new_value in (
+            ('rps', old['throughput_rps'], new['throughput_rps']),
+            ('p50', old['latency'].get('p50_ms', 0), new['latency'].get('p50_ms', 0)),
+            ('p99', old['latency'].get('p99_ms', 0), new['latency'].get('p99_ms', 0)),
+        ):
+            change = (new_value / old_value - 1) * 100 if old_value else 0.0
+            cells.append(f"{old_value:7.1f}>{new_value:7.1f} {change:+4.0f}%" if stat == 'rps'
+                         else f"{old_value:7.2f}>{new_value:7.2f} {change:+4.0f}%")
+        errors = f"{old['error_rate']:5.1%}>{new['error_rate']:5.1%}"
+        print(f"{key[0]:>5} {key[1]:>14} {cells[0]:>19} {cells[1]:>19} {cells[2]:>19} {errors:>13}")
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == 'compare':
+        parser = argparse.ArgumentParser(description="Compare two load test reports")
+        parser.add_argument('command')
+        parser.add_argument('before', help="Earlier report")
+        parser.add_argument('after', help="Later report")
+        args = parser.parse_args()
+        compare(args.before, args.after)
+        return
+
+    parser = argparse.ArgumentParser(description="Load-test the recommendation API")
+    parser.add_argument('--url', default=None, help="Base URL of a running server (default: serve the app in-process)")
+    parser.add_argument('--data-dir', default=os.environ.get('MODEL_DATA_DIR', os.path.join('..', 'Data')),
+                        help="Artifacts of the served catalog, read for the synthetic seeds")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=DEFAULT_CONCURRENCY,
+                        help="Requests in flight, one run per level")
+    parser.add_argument('--requests', type=int, default=REQUESTS_PER_LEVEL, help="Timed requests per level")
+    parser.add_argument('--warmup', type=int, default=WARMUP_REQUESTS, help="Untimed requests before each level")
+    parser.add_argument('--mix', type=_parse_mix, default=DEFAULT_MIX,
+                        help="Endpoint shares, e.g. get_by_id=0.5,bulk_by_id=0.3,batch=0.2")
+    parser.add_argument('--zipf', type=float, default=ZIPF_EXPONENT, help="Zipf exponent of seed popularity")
+    parser.add_argument('--excluded-mean', type=float, default=EXCLUDED_MEAN, help="Mean number of excluded ids")
+    parser.add_argument('--replay', default=None, help="Replay recorded requests (JSON lines) instead, "
+                        "in order and repeated if shorter than every level together")
+    parser.add_argument('--record', default=None, help="Also save the request mix as JSON lines for --replay")
+    parser.add_argument('--rate-limit', type=int, default=0,
+                        help="MODEL_RATE_LIMIT for the in-process server (default 0: no rate limiting)")
+    parser.add_argument('--ready-timeout', type=float, default=600, help="Seconds to wait for GET /ready")
+    parser.add_argument('--seed', type=int, default=0, help="Seed for the synthetic traffic")
+    parser.add_argument('--output', default=None,
+                        help="Report path (default: benchmarks/results/load_<commit>.json)")
+    args = parser.parse_args()
+
+    # Per-request logs would dominate the output
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+    report = run(args)
+    output = args.output or os.path.join('benchmarks', 'results', f"load_{report['meta']['commit']}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Saved results to {os.path.abspath(output)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Reproducible synthetic catalogs in the shape of the raw Steam export
+
+The columns match "Top 1000 Steam Games 2023 export", so a generated catalog
+goes through data_processing.build_similarity like the real one. Developer,
+publisher and tag popularity follow a Zipf-like law as in the real data, but
+the developer/publisher vocabularies grow slower than the catalog so the
+one-hot columns stay manageable at 50k games.
+"""
+import numpy as np
+import pandas as pd
+
+GENRES = ['Action', 'Adventure', 'Indie', 'RPG', 'Strategy', 'Free to Play', 'Simulation',
+          'Massively Multiplayer', 'Casual', 'Sports', 'Early Access', 'Racing']
+GENRE_WEIGHTS = [666, 369, 362, 247, 202, 198, 188, 124, 111, 44, 42, 26]
+OWNER_BUCKETS = ['200,000 .. 500,000', '500,000 .. 1,000,000', '1,000,000 .. 2,000,000',
+                 '2,000,000 .. 5,000,000', '5,000,000 .. 10,000,000', '10,000,000 .. 20,000,000',
+                 '20,000,000 .. 50,000,000', '50,000,000 .. 100,000,000']
+TAG_COUNT = 400
+TAGS_PER_GAME = (5, 20)
+LANGUAGES = 'English, French, German, Spanish - Spain, Simplified Chinese'
+
+
+def _zipf_choice(rng: np.random.Generator, vocabulary_size: int, count: int) -> np.ndarray:
+    """Draw `count` ranks in [0, vocabulary_size) with probability ~ 1 / (rank + 1)"""
+    weights = 1.0 / np.arange(1, vocabulary_size + 1)
+    return rng.choice(vocabulary_size, size=count, p=weights / weights.sum())
+
+
+def generate_catalog(size: int, seed: int = 0) -> pd.DataFrame:
+    """Raw catalog with `size` games, identical for the same size and seed"""
+    rng = np.random.default_rng(seed)
+    developers = _zipf_choice(rng, max(50, size // 20), size)
+    publishers = _zipf_choice(rng, max(25, size // 40), size)
+
+    genre_p = np.array(GENRE_WEIGHTS, dtype=np.float64) / sum(GENRE_WEIGHTS)
+    genre_counts = rng.integers(1, 4, size)
+    tag_counts = rng.integers(TAGS_PER_GAME[0], TAGS_PER_GAME[1] + 1, size)
+    tag_weights = 1.0 / np.arange(1, TAG_COUNT + 1)
+    tag_p = tag_weights / tag_weights.sum()
+
+    genres, tags = [], []
+    for game in range(size):
+        picked = rng.choice(len(GENRES), size=genre_counts[game], replace=False, p=genre_p)
+        genres.append(', '.join(GENRES[g] for g in sorted(picked)))
+        picked = rng.choice(TAG_COUNT, size=tag_counts[game], replace=False, p=tag_p)
+        # Votes fall off with the tag's position, like Steam's ordered tag lists
+        votes = np.sort(rng.integers(5, 5000, tag_counts[game]))[::-1]
+        tags.append(str({f'Tag {tag}': int(vote) for tag, vote in zip(picked, votes)}))
+
+    initial_price = rng.choice([0, 499, 999, 1499, 1999, 2999, 3999, 5999, 6999], size=size)
+    discount = np.where(rng.random(size) < 0.2, rng.choice([10, 25, 50, 75], size=size), 0)
+    positive = rng.lognormal(8, 2, size).astype(np.int64)
+    return pd.DataFrame({
+        'appid': np.arange(10, 10 * (size + 1), 10),
+        'name': [f'Game {game}' for game in range(size)],
+        'developer': [f'Developer {d}' for d in developers],
+        'publisher': [f'Publisher {p}' for p in publishers],
+        'score_rank': '',
+        'positive': positive,
+        'negative': (positive * rng.uniform(0.02, 0.6, size)).astype(np.int64),
+        'userscore': 0,
+        'owners': rng.choice(OWNER_BUCKETS, size=size),
+        'average_forever': 0,
+        'average_2weeks': 0,
+        'median_forever': 0,
+        'median_2weeks': 0,
+        'price': (initial_price * (100 - discount) // 100).astype(np.int64),
+        'initialprice': initial_price,
+        'discount': discount,
+        'languages': LANGUAGES,
+        'genre': genres,
+        'ccu': rng.lognormal(6, 2.5, size).astype(np.int64),
+        'tags': tags,
+    })
@@ -0,0 +1,84 @@
+import sys
+import threading
+from collections import OrderedDict
+from typing import Any, Hashable
+
+import numpy as np
+
+# Returned by `get` on a miss, so cached falsy values (e.g. []) still count as hits
+MISSING = object()
+
+
+def estimate_size(value: Any) -> int:
+    """Approximate memory footprint in bytes of a cache key or value"""
+    if isinstance(value, np.ndarray):
+        return value.nbytes + 112
+    if isinstance(value, (tuple, list, set, frozenset)):
+        return sys.getsizeof(value) + sum(estimate_size(item) for item in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(estimate_size(k) + estimate_size(v) for k, v in value.items())
+    return sys.getsizeof(value)
+
+
+class SizedLRUCache:
+    """Thread-safe LRU cache bounded by the estimated memory of its entries
+
+    Keeps hit/miss/eviction counters. `clear` bumps a generation number: a
+    caller that read `generation` before computing a value passes it to `put`,
+    and values computed against a model that has since been replaced are
+    dropped instead of cached.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.generation = 0
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return MISSING
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Hashable, value: Any, generation: int = None):
+        size = estimate_size(key) + estimate_size(value)
+        with self._lock:
+            if (generation is not None and generation != self.generation) or size > self.max_bytes:
+                return
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[1]
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self.generation += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
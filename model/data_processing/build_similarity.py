@@ -0,0 +1,362 @@
+"""Build the serving artifacts from the raw Steam export
+
+Vectorized version of the pipeline in raw_data_processing.ipynb. From the
+model directory run:
+
+    python -m data_processing.build_similarity "../Data/Top 1000 Steam Games 2023 export 2025-07-09 14-37-02.csv"
+
+It writes processed_games.parquet with its startup snapshot (id index and
+popularity), the weighted sparse feature matrix (and the spec used to weight
+it), the memory-mapped similarity store and the top-K neighbor index into the
+output directory (../Data by default).
+"""
+import argparse
+import ast
+import json
+import os
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from neighbor_index import NeighborIndex
+from similarity_store import SimilarityStore, SUPPORTED_DTYPES
+from snapshot import CatalogSnapshot
+
+# Same feature set and weights as the notebook
+BASE_FEATURES = ['review_ratio', 'price_scaled', 'ccu', 'discount_percentage']
+CATEGORY_PREFIXES = ['tags_', 'developer_', 'owners_', 'publisher_', 'genre_']
+CATEGORY_WEIGHTS = {
+    'tags_': 0.5,
+    'genre_': 0.4,
+    'developer_': 0.2,
+    'review_ratio': 0.1,
+    'ccu': 0.05,
+    'owners_': 0.05,
+    'price_scaled': 0.1,
+    'publisher_': 0.05,
+    'discount_percentage': 0.05
+}
+# Rows converted to sparse at once when reading the processed frame
+CONVERT_CHUNK_ROWS = 10000
+
+
+def sort_by_colname(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Sort dataframe columns with the following rules:
+    1. Columns named "id" or "name"
+    2. Columns without underscores come first (sorted alphabetically)
+    3. Columns with underscores come after (sorted by prefix frequency, then alphabetically)
+       - Least frequent prefixes come first
+    """
+    columns = list(df.columns)
+    special_columns = [col for col in ('id', 'name') if col in columns]
+    columns = [col for col in columns if col not in special_columns]
+
+    columns_without_underscore = sorted(col for col in columns if '_' not in col)
+
+    prefix_groups: Dict[str, List[str]] = {}
+    for col in columns:
+        if '_' in col:
+            prefix_groups.setdefault(col.split('_')[0] + '_', []).append(col)
+    sorted_prefixes = sorted(prefix_groups, key=lambda prefix: len(prefix_groups[prefix]))
+    columns_with_underscore = [col for prefix in sorted_prefixes for col in sorted(prefix_groups[prefix])]
+
+    return df[special_columns + columns_without_underscore + columns_with_underscore]
+
+
+def process_tags(tags_str) -> Dict[str, float]:
+    """Parse a tag-count dict (JSON or Python literal) and normalize counts to sum to 1"""
+    if not isinstance(tags_str, (str, dict)) or tags_str in ('', '[]', '{}'):
+        return {}
+
+    if isinstance(tags_str, str):
+        try:
+            tags_obj = json.loads(tags_str.replace("'", '"'))
+        except json.JSONDecodeError:
+            try:
+                tags_obj = ast.literal_eval(tags_str)
+            except (SyntaxError, ValueError):
+                return {}
+    else:
+        tags_obj = tags_str
+
+    # Some rows hold an empty list instead of a dict
+    if not isinstance(tags_obj, dict) or not tags_obj:
+        return {}
+
+    total = sum(tags_obj.values()) or 1
+    return {tag: count / total for tag, count in tags_obj.items()}
+
+
+def expand_genres_to_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """One-hot encode the comma-separated genre strings as genre_* columns"""
+    genres = df['genre'].fillna('').str.replace(r'\s*,\s*', ',', regex=True).str.strip()
+    dummies = genres.str.get_dummies(sep=',').drop(columns='', errors='ignore')
+    dummies.columns = ['genre_' + genre.lower().replace(' ', '_') for genre in dummies.columns]
+    # Genres that only differ by case end up in the same column
+    dummies = dummies.T.groupby(level=0).max().T
+    return pd.concat([df, dummies], axis=1)
+
+
+def load_tag_weights(path: str) -> pd.DataFrame:
+    """Read the long-format tag weights written by Data/ParseTags.py (row, tag, weight)"""
+    return pd.read_parquet(path, columns=['row', 'tag', 'weight'])
+
+
+def expand_tags_to_columns(df: pd.DataFrame, tag_weights: Optional[pd.DataFrame] = None) -> pd.DataFrame:
+    """Expand the normalized tags into tags_* columns in one sparse assembly
+
+    The tags come from the normalized_tags dicts, or from long-format
+    tag_weights when given, which skips parsing the tag strings entirely.
+    """
+    if tag_weights is not None:
+        rows = tag_weights['row'].to_numpy()
+        if len(rows) and (rows.min() < 0 or rows.max() >= len(df)):
+            raise ValueError(f"Tag weights refer to row {rows.max()} but the catalog has {len(df)} rows")
+        tags = ('tags_' + tag_weights['tag'].str.lower()).to_numpy(dtype=object)
+        values = tag_weights['weight'].to_numpy()
+    else:
+        rows, tags, values = [], [], []
+        for row, tags_dict in enumerate(df['normalized_tags']):
+            rows.extend([row] * len(tags_dict))
+            tags.extend('tags_' + tag.lower() for tag in tags_dict)
+            values.extend(tags_dict.values())
+
+    columns, tag_codes = np.unique(np.array(tags, dtype=object), return_inverse=True)
+    matrix = sp.csr_matrix((values, (rows, tag_codes)), shape=(len(df), len(columns)))
+    tag_df = pd.DataFrame(matrix.toarray(), index=df.index, columns=list(columns))
+    return pd.concat([df, tag_df], axis=1)
+
+
+def preprocess_data(df: pd.DataFrame, parse_tags: bool = True) -> pd.DataFrame:
+    print("preprocessing data...")
+    processed_df = df.drop(['appid', 'average_forever', 'average_2weeks', 'median_forever', 'median_2weeks',
+                            'userscore', 'score_rank', 'languages'], axis=1)
+    processed_df = pd.get_dummies(processed_df, columns=['owners', 'publisher', 'developer'])
+
+    # Handle missing values
+    processed_df['price'] = processed_df['price'].fillna(processed_df['price'].median())
+    processed_df = processed_df.fillna({'positive': 0, 'negative': 0, 'ccu': 0})
+
+    # Normalize tag values, unless they were already parsed by Data/ParseTags.py
+    if parse_tags:
+        processed_df['normalized_tags'] = processed_df['tags'].apply(process_tags)
+    return processed_df
+
+
+def _standard_scale(values: pd.Series) -> pd.Series:
+    """Same result as sklearn's StandardScaler on a single column"""
+    std = values.std(ddof=0)
+    return (values - values.mean()) / (std if std else 1.0)
+
+
+def engineer_features(df: pd.DataFrame, tag_weights: Optional[pd.DataFrame] = None) -> pd.DataFrame:
+    print("Engineering features...")
+    df = df.copy()
+    df['review_ratio'] = df['positive'] / (df['positive'] + df['negative'] + 1)  # Add 1 to avoid division by zero
+    df['discount_percentage'] = (df['initialprice'] - df['price']) / (df['initialprice'] + 0.01)
+
+    df['price_scaled'] = _standard_scale(df['price'])
+    df['positive_scaled'] = _standard_scale(df['positive'])
+    df['negative_scaled'] = _standard_scale(df['negative'])
+
+    df = expand_genres_to_columns(df)
+    df = expand_tags_to_columns(df, tag_weights)
+
+    # The raw price is kept (it is not a feature) so the server can filter on it
+    return df.drop(['positive', 'negative', 'discount', 'initialprice', 'normalized_tags', 'tags', 'genre'],
+                   axis=1, errors='ignore')
+
+
+def select_features(df: pd.DataFrame, category_weights: Optional[Dict[str, float]] = None):
+    """Pick the feature columns and spread each prefix weight evenly over its columns
+
+    Returns:
+        (features, feature_weights)
+    """
+    category_weights = CATEGORY_WEIGHTS if category_weights is None else category_weights
+    features = [col for col in BASE_FEATURES if col in df.columns]
+    for prefix in CATEGORY_PREFIXES:
+        features.extend(col for col in df.columns if col.startswith(prefix))
+
+    prefix_counts = {prefix: sum(col.startswith(prefix) for col in features) for prefix in CATEGORY_PREFIXES}
+    feature_weights = {}
+    for feature in features:
+        if feature in category_weights:
+            feature_weights[feature] = category_weights[feature]
+            continue
+        for prefix in CATEGORY_PREFIXES:
+            if feature.startswith(prefix) and prefix_counts[prefix] > 0:
+                feature_weights[feature] = category_weights.get(prefix, 0) / prefix_counts[prefix]
+                break
+    return features, feature_weights
+
+
+def build_feature_matrix(df: pd.DataFrame, features: List[str], feature_weights: Optional[Dict[str, float]] = None,
+                         category_prefixes: Optional[List[str]] = None) -> sp.csr_matrix:
+    """Weighted, L2-normalized sparse feature matrix whose row dot products are cosine similarities
+
+    Non-category features are multiplied by their weight. For each prefix in
+    `category_prefixes`, the prefix weight is instead split evenly among the
+    categories an item belongs to (value == 1), as in the notebook.
+    """
+    feature_weights = feature_weights or {}
+    category_prefixes = category_prefixes or []
+
+    # Convert in row chunks so the dense float copy of the frame stays bounded
+    chunks = [
+        sp.csr_matrix(df[features].iloc[start:start + CONVERT_CHUNK_ROWS].to_numpy(dtype=np.float64))
+        for start in range(0, len(df), CONVERT_CHUNK_ROWS)
+    ]
+    matrix = sp.vstack(chunks, format='csr') if chunks else sp.csr_matrix((0, len(features)))
+
+    column_scale = np.array([
+        0.0 if any(feature.startswith(prefix) for prefix in category_prefixes) else feature_weights.get(feature, 1.0)
+        for feature in features
+    ])
+    weighted = matrix @ sp.diags(column_scale)
+
+    for prefix in category_prefixes:
+        columns = np.array([j for j, feature in enumerate(features) if feature.startswith(prefix)], dtype=np.int64)
+        if not len(columns):
+            continue
+        membership = (matrix[:, columns] == 1).astype(np.float64)
+        counts = np.asarray(membership.sum(axis=1)).ravel()
+        share = np.divide(feature_weights.get(prefix, 0), counts, out=np.zeros_like(counts), where=counts > 0)
+        placed = sp.csr_matrix(sp.diags(share) @ membership)
+        scatter = sp.csr_matrix((np.ones(len(columns)), (np.arange(len(columns)), columns)),
+                                shape=(len(columns), len(features)))
+        weighted = weighted + placed @ scatter
+
+    weighted = sp.csr_matrix(weighted)
+    weighted.eliminate_zeros()
+    norms = np.sqrt(np.asarray(weighted.multiply(weighted).sum(axis=1)).ravel())
+    # Zero rows stay zero, which gives them a similarity of 0 to everything
+    inverse = np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)
+    return sp.csr_matrix(sp.diags(inverse) @ weighted)
+
+
+def save_feature_spec(path: str, features: List[str], feature_weights: Dict[str, float],
+                      category_prefixes: Optional[List[str]] = None):
+    """Record how the feature matrix was built so new games can be weighted the same way"""
+    with open(path, 'w') as f:
+        json.dump({
+            'features': features,
+            'feature_weights': feature_weights,
+            'category_prefixes': category_prefixes or [],
+        }, f)
+
+
+def load_feature_spec(path: str) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def similarity_blocks(features: sp.csr_matrix, block_size: int = 256):
+    """Yield (start, block) pairs of cosine similarity rows, one row block at a time
+
+    Only block_size x N scores exist at any moment. Each score is the dot
+    product of a catalog row with a densified seed row, the same kernel the
+    sparse serving backend uses, so both give bit-identical values.
+    """
+    size = features.shape[0]
+    for start in range(0, size, block_size):
+        stop = min(start + block_size, size)
+        seeds = features[start:stop].toarray().T
+        yield start, np.asarray(features @ seeds).T
+
+
+def write_artifacts(features: sp.csr_matrix, ids: List[str], output_dir: str, dtype: str = 'float32',
+                    block_size: int = 256, neighbor_count: int = 100, legacy_parquet: bool = False):
+    """Stream the similarity rows into the store, the neighbor index and optionally the legacy parquet"""
+    size = features.shape[0]
+    k = max(min(neighbor_count, size - 1), 0)
+    store = SimilarityStore.create(os.path.join(output_dir, 'games_similarity_matrix.sim'), ids, dtype)
+    neighbor_ids = np.empty((size, k), dtype=np.int32)
+    neighbor_scores = np.empty((size, k), dtype=np.float32)
+
+    writer = None
+    if legacy_parquet:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        schema = pa.schema([(str(game_id), pa.float64()) for game_id in ids])
+        writer = pq.ParquetWriter(os.path.join(output_dir, 'games_similarity_matrix.parquet'), schema)
+
+    try:
+        for start, block in similarity_blocks(features, block_size):
+            stop = start + block.shape[0]
+            store.write_rows(start, block)
+            # Rank the values as stored (rounded to `dtype`), so the index agrees with the store's own top-k
+            neighbor_ids[start:stop], neighbor_scores[start:stop] = NeighborIndex.rank_block(store[start:stop], start, k)
+            if writer is not None:
+                writer.write_table(pa.Table.from_arrays(list(block.T), schema=schema))
+    finally:
+        if writer is not None:
+            writer.close()
+
+    store.flush()
+    NeighborIndex(neighbor_ids, neighbor_scores, NeighborIndex.fingerprint(store)).save(os.path.join(output_dir, 'games_neighbors.npz'))
+
+
+def build(input_csv: str, output_dir: str, dtype: str = 'float32', block_size: int = 256,
+          neighbor_count: int = 100, legacy_parquet: bool = False, dense: bool = True,
+          tags_path: Optional[str] = None) -> pd.DataFrame:
+    """Run the whole pipeline from the raw export to the serving artifacts
+
+    With dense=False only the catalog and the feature matrix are written, which
+    is all the sparse backend needs, and nothing N x N is computed. With
+    tags_path (the output of Data/ParseTags.py) the tag column is not read from
+    the export and the tag features come from the pre-parsed weights.
+    """
+    started = time.perf_counter()
+    if tags_path:
+        raw_df = pd.read_csv(input_csv, usecols=lambda column: column != 'tags')
+        processed_df = engineer_features(preprocess_data(raw_df, parse_tags=False), load_tag_weights(tags_path))
+    else:
+        processed_df = engineer_features(preprocess_data(pd.read_csv(input_csv)))
+    processed_df = sort_by_colname(processed_df)
+    catalog_path = os.path.join(output_dir, 'processed_games.parquet')
+    processed_df.to_parquet(catalog_path)
+    # Lets the server start without reading the catalog frame
+    CatalogSnapshot.from_frame(processed_df).save(os.path.join(output_dir, 'games_snapshot.npz'), catalog_path)
+
+    print("Building feature matrix...")
+    features, feature_weights = select_features(processed_df)
+    matrix = build_feature_matrix(processed_df, features, feature_weights)
+    # Served directly by the sparse backend for catalogs too large for a dense matrix
+    sp.save_npz(os.path.join(output_dir, 'games_features.npz'), matrix)
+    save_feature_spec(os.path.join(output_dir, 'games_features.json'), features, feature_weights)
+
+    if dense:
+        print(f"Writing similarity artifacts for {matrix.shape[0]} games x {matrix.shape[1]} features...")
+        id_column = processed_df.index if 'id' not in processed_df.columns else processed_df['id']
+        write_artifacts(matrix, [str(game_id) for game_id in id_column], output_dir, dtype, block_size,
+                        neighbor_count, legacy_parquet)
+    print(f"Done in {time.perf_counter() - started:.1f}s")
+    return processed_df
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the processed catalog and similarity artifacts")
+    parser.add_argument('input_csv', help="Raw Steam export CSV")
+    parser.add_argument('--output-dir', default='../Data', help="Directory for the serving artifacts")
+    parser.add_argument('--dtype', choices=SUPPORTED_DTYPES, default='float32', help="Similarity store dtype")
+    parser.add_argument('--block-size', type=int, default=256, help="Similarity rows computed per block")
+    parser.add_argument('--neighbors', type=int, default=100, help="Neighbors kept per game in the index")
+    parser.add_argument('--legacy-parquet', action='store_true',
+                        help="Also write games_similarity_matrix.parquet for older servers")
+    parser.add_argument('--sparse-only', action='store_true',
+                        help="Skip the N x N store and neighbor index (for MODEL_BACKEND=sparse)")
+    parser.add_argument('--tags', default=None,
+                        help="Tag weights written by Data/ParseTags.py, used instead of parsing the tag column")
+    args = parser.parse_args()
+
+    build(args.input_csv, args.output_dir, args.dtype, args.block_size, args.neighbors, args.legacy_parquet,
+          dense=not args.sparse_only, tags_path=args.tags)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+import threading
+from typing import Dict, Iterator, Optional
+
+import numpy as np
+
+from id_index import IdIndex
+
+
+class ExclusionSet:
+    """One named set of catalog rows (e.g. a user's library) as a packed bitset
+
+    Instances are never modified: adding or removing games creates a new set
+    with a new version, so a prediction holding a set keeps a consistent view
+    and (name, version) can key cached results.
+    """
+    __slots__ = ('name', 'version', 'bits', 'count')
+
+    def __init__(self, name: str, version: int, bits: np.ndarray):
+        self.name = name
+        self.version = version
+        self.bits = bits
+        self.count = int(np.unpackbits(bits).sum())
+
+    @property
+    def key(self) -> tuple:
+        return self.name, self.version
+
+    def rows(self, size: int) -> np.ndarray:
+        return np.flatnonzero(unpack(self.bits, size))
+
+
+def unpack(bits: np.ndarray, size: int) -> np.ndarray:
+    """Boolean mask over `size` catalog rows from a packed bitset"""
+    return np.unpackbits(bits, count=size).astype(bool)
+
+
+class ExclusionSets:
+    """Named exclusion sets over the rows of one catalog, within a memory budget
+
+    Each set costs N/8 bytes however many games it holds, and applying it is a
+    single unpack into the exclusion mask instead of resolving ids per request.
+    """
+
+    def __init__(self, size: int, max_bytes: int):
+        self.size = size
+        self.max_bytes = max_bytes
+        self._sets: Dict[str, ExclusionSet] = {}
+        self._lock = threading.Lock()
+        # Versions are never reused, even by a set deleted and created again
+        self._next_version = 1
+
+    def __len__(self) -> int:
+        return len(self._sets)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self._sets))
+
+    def get(self, name: str) -> Optional[ExclusionSet]:
+        return self._sets.get(name)
+
+    @property
+    def nbytes(self) -> int:
+        return len(self._sets) * ((self.size + 7) // 8)
+
+    def _store(self, name: str, mask: np.ndarray, check_budget: bool = True) -> ExclusionSet:
+        """Swap in a new version of the set; callers hold the lock"""
+        if check_budget and name not in self._sets and self.nbytes + (self.size + 7) // 8 > self.max_bytes:
+            raise ValueError(f"Exclusion sets are limited to {self.max_bytes} bytes; delete unused sets first")
+        exclusion_set = ExclusionSet(name, self._next_version, np.packbits(mask))
+        self._next_version += 1
+        self._sets[name] = exclusion_set
+        return exclusion_set
+
+    def _mask(self, rows: np.ndarray) -> np.ndarray:
+        mask = np.zeros(self.size, dtype=bool)
+        mask[rows] = True
+        return mask
+
+    def put(self, name: str, rows: np.ndarray) -> ExclusionSet:
+        """Create or replace a set with exactly these rows"""
+        with self._lock:
+            return self._store(name, self._mask(rows))
+
+    def add(self, name: str, rows: np.ndarray) -> ExclusionSet:
+        """Add rows to a set, creating it if needed"""
+        with self._lock:
+            current = self._sets.get(name)
+            mask = self._mask(rows)
+            if current is not None:
+                mask |= unpack(current.bits, self.size)
+            return self._store(name, mask)
+
+    def remove(self, name: str, rows: np.ndarray) -> ExclusionSet:
+        """Remove rows from an existing set"""
+        with self._lock:
+            current = self._sets.get(name)
+            if current is None:
+                raise KeyError(name)
+            mask = unpack(current.bits, self.size)
+            mask[rows] = False
+            return self._store(name, mask)
+
+    def delete(self, name: str) -> bool:
+        with self._lock:
+            return self._sets.pop(name, None) is not None
+
+    def remapped(self, old_ids: np.ndarray, new_index: IdIndex) -> "ExclusionSets":
+        """The same sets over another catalog, matching games by id
+
+        Used when the served model changes, since reloads and item updates can
+        add games or move them to other rows. Games missing from the new catalog
+        are dropped from the sets.
+        """
+        remapped = ExclusionSets(len(new_index), self.max_bytes)
+        with self._lock:
+            remapped._next_version = self._next_version
+            for name, exclusion_set in self._sets.items():
+                rows = new_index.lookup(old_ids[exclusion_set.rows(self.size)])
+                # Sets that exist are kept even if a larger catalog takes them over budget
+                remapped._store(name, remapped._mask(rows[rows >= 0]), check_budget=False)
+        return remapped
@@ -0,0 +1,125 @@
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+GENRE_PREFIX = 'genre_'
+TAG_PREFIX = 'tags_'
+# Raw price column kept by the build step (in cents, as in the Steam export)
+PRICE_COLUMN = 'price'
+# Catalog columns read and packed at once when building from the parquet file
+COLUMN_BLOCK = 64
+
+
+def genre_key(genre: str) -> str:
+    """Column suffix of a genre name, as written by expand_genres_to_columns"""
+    return genre.strip().lower().replace(' ', '_')
+
+
+def tag_key(tag: str) -> str:
+    """Column suffix of a tag name, as written by expand_tags_to_columns"""
+    return tag.strip().lower()
+
+
+class FilterIndex:
+    """Bitmap indexes over the genre_*, tags_* and price columns of the catalog
+
+    Every genre and tag gets one bitmap (np.packbits over the rows having it),
+    so a filter is a few ANDs over N/8 bytes and one unpack into a boolean
+    mask of the rows it allows. The model combines that mask with the
+    exclusion mask before any top-k selection. A game passes when it has every
+    requested genre and every requested tag and its price is within range.
+    """
+
+    def __init__(self, size: int, names: List[str], bitmaps: np.ndarray, prices: Optional[np.ndarray] = None):
+        self.size = size
+        self.bitmaps = bitmaps
+        self.prices = prices
+        self._rows = {name: row for row, name in enumerate(names)}
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> "FilterIndex":
+        columns = [column for column in df.columns if column.startswith((GENRE_PREFIX, TAG_PREFIX))]
+        bitmaps = [_pack(df[columns[start:start + COLUMN_BLOCK]]) for start in range(0, len(columns), COLUMN_BLOCK)]
+        prices = df[PRICE_COLUMN].to_numpy(dtype=np.float64) if PRICE_COLUMN in df.columns else None
+        return cls(len(df), columns, _stack(bitmaps, len(df)), prices)
+
+    @classmethod
+    def from_catalog(cls, catalog_path: str) -> "FilterIndex":
+        """Build from the catalog file, reading only the filterable columns a block at a time"""
+        import pyarrow.parquet as pq
+
+        parquet = pq.ParquetFile(catalog_path)
+        size = parquet.metadata.num_rows
+        names = parquet.schema_arrow.names
+        columns = [column for column in names if column.startswith((GENRE_PREFIX, TAG_PREFIX))]
+        bitmaps = [
+            _pack(parquet.read(columns=columns[start:start + COLUMN_BLOCK]).to_pandas())
+            for start in range(0, len(columns), COLUMN_BLOCK)
+        ]
+        prices = None
+        if PRICE_COLUMN in names:
+            prices = parquet.read(columns=[PRICE_COLUMN]).column(0).to_numpy(zero_copy_only=False).astype(np.float64)
+        return cls(size, columns, _stack(bitmaps, size), prices)
+
+    @property
+    def genres(self) -> List[str]:
+        return [name[len(GENRE_PREFIX):] for name in self._rows if name.startswith(GENRE_PREFIX)]
+
+    @property
+    def tags(self) -> List[str]:
+        return [name[len(TAG_PREFIX):] for name in self._rows if name.startswith(TAG_PREFIX)]
+
+    def _bitmap_rows(self, genres: Optional[Iterable[str]], tags: Optional[Iterable[str]]) -> List[int]:
+        rows = []
+        for kind, prefix, key, names in (('genre', GENRE_PREFIX, genre_key, genres), ('tag', TAG_PREFIX, tag_key, tags)):
+            for name in names or ():
+                row = self._rows.get(prefix + key(name))
+                if row is None:
+                    raise ValueError(f"Unknown {kind} '{name}'")
+                rows.append(row)
+        return rows
+
+    def validate(self, genres: Optional[Iterable[str]] = None, tags: Optional[Iterable[str]] = None,
+                 min_price: Optional[float] = None, max_price: Optional[float] = None):
+        """Raise ValueError for unknown genres or tags, or price bounds the catalog cannot answer"""
+        self._bitmap_rows(genres, tags)
+        if (min_price is not None or max_price is not None) and self.prices is None:
+            raise ValueError("The catalog has no price column; rebuild it with data_processing.build_similarity")
+        if min_price is not None and max_price is not None and min_price > max_price:
+            raise ValueError("'min_price' must not be greater than 'max_price'")
+
+    def mask(self, genres: Optional[Iterable[str]] = None, tags: Optional[Iterable[str]] = None,
+             min_price: Optional[float] = None, max_price: Optional[float] = None) -> Optional[np.ndarray]:
+        """Boolean mask of the rows passing every filter, or None when nothing is filtered"""
+        self.validate(genres, tags, min_price, max_price)
+        allowed = None
+        rows = self._bitmap_rows(genres, tags)
+        if rows:
+            bits = np.bitwise_and.reduce(self.bitmaps[rows], axis=0)
+            allowed = np.unpackbits(bits, count=self.size).astype(bool)
+        if min_price is not None or max_price is not None:
+            # NaN prices fail both comparisons, so unpriced games never pass a price filter
+            in_range = np.ones(self.size, dtype=bool)
+            if min_price is not None:
+                in_range &= self.prices >= min_price
+            if max_price is not None:
+                in_range &= self.prices <= max_price
+            allowed = in_range if allowed is None else allowed & in_range
+        return allowed
+
+    @property
+    def nbytes(self) -> int:
+        return self.bitmaps.nbytes + (self.prices.nbytes if self.prices is not None else 0)
+
+
+def _pack(values: pd.DataFrame) -> np.ndarray:
+    """One packed bitmap per column (as rows) of the cells holding a positive value"""
+    present = values.fillna(0).to_numpy(dtype=np.float64) > 0
+    return np.packbits(present, axis=0).T
+
+
+def _stack(bitmaps: List[np.ndarray], size: int) -> np.ndarray:
+    if not bitmaps:
+        return np.zeros((0, (size + 7) // 8), dtype=np.uint8)
+    return np.ascontiguousarray(np.concatenate(bitmaps))
@@ -0,0 +1,60 @@
+from typing import Iterable, Iterator, Optional
+
+import numpy as np
+
+
+class IdIndex:
+    """Read-only mapping from game id to catalog row, backed by two NumPy arrays
+
+    `ids` holds the ids in row order and `order` the rows sorted by id, so a
+    lookup is a binary search and building the index from a snapshot is just
+    loading two arrays, with no per-row Python work. It supports the dict
+    operations the model uses (`in`, `[]`, `get`, iteration in row order).
+    When an id appears on several rows the last row wins, as with a dict.
+    """
+
+    def __init__(self, ids: np.ndarray, order: Optional[np.ndarray] = None):
+        self.ids = np.asarray(ids).astype(str)
+        self.order = np.argsort(self.ids, kind='stable') if order is None else np.asarray(order)
+        self._sorted = self.ids[self.order]
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.ids.tolist())
+
+    def _position(self, game_id) -> int:
+        """Position in the sorted order of the last row with this id, or -1"""
+        if not isinstance(game_id, str) or not len(self._sorted):
+            return -1
+        position = int(np.searchsorted(self._sorted, game_id, side='right')) - 1
+        return position if position >= 0 and self._sorted[position] == game_id else -1
+
+    def __contains__(self, game_id) -> bool:
+        return self._position(game_id) >= 0
+
+    def __getitem__(self, game_id) -> int:
+        position = self._position(game_id)
+        if position < 0:
+            raise KeyError(game_id)
+        return int(self.order[position])
+
+    def get(self, game_id, default=None):
+        position = self._position(game_id)
+        return int(self.order[position]) if position >= 0 else default
+
+    def lookup(self, game_ids: Iterable[str]) -> np.ndarray:
+        """Rows of many ids at once, -1 for unknown ids"""
+        game_ids = list(game_ids)
+        valid = np.array([isinstance(game_id, str) for game_id in game_ids], dtype=bool)
+        if not valid.any() or not len(self._sorted):
+            return np.full(len(game_ids), -1, dtype=np.int64)
+        keys = np.array([game_id if is_str else '' for game_id, is_str in zip(game_ids, valid)], dtype=str)
+        positions = np.maximum(np.searchsorted(self._sorted, keys, side='right') - 1, 0)
+        found = valid & (self._sorted[positions] == keys)
+        return np.where(found, self.order[positions], -1).astype(np.int64)
+
+    @property
+    def nbytes(self) -> int:
+        return self.ids.nbytes + self.order.nbytes + self._sorted.nbytes
@@ -0,0 +1,59 @@
+from typing import Dict, List, Sequence
+
+import numpy as np
+import pandas as pd
+
+
+class ItemRecords:
+    """Catalog fields returned with detailed recommendations, one array per field
+
+    Only the configured columns are read from the catalog, once, into NumPy
+    arrays (object arrays for text). Describing a recommendation list is then
+    one fancy-index per field over the recommended rows, and the DataFrame is
+    never touched while serving.
+    """
+
+    def __init__(self, columns: Dict[str, np.ndarray]):
+        self.columns = columns
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, fields: Sequence[str]) -> "ItemRecords":
+        return cls({field: _column(df[field]) for field in fields if field in df.columns})
+
+    @classmethod
+    def from_catalog(cls, catalog_path: str, fields: Sequence[str]) -> "ItemRecords":
+        """Read just the configured fields that the catalog has"""
+        import pyarrow.parquet as pq
+
+        names = pq.read_schema(catalog_path).names
+        present = [field for field in fields if field in names]
+        return cls.from_frame(pd.read_parquet(catalog_path, columns=present), present)
+
+    @property
+    def fields(self) -> List[str]:
+        return list(self.columns)
+
+    def records(self, rows: np.ndarray, fields: Sequence[str]) -> List[Dict]:
+        """One dict of the requested fields per row, with missing values as None"""
+        values = [_json_values(self.columns[field][rows]) for field in fields]
+        return [dict(zip(fields, row_values)) for row_values in zip(*values)] if fields else [{} for _ in rows]
+
+    @property
+    def nbytes(self) -> int:
+        return sum(column.nbytes for column in self.columns.values())
+
+
+def _column(values: pd.Series) -> np.ndarray:
+    if pd.api.types.is_bool_dtype(values) or pd.api.types.is_numeric_dtype(values):
+        return values.to_numpy()
+    return values.astype(object).where(values.notna(), None).to_numpy(dtype=object)
+
+
+def _json_values(values: np.ndarray) -> list:
+    """Plain Python values, with NaN (not valid JSON) replaced by None"""
+    if values.dtype.kind == 'f':
+        missing = ~np.isfinite(values)
+        if missing.any():
+            values = values.astype(object)
+            values[missing] = None
+    return values.tolist()
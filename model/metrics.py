@@ -0,0 +1,220 @@
+import bisect
+import contextvars
+import math
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# Latency buckets in seconds, from 50 microseconds (cache hits) to 10 seconds
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Per-request stage timings, only set for requests sampled for the Server-Timing header
+request_timings: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar(
+    'request_timings', default=None
+)
+
+
+class _Metric:
+    """Base class: a named metric family with optional labels, registered on creation"""
+    kind = ''
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key: Tuple[str, ...], extra: str = '') -> str:
+        pairs = [f'{name}="{value}"' for name, value in zip(self.labelnames, key)]
+        if extra:
+            pairs.append(extra)
+        return '{' + ','.join(pairs) + '}' if pairs else ''
+
+    def render(self) -> List[str]:
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}'] + self._samples()
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Monotonic count, optionally per label values"""
+    kind = 'counter'
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set(self, value: float, **labels):
+        """Mirror a count that is kept elsewhere (e.g. by a cache)"""
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            return [f'{self.name}{self._labels(key)} {_format(value)}' for key, value in self._values.items()]
+
+
+class Gauge(Counter):
+    """Value that can go up and down"""
+    kind = 'gauge'
+
+
+class _Timer:
+    """Context manager recording the elapsed time into a histogram"""
+    __slots__ = ('histogram', 'labels', 'start')
+
+    def __init__(self, histogram: "Histogram", labels: Dict[str, str]):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+
+class Histogram(_Metric):
+    """Cumulative bucket counts, sum and count of observed values
+
+    Observing is a bisect and three additions under a lock, cheap enough to
+    time every stage of every request.
+    """
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label values: [count per bucket (+Inf last), sum, count]
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][position] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def time(self, **labels) -> _Timer:
+        return _Timer(self, labels)
+
+    def _samples(self) -> List[str]:
+        lines = []
+        with self._lock:
+            for key, (counts, total, count) in self._values.items():
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                    cumulative += bucket_count
+                    le = '+Inf' if bound == math.inf else _format(bound)
+                    bound_label = f'le="{le}"'
+                    lines.append(f'{self.name}_bucket{self._labels(key, bound_label)} {cumulative}')
+                lines.append(f'{self.name}_sum{self._labels(key)} {_format(total)}')
+                lines.append(f'{self.name}_count{self._labels(key)} {count}')
+        return lines
+
+
+def _format(value: float) -> str:
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+REGISTRY: List[_Metric] = []
+# Called before every scrape to refresh values kept outside the registry
+COLLECTORS: List[Callable[[], None]] = []
+
+
+def _reset_locks():
+    """Give every metric a new lock in a forked child, since a parent thread may have held one"""
+    for metric in REGISTRY:
+        metric._lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_locks)
+
+STAGE_SECONDS = Histogram(
+    'recommendation_stage_seconds', 'Time spent in each stage of serving a recommendation', ('stage',)
+)
+REQUEST_SECONDS = Histogram(
+    'http_request_duration_seconds', 'End-to-end request latency by route', ('path', 'status')
+)
+CACHE_HITS = Counter('recommendation_cache_hits_total', 'Cache lookups that found an entry', ('cache',))
+CACHE_MISSES = Counter('recommendation_cache_misses_total', 'Cache lookups that found nothing', ('cache',))
+CACHE_EVICTIONS = Counter('recommendation_cache_evictions_total', 'Entries evicted to stay within the memory budget', ('cache',))
+CACHE_BYTES = Gauge('recommendation_cache_bytes', 'Estimated memory held by each cache', ('cache',))
+FETCH_MORE = Counter(
+    'recommendation_fetch_more_total', 'Rankings deepened or full rows loaded because exclusions used up the neighbors', ('path',)
+)
+COALESCED_REQUESTS = Counter(
+    'recommendation_coalesced_requests_total', 'Requests that waited on an identical request in flight, by outcome', ('outcome',)
+)
+SHARD_FAILURES = Counter(
+    'recommendation_shard_failures_total', 'Shard calls left out of a result, by shard and reason', ('shard', 'reason')
+)
+INVALID_SEEDS = Counter('recommendation_invalid_seeds_total', 'Requested ids or indices that are not in the catalog', ('kind',))
+MODEL_ITEMS = Gauge('model_items', 'Number of items in the served model')
+MODEL_BYTES = Gauge('model_bytes', 'Memory held by the model arrays, by component', ('component',))
+MODEL_LOAD_SECONDS = Gauge('model_load_seconds', 'Time taken to load the served model')
+EXCLUSION_SETS = Gauge('exclusion_sets', 'Named exclusion sets currently registered')
+EXCLUSION_SET_BYTES = Gauge('exclusion_set_bytes', 'Memory held by the named exclusion set bitsets')
+MODEL_VERSION = Gauge('model_version', 'Version of the served model, bumped by every reload or item update')
+
+
+class _StageTimer(_Timer):
+    """Stage timer that also reports into the request's Server-Timing entries when sampled"""
+    __slots__ = ()
+
+    def __init__(self, name: str):
+        super().__init__(STAGE_SECONDS, {'stage': name})
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.start
+        STAGE_SECONDS.observe(elapsed, **self.labels)
+        timings = request_timings.get()
+        if timings is not None:
+            name = self.labels['stage']
+            timings[name] = timings.get(name, 0.0) + elapsed
+
+
+def stage(name: str) -> _Timer:
+    """Time a stage: `with metrics.stage('merge'): ...`"""
+    return _StageTimer(name)
+
+
+def observe_stage(name: str, seconds: float):
+    """Record a stage duration measured by the caller"""
+    STAGE_SECONDS.observe(seconds, stage=name)
+    timings = request_timings.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + seconds
+
+
+def server_timing(timings: Dict[str, float]) -> str:
+    """Format stage timings as a Server-Timing header value (durations in milliseconds)"""
+    return ', '.join(f'{name};dur={seconds * 1000:.3f}' for name, seconds in timings.items())
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format"""
+    for collect in COLLECTORS:
+        collect()
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
@@ -1,52 +1,259 @@
+import copy
+import os
+import tempfile
+import threading
+import time
+import numpy as np
 import pandas as pd
-from typing import List, Optional, Dict, Set, Union
+import scipy.sparse as sp
+from typing import List, Optional, Dict, Sequence, Set, Union
 from collections import defaultdict
 
+import metrics
+from cache import MISSING, SizedLRUCache
+from exclusion_sets import unpack
+from filter_index import FilterIndex
+from id_index import IdIndex
+from item_records import ItemRecords
+from neighbor_index import NeighborIndex
+from ranking import combine_scores, ranked_row, top_k
+from shards import ShardedBackend
+from similarity_store import SimilarityStore
+from snapshot import CatalogSnapshot
+from sparse_similarity import SparseSimilarity
+from data_processing.build_similarity import build_feature_matrix, load_feature_spec
+
+# Directory holding the catalog and similarity artifacts
+DATA_DIR = os.environ.get('MODEL_DATA_DIR', '../Data')
+CATALOG_FILE = 'processed_games.parquet'
+# Id index and popularity written by the build step, so startup never reads the catalog frame
+SNAPSHOT_FILE = 'games_snapshot.npz'
+SIMILARITY_PARQUET_FILE = 'games_similarity_matrix.parquet'
+# Number of precomputed neighbors kept per game
+NEIGHBOR_COUNT = 100
+NEIGHBOR_INDEX_FILE = 'games_neighbors.npz'
+# Memory-mapped similarity store, preferred over the parquet matrix when present
+SIMILARITY_STORE_FILE = 'games_similarity_matrix.sim'
+# Weighted sparse feature matrix written by data_processing.build_similarity
+FEATURES_FILE = 'games_features.npz'
+FEATURE_SPEC_FILE = 'games_features.json'
+# 'dense' serves from the N x N similarity matrix, 'sparse' from the feature matrix and
+# 'sharded' from shard processes each holding a part of the catalog
+BACKENDS = ('dense', 'sparse', 'sharded')
+DEFAULT_BACKEND = os.environ.get('MODEL_BACKEND', 'dense')
+# Shard servers of the sharded backend ('host:port,...' in shard order, see shards.py);
+# when unset, MODEL_SHARD_COUNT local shard processes are forked from the data directory
+SHARD_ADDRESSES = os.environ.get('MODEL_SHARDS', '')
+SHARD_COUNT = int(os.environ.get('MODEL_SHARD_COUNT', 2))
+# What local shards hold: 'sparse' (feature vectors) or 'dense' (similarity store columns)
+SHARD_STORAGE = os.environ.get('MODEL_SHARD_STORAGE', 'sparse')
+# Seconds a call waits for the shards; slower or missing shards are left out of the result
+SHARD_TIMEOUT = float(os.environ.get('MODEL_SHARD_TIMEOUT', 2.0))
+# Secret shared with shard servers started by hand (required with MODEL_SHARDS)
+SHARD_AUTHKEY = os.environ.get('MODEL_SHARD_AUTHKEY')
+# How the rankings of several seed items are combined
+AGGREGATIONS = ('round_robin', 'mean', 'max', 'weighted')
+# Number of full similarity rows ranked together by the batch fallback path
+BATCH_ROW_BLOCK = 64
+# Memory budget for per-seed rankings kept beyond the neighbor index
+RANKING_CACHE_BYTES = int(float(os.environ.get('MODEL_RANKING_CACHE_MB', 64)) * 2 ** 20)
+# Smallest ranking depth computed when a seed's row has to be ranked
+RANKING_MIN_DEPTH = 64
+# Candidates re-ranked by the diversity mode: this many per requested recommendation,
+# and at least DIVERSITY_MIN_POOL
+DIVERSITY_POOL_FACTOR = 5
+DIVERSITY_MIN_POOL = 50
+# Catalog columns that detailed responses can return with each recommendation
+RECORD_FIELDS = [field.strip() for field in os.environ.get(
+    'MODEL_RECORD_FIELDS', 'name,price,ccu,review_ratio,discount_percentage').split(',') if field.strip()]
+
 # Model class to encapsulate the recommendation logic
 class RecommendationModel:
-    def __init__(self):
+    def __init__(self, backend: Optional[str] = None, data_dir: Optional[str] = None):
+        started = time.perf_counter()
+        self.backend = backend or DEFAULT_BACKEND
+        self.data_dir = data_dir or DATA_DIR
+        if self.backend not in BACKENDS:
+            raise ValueError(f"Unknown backend '{self.backend}', expected one of {BACKENDS}")
+        
+        # The full catalog frame is only needed by item updates, so it is read on first use
+        self._df = None
+        self._df_lock = threading.Lock()
+        # Index mapping game IDs to dataframe indices, plus per-game popularity for warm-up
+        snapshot = self._load_snapshot()
+        self.id_to_index = snapshot.id_index
+        self.popularity = snapshot.popularity
+        self.size = len(self.id_to_index)
+        # Genre, tag and price bitmaps for filtered queries
+        self.filter_index = FilterIndex.from_catalog(self._data_path(CATALOG_FILE))
+        if self.filter_index.size != self.size:
+            raise ValueError(f"Catalog has {self.filter_index.size} rows but the id index has {self.size}")
+        # Per-item fields for detailed responses, so serving never reads the catalog frame
+        self.records = ItemRecords.from_catalog(self._data_path(CATALOG_FILE), RECORD_FIELDS)
+        
         # Load your data and model here
-        self.df = self._load_dataframe()
-        self.similarity_matrix = self._load_similarity_matrix()
-        # Create an index mapping game IDs to dataframe indices for faster lookups
-        self._create_id_index()
-        print("Model loaded successfully!")
+        if self.backend == 'sparse':
+            # Similarities are computed from feature vectors per request, nothing N x N is loaded
+            self.similarity_matrix = self._load_sparse_similarity()
+            self.neighbor_index = None
+        elif self.backend == 'sharded':
+            # Shards rank their own rows and only their top k come back, so nothing is held here
+            self.similarity_matrix = self._load_sharded_similarity()
+            self.neighbor_index = None
+        else:
+            self.similarity_matrix = self._load_similarity_matrix()
+        if self.backend == 'dense':
+            # Ranked neighbors are fixed for a given matrix, so rank each row once up front
+            self.neighbor_index = self._load_neighbor_index()
+        # Per-seed rankings, reused across requests whatever their exclusions
+        self.ranking_cache = SizedLRUCache(RANKING_CACHE_BYTES)
+        # Feature matrix and spec for incremental updates, loaded on first use
+        self._features = None
+        self._feature_spec = None
+        self.load_seconds = time.perf_counter() - started
+        print(f"Model loaded successfully! ({self.backend} backend)")
         
+    def _data_path(self, file_name: str) -> str:
+        return os.path.join(self.data_dir, file_name)
+    
+    @property
+    def df(self) -> pd.DataFrame:
+        """Full catalog frame, read from disk the first time it is needed"""
+        if self._df is None:
+            with self._df_lock:
+                if self._df is None:
+                    self._df = self._load_dataframe()
+        return self._df
+    
+    @df.setter
+    def df(self, df: pd.DataFrame):
+        self._df = df
+    
     def _load_dataframe(self):
-        processed_games_df = pd.read_parquet('../Data/processed_games.parquet')
+        processed_games_df = pd.read_parquet(self._data_path(CATALOG_FILE))
         return processed_games_df
     
-    def _load_similarity_matrix(self):
-        similarity_df = pd.read_parquet('../Data/games_similarity_matrix.parquet')
-        return similarity_df
+    def _load_snapshot(self) -> CatalogSnapshot:
+        """Use the snapshot written by the build step, or read just the id and popularity columns"""
+        catalog_path = self._data_path(CATALOG_FILE)
+        snapshot = CatalogSnapshot.load(self._data_path(SNAPSHOT_FILE), catalog_path)
+        return snapshot if snapshot is not None else CatalogSnapshot.from_catalog(catalog_path)
+    
+    def _load_similarity_matrix(self) -> SimilarityStore:
+        store_path = self._data_path(SIMILARITY_STORE_FILE)
+        if os.path.exists(store_path):
+            # Mapped read-only, so every worker process shares the same pages
+            store = SimilarityStore.open(store_path)
+            if len(store) != self.size:
+                raise ValueError(f"Similarity store has {len(store)} rows but the catalog has {self.size} games")
+            return store
+        similarity_df = pd.read_parquet(self._data_path(SIMILARITY_PARQUET_FILE))
+        return SimilarityStore.from_array(similarity_df.to_numpy(dtype=np.float64), similarity_df.index)
+    
+    def _load_sparse_similarity(self) -> SparseSimilarity:
+        similarity = SparseSimilarity.load(self._data_path(FEATURES_FILE))
+        if len(similarity) != self.size:
+            raise ValueError(f"Feature matrix has {len(similarity)} rows but the catalog has {self.size} games")
+        return similarity
+    
+    def _load_sharded_similarity(self) -> ShardedBackend:
+        if SHARD_ADDRESSES:
+            similarity = ShardedBackend.connect(SHARD_ADDRESSES, SHARD_AUTHKEY, SHARD_TIMEOUT)
+        else:
+            path = self._data_path(FEATURES_FILE if SHARD_STORAGE == 'sparse' else SIMILARITY_STORE_FILE)
+            similarity = ShardedBackend.start_local(path, SHARD_COUNT, SHARD_TIMEOUT)
+        if len(similarity) != self.size:
+            raise ValueError(f"Shards hold {len(similarity)} rows but the catalog has {self.size} games")
+        return similarity
+    
+    def _load_neighbor_index(self) -> NeighborIndex:
+        """Use the neighbor index shipped with the matrix if it fits, otherwise build it
+        
+        The shipped index must have been ranked from the served matrix at the
+        served precision (same fingerprint): one ranked from the float64 parquet
+        next to a float32 store orders near-ties differently from the store's own
+        rankings, which the fallback paths use.
+        """
+        size = self.similarity_matrix.shape[0]
+        wanted_k = min(NEIGHBOR_COUNT, size - 1)
+        index_path = self._data_path(NEIGHBOR_INDEX_FILE)
+        if os.path.exists(index_path):
+            index = NeighborIndex.load(index_path)
+            if index.size != size or index.k < wanted_k:
+                print(f"Ignoring stale neighbor index at {index_path}")
+            elif index.source != NeighborIndex.fingerprint(self.similarity_matrix):
+                print(f"Ignoring neighbor index at {index_path}: it was not ranked from the served similarity matrix")
+            else:
+                return index
+        return NeighborIndex.build(self.similarity_matrix, wanted_k)
     
     def _create_id_index(self):
-        """Create a dictionary mapping game IDs to dataframe indices for O(1) lookups"""
-        self.id_to_index: Dict[str, int] = {}
-        # Check what columns are available in the dataframe
-        id_column = self.df.index if 'id' not in self.df.columns else self.df['id']
-        for idx, game_id in enumerate(id_column):
-            self.id_to_index[str(game_id)] = idx
+        """Rebuild the id index and popularity from the catalog frame (after item updates)"""
+        snapshot = CatalogSnapshot.from_frame(self.df)
+        self.id_to_index = snapshot.id_index
+        self.popularity = snapshot.popularity
+        self.size = len(self.id_to_index)
 
     
     def get_indices_from_ids(self, ids: List[str]) -> Set[int]:
         """Convert a list of game IDs to a set of dataframe indices using the index"""
-        indices = set()
-        for game_id in ids:
-            if game_id in self.id_to_index:
-                indices.add(self.id_to_index[game_id])
-        return indices
+        indices = self.id_to_index.lookup(ids)
+        return set(indices[indices >= 0].tolist())
     
-    def predict_by_id(self, id_values: Union[str, List[str]], n: int = 5, excluded_ids: List[str] = None) -> list:
+    def memory_usage(self) -> Dict[str, int]:
+        """Bytes held by the model's main arrays, per component"""
+        if self.backend == 'sparse':
+            features = self.similarity_matrix.features
+            similarity = features.data.nbytes + features.indices.nbytes + features.indptr.nbytes
+        elif self.backend == 'sharded':
+            # Held by the shard processes
+            similarity = 0
+        else:
+            similarity = self.similarity_matrix.data.nbytes
+        usage = {
+            'id_index': self.id_to_index.nbytes + self.popularity.nbytes,
+            'similarity': int(similarity),
+            'filter_index': self.filter_index.nbytes,
+            'records': self.records.nbytes,
+        }
+        if self._df is not None:
+            usage['dataframe'] = int(self._df.memory_usage(index=True).sum())
+        if self.neighbor_index is not None:
+            usage['neighbor_index'] = self.neighbor_index.ids.nbytes + self.neighbor_index.scores.nbytes
+        return usage
+    
+    def warm_up(self, count: int) -> List[int]:
+        """Rank the `count` most popular seeds before serving traffic
+        
+        Fills the ranking cache for them and pulls their similarity rows into
+        memory, so the first requests for popular games are not the slow ones.
+        
+        Returns:
+            The warmed seed indices
+        """
+        seeds = np.argsort(-self.popularity, kind='stable')[:max(count, 0)].tolist()
+        for seed in seeds:
+            self.ranked_neighbors(seed, RANKING_MIN_DEPTH)
+        return seeds
+    
+    def predict_by_id(self, id_values: Union[str, List[str]], n: int = 5, excluded_ids: List[str] = None,
+                      aggregate: str = 'round_robin', weights: Optional[List[float]] = None,
+                      filters: Optional[Dict] = None, exclusion_set: Optional[np.ndarray] = None,
+                      diversity: Optional[float] = None) -> list:
         """Get recommendation indices for item(s) by ID(s)
         
         Args:
             id_values: Single ID string or list of ID strings
             n: Total number of recommendations to return
             excluded_ids: List of IDs to exclude from recommendations
+            aggregate: How to combine several items, see predict_by_index
+            weights: Per-item weights for the 'weighted' aggregation
+            filters: Attribute filters, see predict_by_index
+            exclusion_set: Packed bitset of catalog rows to exclude, see predict_by_index
+            diversity: Relevance/diversity trade-off, see predict_by_index
             
         Returns:
-            List of recommendation indices in round-robin order from all input items
+            List of recommendation indices from all input items
         """
         try:
             # Handle single ID case for backward compatibility
@@ -54,135 +261,713 @@ class RecommendationModel:
                 id_values = [id_values]
             
             # Convert IDs to indices, filtering out invalid ones
-            valid_indices = []
-            for id_value in id_values:
-                if id_value in self.id_to_index:
-                    valid_indices.append(self.id_to_index[id_value])
-                else:
-                    print(f"Item with ID {id_value} not found in the database.")
+            valid_indices, valid_weights = self._resolve_ids(id_values, weights)
             
             if not valid_indices:
                 print("No valid IDs found in the database.")
                 return []
             
             # Use the index-based method
-            return self.predict_by_index(valid_indices, n, excluded_ids)
+            return self.predict_by_index(valid_indices, n, excluded_ids, aggregate, valid_weights, filters, exclusion_set,
+                                         diversity)
             
         except Exception as e:
             print(f"Error in predict_by_id: {str(e)}")
             return []
     
-    def predict_by_index(self, indices: Union[int, List[int]], n: int = 5, excluded_ids: List[str] = None) -> list:
-        """Get recommendation indices by dataframe index(es) in round-robin order
+    def _resolve_ids(self, id_values: List[str], weights: Optional[List[float]]):
+        """Indices of the known ids, with their weights (None when no weights were given)"""
+        valid_indices = []
+        valid_weights = []
+        with metrics.stage('id_resolution'):
+            for position, id_value in enumerate(id_values):
+                idx = self.id_to_index.get(id_value)
+                if idx is not None:
+                    valid_indices.append(idx)
+                    if weights is not None:
+                        valid_weights.append(weights[position])
+                else:
+                    metrics.INVALID_SEEDS.inc(kind='id')
+                    print(f"Item with ID {id_value} not found in the database.")
+        return valid_indices, valid_weights if weights is not None else None
+    
+    def predict_by_index(self, indices: Union[int, List[int]], n: int = 5, excluded_ids: List[str] = None,
+                         aggregate: str = 'round_robin', weights: Optional[List[float]] = None,
+                         filters: Optional[Dict] = None, exclusion_set: Optional[np.ndarray] = None,
+                         diversity: Optional[float] = None) -> list:
+        """Get recommendation indices by dataframe index(es)
         
         Args:
             indices: Single index or list of indices
             n: Total number of recommendations to return
             excluded_ids: List of IDs to exclude from recommendations
+            aggregate: 'round_robin' interleaves each item's own ranking (default);
+                'mean', 'max' and 'weighted' rank once by a combined score over all items
+            weights: Per-item weights for 'weighted' (defaults to 1 for every item)
+            filters: Only recommend games passing these filters: 'genres' and 'tags'
+                (lists the game must all have) and 'min_price'/'max_price' (in cents)
+            exclusion_set: Packed bitset (np.packbits) of catalog rows to exclude, such
+                as a registered library; applied together with excluded_ids
+            diversity: Between 0 and 1; re-rank a larger candidate pool so games
+                unlike those already picked move up, see diversify (0 or None
+                leaves the ranking unchanged)
             
         Returns:
-            List of recommendation indices in round-robin order from all input items
+            List of recommendation indices from all input items
         """
         try:
             # Handle single index case for backward compatibility
             if isinstance(indices, int):
                 indices = [indices]
             
+            if aggregate not in AGGREGATIONS:
+                print(f"Unknown aggregation '{aggregate}'.")
+                return []
+            if weights is not None and len(weights) != len(indices):
+                print("Weights must match the number of items.")
+                return []
+            
             # Validate indices
             valid_indices = []
-            for idx in indices:
-                if 0 <= idx < len(self.df):
+            valid_weights = []
+            for position, idx in enumerate(indices):
+                if 0 <= idx < self.size:
                     valid_indices.append(idx)
+                    valid_weights.append(weights[position] if weights is not None else 1.0)
                 else:
+                    metrics.INVALID_SEEDS.inc(kind='index')
                     print(f"Index {idx} out of range.")
             
             if not valid_indices:
                 print("No valid indices provided.")
                 return []
             
-            # Calculate how many candidates we need based on exclusion list size
-            exclude_size = 0 if not excluded_ids else len(excluded_ids)
+            exclude_mask, allowed = self._query_mask(valid_indices, excluded_ids, filters, exclusion_set)
+            # The diversity mode picks n games out of a larger pool of the best candidates
+            pool_size = self.diversity_pool(n) if diversity else n
+            
+            # Combined scoring ranks every item in a single pass
+            if aggregate != 'round_robin':
+                with metrics.stage('row_selection'):
+                    result = self._get_aggregate_recommendations(
+                        valid_indices, valid_weights, aggregate, pool_size, exclude_mask
+                    )
+            else:
+                # Get recommendations for each index
+                recommendations_per_index = {}
+                
+                with metrics.stage('row_selection'):
+                    for idx in valid_indices:
+                        recommendations_per_index[idx] = self._get_single_index_recommendations(
+                            idx, pool_size, exclude_mask, allowed is not None
+                        )
+                
+                # Round-robin merge the recommendations
+                with metrics.stage('merge'):
+                    result = self._round_robin_merge(recommendations_per_index, pool_size)
+            
+            if diversity:
+                result = self.diversify(result, valid_indices, valid_weights, aggregate, n, diversity)
+            return result
             
+        except Exception as e:
+            print(f"Error in predict_by_index: {str(e)}")
+            return []
+    
+    def predict_for_user(self, scores: np.ndarray, owned: np.ndarray, n: int = 5, excluded_ids: List[str] = None,
+                         filters: Optional[Dict] = None, exclusion_set: Optional[np.ndarray] = None) -> list:
+        """Get recommendation indices from a user's profile score vector
+        
+        Args:
+            scores: Score of every catalog row for the user, see user_profiles.UserProfile
+            owned: Rows of the user's games, which are never recommended
+            n: Total number of recommendations to return
+            excluded_ids: List of IDs to exclude from recommendations
+            filters: Attribute filters, see predict_by_index
+            exclusion_set: Packed bitset of catalog rows to exclude, see predict_by_index
+        
+        Returns:
+            List of recommendation indices, best first
+        """
+        try:
+            if len(scores) != self.size:
+                print("The profile does not match the catalog.")
+                return []
+            exclude_mask, _ = self._query_mask(owned.tolist(), excluded_ids, filters, exclusion_set)
+            # One top-k over the cached vector, whatever the number of owned games
+            with metrics.stage('row_selection'):
+                scores = scores.astype(np.float64)
+                scores[exclude_mask] = -np.inf
+                return ranked_row(scores, n).tolist()
+        
+        except Exception as e:
+            print(f"Error in predict_for_user: {str(e)}")
+            return []
+        
+    def predict_page(self, seeds: List, n: int = 5, excluded_ids: List[str] = None,
+                     aggregate: str = 'round_robin', weights: Optional[List[float]] = None,
+                     filters: Optional[Dict] = None, exclusion_set: Optional[np.ndarray] = None,
+                     by: str = 'index', offsets: Optional[List[int]] = None, turn: int = 0):
+        """Get the next page of recommendations, resuming where the previous page stopped
+        
+        Pages walk the same rankings as predict_by_index, so consecutive pages
+        concatenate to what one call with their total n returns. Every page of
+        a seed comes from its cached ranking of the similarity store, never from
+        the neighbor index, so the order pages are cut from and the scores that
+        recognise games already shown have a single source however deep the
+        pages go. Instead of ranking to the new depth again, every page resumes
+        each seed's cached ranking (or the cached combined ranking) at its
+        offset, and the round-robin merge at the seed whose turn it was, so a
+        page costs O(n) however deep it is. A game already shown by another seed is recognised
+        by comparing its score with the last game that seed consumed, so the
+        state stays one offset per seed instead of every game shown so far.
+        Exclusions and filters apply to each page and may change between pages.
+        
+        Args:
+            seeds: Seed ids (by='id') or indices (by='index'); unknown ones are ignored
+            n: Page size
+            excluded_ids, aggregate, weights, filters, exclusion_set: See predict_by_index
+            offsets: Position in each ranking returned with the previous page, None for the first page
+            turn: Round-robin position returned with the previous page
+            
+        Returns:
+            (recommendation indices, offsets, turn); offsets is None once every
+            ranking is exhausted
+            
+        Raises:
+            ValueError: The offsets or turn do not fit this query's rankings
+        """
+        try:
+            if by == 'id':
+                seeds, weights = self._resolve_ids(seeds, weights)
+            else:
+                in_range = [position for position, seed in enumerate(seeds) if 0 <= seed < self.size]
+                if weights is not None:
+                    weights = [weights[position] for position in in_range]
+                seeds = [seeds[position] for position in in_range]
+            if not seeds or aggregate not in AGGREGATIONS:
+                return [], None, 0
+            
+            exclude_mask, _ = self._query_mask(seeds, excluded_ids, filters, exclusion_set)
+            with metrics.stage('row_selection'):
+                if aggregate == 'round_robin':
+                    streams = list(dict.fromkeys(seeds))
+                    rankings = [lambda depth, seed=seed: self.ranked_neighbors(seed, max(depth, RANKING_MIN_DEPTH))
+                                for seed in streams]
+                else:
+                    seed_weights = weights if weights is not None else [1.0] * len(seeds)
+                    streams = [None]
+                    rankings = [lambda depth: self.ranked_combination(seeds, seed_weights, aggregate, depth)]
+                
+                offsets = list(offsets) if offsets is not None else [0] * len(rankings)
+                if len(offsets) != len(rankings) or not 0 <= turn < len(rankings) or min(offsets) < 0:
+                    raise ValueError("The cursor does not belong to this query")
+                return self._page(streams, rankings, n, exclude_mask, offsets, turn)
+            
+        except ValueError:
+            raise
+        except Exception as e:
+            print(f"Error in predict_page: {str(e)}")
+            return [], None, 0
+    
+    def _page(self, seeds: List[Optional[int]], rankings: List, n: int, exclude_mask: np.ndarray,
+              offsets: List[int], turn: int):
+        """Round-robin over the rankings from the given offsets until n new games are found
+        
+        With a single ranking (one seed, or a combined one) this is just the next
+        n games that are not excluded.
+        """
+        count = len(rankings)
+        # Unconsumed (ranking position, game, scores for every seed) per ranking
+        pending = [[] for _ in range(count)]
+        # Per seed: the last game it consumed and that game's score. Everything ranked
+        # above it was consumed too, which is how games shown by that seed are recognised
+        lasts = [None] * count
+        thresholds = [None] * count
+        started = [position for position in range(count) if offsets[position] > 0] if count > 1 else []
+        for position in started:
+            ranked, _ = rankings[position](offsets[position])
+            if offsets[position] > len(ranked):
+                raise ValueError("The cursor does not belong to this query")
+            lasts[position] = int(ranked[offsets[position] - 1])
+        if started:
+            last_scores = self.similarity_matrix.scores(np.array([seeds[position] for position in started]),
+                                                        np.array([lasts[position] for position in started]))
+            for row, position in enumerate(started):
+                thresholds[position] = last_scores[row, row]
+        
+        result = []
+        exhausted = [False] * count
+        while len(result) < n and not all(exhausted):
+            position = turn
+            turn = (turn + 1) % count
+            if exhausted[position]:
+                continue
+            if not pending[position]:
+                pending[position] = self._window(rankings[position], offsets[position], n - len(result),
+                                                 exclude_mask, seeds if count > 1 else None)
+                if not pending[position]:
+                    exhausted[position] = True
+                    continue
+            rank, game, game_scores = pending[position].pop(0)
+            offsets[position] = rank + 1
+            shown = any(
+                thresholds[other] is not None and other != position
+                and (game_scores[other] > thresholds[other]
+                     or (game_scores[other] == thresholds[other] and game <= lasts[other]))
+                for other in range(count)
+            )
+            if not shown:
+                result.append(game)
+            if count > 1:
+                lasts[position], thresholds[position] = game, game_scores[position]
+        
+        if all(exhausted):
+            return result, None, 0
+        return result, offsets, turn
+    
+    def _window(self, ranking, offset: int, count: int, exclude_mask: np.ndarray,
+                seeds: Optional[List[int]]) -> List[tuple]:
+        """The next `count` games of a ranking that are not excluded, with their scores for every seed"""
+        depth = offset + count
+        while True:
+            ranked, complete = ranking(depth)
+            positions = offset + np.flatnonzero(~exclude_mask[ranked[offset:]])
+            if len(positions) >= count or complete:
+                break
+            depth *= 2
+        positions = positions[:count]
+        games = ranked[positions].astype(np.int64)
+        if seeds is None or not len(games):
+            scores = [None] * len(games)
+        else:
+            scores = self.similarity_matrix.scores(np.array(seeds), games).T.tolist()
+        return list(zip(positions.tolist(), games.tolist(), scores))
+    
+    def describe(self, recommendations: List[int], seeds: List, fields: Sequence[str], by: str = 'index',
+                 aggregate: str = 'round_robin', weights: Optional[List[float]] = None) -> List[dict]:
+        """Index, id, similarity score and catalog fields of each recommendation
+        
+        Args:
+            recommendations: Indices returned by a predict method
+            seeds: The query's seed ids (by='id') or indices (by='index'); unknown
+                seeds are ignored as they are by the predict methods
+            fields: Names from `self.records.fields` to include
+            aggregate: The query's aggregation; the score is the mean, max or
+                weighted similarity to the seeds, and the highest similarity to
+                any seed for round-robin
+            weights: Per-seed weights for 'weighted'
+            
+        Returns:
+            One dict per recommendation, in the same order
+        """
+        with metrics.stage('describe'):
+            rows = np.asarray(recommendations, dtype=np.int64)
+            if by == 'id':
+                seed_rows = self.id_to_index.lookup(seeds)
+            else:
+                seed_rows = np.array([seed if isinstance(seed, int) else -1 for seed in seeds], dtype=np.int64)
+            valid = (seed_rows >= 0) & (seed_rows < self.size)
+            
+            scores = np.full(len(rows), np.nan)
+            if len(rows) and valid.any():
+                seed_weights = np.asarray(weights, dtype=np.float64)[valid] if weights is not None else None
+                scores = self._relevance(self.similarity_matrix.scores(seed_rows[valid], rows), aggregate, seed_weights)
+            scores = [float(score) if np.isfinite(score) else None for score in scores]
+            
+            ids = self.id_to_index.ids[rows].tolist()
+            records = self.records.records(rows, fields)
+            return [
+                {'index': index, 'id': game_id, 'score': score, **record}
+                for index, game_id, score, record in zip(rows.tolist(), ids, scores, records)
+            ]
+    
+    @staticmethod
+    def _relevance(similarities: np.ndarray, aggregate: str, weights: Optional[Sequence[float]]) -> np.ndarray:
+        """Score of each candidate for the query, from its similarities to the seeds (seeds x candidates)
+        
+        The mean, max or weighted similarity for those aggregations, and the
+        highest similarity to any seed for round-robin.
+        """
+        if aggregate == 'mean':
+            return similarities.mean(axis=0)
+        if aggregate == 'weighted':
+            return similarities.sum(axis=0) if weights is None else np.asarray(weights, dtype=np.float64) @ similarities
+        return similarities.max(axis=0)
+    
+    @staticmethod
+    def diversity_pool(n: int) -> int:
+        """Number of candidates the diversity mode chooses n recommendations from"""
+        return max(n * DIVERSITY_POOL_FACTOR, DIVERSITY_MIN_POOL)
+    
+    def diversify(self, candidates: List[int], seeds: List[int], weights: Optional[List[float]], aggregate: str,
+                  n: int, diversity: float) -> List[int]:
+        """Pick n of the candidates by maximal marginal relevance
+        
+        Each pick maximizes (1 - diversity) * relevance - diversity * (highest
+        similarity to the games already picked), where relevance is the score
+        describe reports for the query. Only the seeds-and-candidates by
+        candidates block of the similarity matrix is read, and every step is
+        one vectorized update over the pool, so the cost depends on the number
+        of candidates and not on the catalog size.
+        
+        Args:
+            candidates: Ranked candidate indices, e.g. from predict_by_index with a larger n
+            seeds: Seed indices of the query
+            weights: Per-seed weights for 'weighted'
+            aggregate: The query's aggregation, which decides the relevance
+            n: Number of recommendations to pick
+            diversity: 0 ranks by relevance only, 1 by dissimilarity only
+            
+        Returns:
+            The picked indices in pick order
+        """
+        with metrics.stage('diversify'):
+            pool = np.asarray(candidates, dtype=np.int64)
+            if not len(pool) or n <= 0:
+                return []
+            # One read for the seed rows and the candidate-to-candidate block
+            similarities = np.nan_to_num(self.similarity_matrix.scores(np.concatenate([seeds, pool]), pool), nan=0.0)
+            relevance = self._relevance(similarities[:len(seeds)], aggregate, weights)
+            block = similarities[len(seeds):]
+            
+            picked = []
+            available = np.ones(len(pool), dtype=bool)
+            # Highest similarity of each candidate to the picked games (nothing picked yet)
+            redundancy = np.zeros(len(pool))
+            for step in range(min(n, len(pool))):
+                gain = (1 - diversity) * relevance - diversity * redundancy
+                gain[~available] = -np.inf
+                pick = int(np.argmax(gain))
+                picked.append(pick)
+                available[pick] = False
+                redundancy = block[pick] if step == 0 else np.maximum(redundancy, block[pick])
+            return pool[picked].tolist()
+    
+    def _exclusion_mask(self, exclude_indices: Set[int]) -> np.ndarray:
+        """Boolean mask over catalog rows that is True for every excluded row"""
+        mask = np.zeros(self.similarity_matrix.shape[0], dtype=bool)
+        if exclude_indices:
+            mask[np.fromiter(exclude_indices, dtype=np.int64, count=len(exclude_indices))] = True
+        return mask
+    
+    def _query_mask(self, seeds: List[int], excluded_ids: Optional[List[str]], filters: Optional[Dict],
+                    exclusion_set: Optional[np.ndarray]):
+        """Mask of every row a query must not return, and its filter mask (None when unfiltered)"""
+        with metrics.stage('exclusion_mask'):
             # Convert excluded_ids to indices using our fast lookup index
             exclude_indices = self.get_indices_from_ids(excluded_ids) if excluded_ids else set()
             
             # Add the query indices themselves to the exclusion set
-            exclude_indices.update(valid_indices)
+            exclude_indices.update(seeds)
+            exclude_mask = self._exclusion_mask(exclude_indices)
+            if exclusion_set is not None:
+                exclude_mask |= unpack(exclusion_set, self.size)
             
-            # Get recommendations for each index
-            recommendations_per_index = {}
-            
-            for idx in valid_indices:
-                recommendations_per_index[idx] = self._get_single_index_recommendations(
-                    idx, n, exclude_indices
-                )
+            # Filtered-out games are excluded like any other, before top-k selection
+            allowed = self.filter_mask(filters)
+            if allowed is not None:
+                exclude_mask |= ~allowed
+        return exclude_mask, allowed
+    
+    def filter_mask(self, filters: Optional[Dict]) -> Optional[np.ndarray]:
+        """Rows allowed by the attribute filters, or None when the query has none"""
+        if not filters:
+            return None
+        with metrics.stage('filter_mask'):
+            return self.filter_index.mask(filters.get('genres'), filters.get('tags'),
+                                          filters.get('min_price'), filters.get('max_price'))
+    
+    def _get_single_index_recommendations(self, index: int, n: int, exclude_mask: np.ndarray,
+                                          filtered: bool = False) -> List[int]:
+        """Get recommendations for a single index from the precomputed neighbor list
+        
+        Falls back to a deeper ranking of the seed's full similarity row only when
+        the exclusions use up the precomputed neighbors. The sparse backend has
+        no neighbor index and always uses the deeper ranking. A filtered query
+        that gets there ranks the row once with the mask applied instead, since
+        a selective filter would otherwise deepen the ranking many times.
+        """
+        try:
+            if self.neighbor_index is not None:
+                neighbors = self.neighbor_index.neighbors(index)
+                neighbors = neighbors[~exclude_mask[neighbors]]
+                if len(neighbors) >= n or self.neighbor_index.is_complete:
+                    return neighbors[:n].tolist()
             
-            # Round-robin merge the recommendations
-            result = self._round_robin_merge(recommendations_per_index, n)
+            if filtered:
+                metrics.FETCH_MORE.inc(path='filtered')
+                return self.similarity_matrix.top_k(index, n, exclude_mask).tolist()
             
-            return result
+            # Not enough precomputed neighbors survived the exclusions (or there is no
+            # index): filter a deeper cached ranking, deepening it only when needed
+            depth = max(2 * n, RANKING_MIN_DEPTH)
+            if self.neighbor_index is not None:
+                depth = max(depth, 2 * self.neighbor_index.k)
+            while True:
+                metrics.FETCH_MORE.inc(path='single')
+                ranked, complete = self.ranked_neighbors(index, depth)
+                ranked = ranked[~exclude_mask[ranked]]
+                if len(ranked) >= n or complete:
+                    return ranked[:n].tolist()
+                depth *= 2
             
         except Exception as e:
-            print(f"Error in predict_by_index: {str(e)}")
+            print(f"Error in _get_single_index_recommendations: {str(e)}")
             return []
     
-    def _get_single_index_recommendations(self, index: int, n: int, exclude_indices: Set[int]) -> List[int]:
-        """Get recommendations for a single index, optimized for performance"""
+    def ranked_neighbors(self, index: int, depth: int):
+        """The seed's ranking (only itself excluded) at least `depth` deep
+        
+        Rankings are cached per seed and shared by every request for that seed;
+        exclusions are applied by the caller on top of them.
+        
+        Returns:
+            (ranked indices, complete) where complete means the ranking covers
+            every other item, so going deeper cannot add anything
+        """
+        cached = self.ranking_cache.get(index)
+        if cached is not MISSING:
+            ranked, complete = cached
+            if len(ranked) >= depth or complete:
+                return cached
+            depth = max(depth, 2 * len(ranked))
+        
+        failures = self.backend_failures
+        ranked = self.similarity_matrix.top_k(index, depth).astype(np.int32)
+        cached = (ranked, len(ranked) < depth)
+        if self.backend_failures == failures:
+            # A ranking missing a shard's rows is used once but not kept
+            self.ranking_cache.put(index, cached)
+        return cached
+    
+    @property
+    def backend_failures(self) -> int:
+        """Shard calls left out of results so far (sharded backend), to avoid caching partial results"""
+        return getattr(self.similarity_matrix, 'failures', 0)
+    
+    def ranked_combination(self, indices: List[int], weights: List[float], aggregate: str, depth: int):
+        """The combined ranking of several seeds at least `depth` deep, cached like ranked_neighbors"""
+        key = (aggregate, tuple(indices), tuple(weights))
+        cached = self.ranking_cache.get(key)
+        if cached is not MISSING:
+            ranked, complete = cached
+            if len(ranked) >= depth or complete:
+                return cached
+            depth = max(depth, 2 * len(ranked))
+        depth = max(depth, RANKING_MIN_DEPTH)
+        
+        failures = self.backend_failures
+        if self.backend == 'sharded':
+            ranked = self.similarity_matrix.combined_top_k(indices, weights, aggregate, depth,
+                                                           self._exclusion_mask(set(indices))).astype(np.int32)
+        else:
+            scores = self._combined_scores(indices, weights, aggregate)
+            scores[np.asarray(indices)] = -np.inf
+            ranked = ranked_row(scores, depth).astype(np.int32)
+        cached = (ranked, len(ranked) < depth)
+        if self.backend_failures == failures:
+            self.ranking_cache.put(key, cached)
+        return cached
+    
+    def _get_aggregate_recommendations(self, indices: List[int], weights: List[float], aggregate: str,
+                                       n: int, exclude_mask: np.ndarray) -> List[int]:
+        """Rank the catalog once by the mean, max or weighted sum of the seed rows"""
+        if self.backend == 'sharded':
+            # Every shard ranks its own rows by the combined score and returns only its top n
+            return self.similarity_matrix.combined_top_k(indices, weights, aggregate, n, exclude_mask).tolist()
+        scores = self._combined_scores(indices, weights, aggregate)
+        scores[exclude_mask] = -np.inf
+        return ranked_row(scores, n).tolist()
+    
+    def _combined_scores(self, indices: List[int], weights: List[float], aggregate: str) -> np.ndarray:
+        """Combine the seed rows into one score vector, with NaN scores ranked last"""
+        return combine_scores(self.similarity_matrix[np.asarray(indices)], weights, aggregate)
+    
+    def predict_batch(self, queries: List[dict]) -> List[List[int]]:
+        """Answer many independent recommendation queries in one call
+        
+        Args:
+            queries: Each query is a dict with either 'ids' or 'indices' (the seed
+                items), plus optional 'n', 'excluded_ids', 'aggregate', 'weights',
+                'filters', 'exclusion_set' and 'diversity' with the same meaning as in
+                predict_by_index
+            
+        Returns:
+            One list of recommendation indices per query, in the same order. A query
+            without any valid seed gets an empty list.
+        """
+        started = time.perf_counter()
         try:
-            # For better performance, determine the number of candidates to fetch initially
-            # We want more than n to account for exclusions, but also add a buffer
-            buffer_factor = 1.5  # 50% buffer
-            candidate_count = min(
-                int(n * buffer_factor + len(exclude_indices)), 
-                len(self.similarity_matrix.loc[index]) - 1
-            )
+            size = self.similarity_matrix.shape[0]
             
-            # Get similarity scores for this item
-            similarity_scores = self.similarity_matrix.loc[index].sort_values(ascending=False)
-            
-            # If no exclusion, we can return directly for maximum performance
-            if not exclude_indices or len(exclude_indices) == 0:
-                return similarity_scores.iloc[1:n+1].index.tolist()
-            
-            # Get top candidates
-            top_candidates = similarity_scores.iloc[1:candidate_count+1]
-            
-            # Filter out excluded indices efficiently
-            result = []
-            for idx in top_candidates.index:
-                if idx not in exclude_indices:
-                    result.append(idx)
-                    if len(result) >= n:
-                        break
-            
-            # If we still need more recommendations, fetch more in batches
-            if len(result) < n:
-                remaining_needed = n - len(result)
-                batch_size = max(remaining_needed * 2, len(exclude_indices))  # Adjust batch size based on exclusion list
-                offset = candidate_count + 1
+            # Resolve every id referenced anywhere in the batch in one pass
+            all_ids = set()
+            for query in queries:
+                all_ids.update(query.get('ids') or ())
+                all_ids.update(query.get('excluded_ids') or ())
+            all_ids = list(all_ids)
+            resolved = {game_id: int(row) for game_id, row in zip(all_ids, self.id_to_index.lookup(all_ids)) if row >= 0}
+            
+            # Each query becomes one ranking row per seed (round-robin) or a single
+            # combined row (aggregations), all ranked together below
+            row_seeds = []       # seed index, or None for a combined row
+            row_n = []
+            row_exclusions = []  # excluded catalog rows per ranking row
+            row_allowed = []     # filter mask per ranking row, None when unfiltered
+            plans = []           # (aggregate, ranking rows, n, diversity re-ranking) per query
+            combined = {}        # ranking row -> (seeds, weights, aggregate)
+            
+            for query in queries:
+                n = query.get('n', 5)
+                aggregate = query.get('aggregate', 'round_robin')
+                weights = query.get('weights')
+                if 'ids' in query:
+                    positions = [(position, resolved[game_id]) for position, game_id in enumerate(query['ids'])
+                                 if game_id in resolved]
+                else:
+                    positions = [(position, idx) for position, idx in enumerate(query.get('indices') or ())
+                                 if 0 <= idx < size]
+                seeds = [idx for _, idx in positions]
+                if not seeds or n <= 0 or aggregate not in AGGREGATIONS:
+                    plans.append((aggregate, [], n, None))
+                    continue
+                seed_weights = [weights[position] for position, _ in positions] if weights else [1.0] * len(seeds)
+                diversity = query.get('diversity')
+                # Diversified queries rank a larger pool and pick n from it below
+                pool_size = self.diversity_pool(n) if diversity else n
                 
-                while len(result) < n and offset < len(similarity_scores):
-                    # Fetch the next batch
-                    next_batch_size = min(batch_size, len(similarity_scores) - offset)
-                    next_batch = similarity_scores.iloc[offset:offset+next_batch_size]
-                    offset += next_batch_size
-                    
-                    # Process this batch
-                    for idx in next_batch.index:
-                        if idx not in exclude_indices:
-                            result.append(idx)
-                            if len(result) >= n:
-                                break
-                    
-                    # If we've gone through all items and still don't have enough, break
-                    if next_batch_size < batch_size:
-                        break
+                excluded = {resolved[game_id] for game_id in query.get('excluded_ids') or () if game_id in resolved}
+                excluded.update(seeds)
+                excluded = np.fromiter(excluded, dtype=np.int64, count=len(excluded))
+                allowed = self.filter_mask(query.get('filters'))
+                if query.get('exclusion_set') is not None:
+                    # Applied with the filter mask rather than listed with the exclusions
+                    outside_set = ~unpack(query['exclusion_set'], size)
+                    allowed = outside_set if allowed is None else allowed & outside_set
+                
+                rows = []
+                if aggregate == 'round_robin':
+                    for seed in dict.fromkeys(seeds):
+                        rows.append(len(row_seeds))
+                        row_seeds.append(seed)
+                        row_n.append(pool_size)
+                        row_exclusions.append(excluded)
+                        row_allowed.append(allowed)
+                else:
+                    combined[len(row_seeds)] = (seeds, seed_weights, aggregate)
+                    rows.append(len(row_seeds))
+                    row_seeds.append(None)
+                    row_n.append(pool_size)
+                    row_exclusions.append(excluded)
+                    row_allowed.append(allowed)
+                plans.append((aggregate, rows, pool_size, (seeds, seed_weights, n, diversity) if diversity else None))
             
-            return result
+            ranked = self._rank_batch(row_seeds, row_n, row_exclusions, combined, row_allowed)
+            
+            results = []
+            for aggregate, rows, n, diversify in plans:
+                if not rows:
+                    results.append([])
+                    continue
+                if aggregate == 'round_robin':
+                    result = self._round_robin_merge({row_seeds[row]: ranked[row] for row in rows}, n)
+                else:
+                    result = ranked[rows[0]]
+                if diversify is not None:
+                    seeds, seed_weights, n, diversity = diversify
+                    result = self.diversify(result, seeds, seed_weights, aggregate, n, diversity)
+                results.append(result)
+            metrics.observe_stage('batch', time.perf_counter() - started)
+            return results
             
         except Exception as e:
-            print(f"Error in _get_single_index_recommendations: {str(e)}")
-            return []
+            print(f"Error in predict_batch: {str(e)}")
+            return [[] for _ in queries]
+    
+    def _rank_batch(self, row_seeds: List[Optional[int]], row_n: List[int], row_exclusions: List[np.ndarray],
+                    combined: Dict[int, tuple], row_allowed: Optional[List[Optional[np.ndarray]]] = None
+                    ) -> List[List[int]]:
+        """Rank many rows at once, each with its own n, exclusions and filter mask
+        
+        Seed rows are first answered from the neighbor index with one vectorized
+        membership test; only rows whose neighbors run out (and combined rows)
+        load their full similarity row, and those are ranked in blocks. The
+        sharded backend never loads full rows: every row is ranked by the
+        shards, which only send back their top k.
+        """
+        row_allowed = row_allowed or [None] * len(row_seeds)
+        size = self.similarity_matrix.shape[0]
+        row_count = len(row_seeds)
+        ranked: List[List[int]] = [[] for _ in range(row_count)]
+        if not row_count:
+            return ranked
+        
+        if self.backend == 'sharded':
+            for row in range(row_count):
+                exclude_mask = np.zeros(size, dtype=bool)
+                exclude_mask[row_exclusions[row]] = True
+                if row_allowed[row] is not None:
+                    exclude_mask |= ~row_allowed[row]
+                if row in combined:
+                    ranked[row] = self.similarity_matrix.combined_top_k(*combined[row], row_n[row], exclude_mask).tolist()
+                else:
+                    ranked[row] = self.similarity_matrix.top_k(row_seeds[row], row_n[row], exclude_mask).tolist()
+            return ranked
+        
+        # Flattened (row, catalog index) keys of every exclusion in the batch
+        exclusion_keys = np.concatenate([
+            row * size + excluded for row, excluded in enumerate(row_exclusions)
+        ])
+        
+        full_rows = list(combined)
+        seed_rows = np.array([row for row in range(row_count) if row not in combined], dtype=np.int64)
+        if self.neighbor_index is None:
+            full_rows.extend(seed_rows.tolist())
+        elif len(seed_rows):
+            neighbors = self.neighbor_index.ids[np.array([row_seeds[row] for row in seed_rows])]
+            kept = ~np.isin(seed_rows[:, None] * size + neighbors, exclusion_keys)
+            for position, row in enumerate(seed_rows):
+                if row_allowed[row] is not None:
+                    kept[position] &= row_allowed[row][neighbors[position]]
+            kept_counts = kept.sum(axis=1)
+            for position, row in enumerate(seed_rows):
+                n = row_n[row]
+                if kept_counts[position] >= n or self.neighbor_index.is_complete:
+                    ranked[row] = neighbors[position][kept[position]][:n].tolist()
+                else:
+                    full_rows.append(row)
+        if len(full_rows) > len(combined):
+            metrics.FETCH_MORE.inc(len(full_rows) - len(combined), path='batch')
+        
+        # Fallback: partial selection over full rows, a block of rows at a time
+        for start in range(0, len(full_rows), BATCH_ROW_BLOCK):
+            block_rows = full_rows[start:start + BATCH_ROW_BLOCK]
+            scores = np.empty((len(block_rows), size), dtype=np.float64)
+            # Gather all plain seed rows of the block with a single fancy-index read
+            plain = [position for position, row in enumerate(block_rows) if row not in combined]
+            if plain:
+                scores[plain] = self.similarity_matrix[np.array([row_seeds[block_rows[p]] for p in plain])]
+            for position, row in enumerate(block_rows):
+                if row in combined:
+                    scores[position] = self._combined_scores(*combined[row])
+            scores[np.isnan(scores)] = -np.inf
+            
+            excluded_positions = np.concatenate([
+                np.full(len(row_exclusions[row]), position) for position, row in enumerate(block_rows)
+            ])
+            excluded_columns = np.concatenate([row_exclusions[row] for row in block_rows])
+            scores[excluded_positions, excluded_columns] = -np.inf
+            for position, row in enumerate(block_rows):
+                if row_allowed[row] is not None:
+                    scores[position, ~row_allowed[row]] = -np.inf
+            
+            selected = top_k(scores, max(row_n[row] for row in block_rows))
+            for position, row in enumerate(block_rows):
+                picks = selected[position][:row_n[row]]
+                ranked[row] = picks[np.isfinite(scores[position, picks])].tolist()
+        
+        return ranked
     
     def _round_robin_merge(self, recommendations_per_index: Dict[int, List[int]], n: int) -> List[int]:
         """Merge recommendations from multiple indices in round-robin fashion"""
@@ -209,3 +994,159 @@ class RecommendationModel:
                 break
         
         return result[:n]
+    
+    def with_items(self, items: pd.DataFrame) -> "RecommendationModel":
+        """Return a copy of the model with games added or updated, without a full rebuild
+        
+        Only the similarity rows and columns of the changed games are computed, and
+        only the neighbor lists they affect are re-ranked. This model is left
+        untouched so it can keep serving until the copy is swapped in.
+        
+        Args:
+            items: Processed rows (same columns as processed_games.parquet) plus an
+                'id' column. Known ids are updated, unknown ids are appended. Feature
+                columns the catalog does not have yet are ignored.
+            
+        Returns:
+            The updated model
+        """
+        if self.backend == 'sharded':
+            raise ValueError("Item updates are not supported by the sharded backend; rebuild the data and restart the shards")
+        features, spec = self._load_features()
+        ids = [str(game_id) for game_id in items['id']]
+        if len(set(ids)) != len(ids):
+            raise ValueError("Duplicate ids in item update")
+        
+        old_size = self.size
+        positions = []
+        new_size = old_size
+        for game_id in ids:
+            if game_id in self.id_to_index:
+                positions.append(self.id_to_index[game_id])
+            else:
+                positions.append(new_size)
+                new_size += 1
+        positions = np.array(positions, dtype=np.int64)
+        
+        df = self._merge_items(items, ids, positions)
+        
+        # Weight the changed rows exactly like the build step did
+        weighted = build_feature_matrix(df.loc[positions], spec['features'], spec['feature_weights'],
+                                        spec['category_prefixes'])
+        order = np.arange(new_size)
+        order[positions] = old_size + np.arange(len(positions))
+        new_features = sp.vstack([features, weighted], format='csr')[order]
+        
+        updated = copy.copy(self)
+        updated.df = df
+        updated.ranking_cache = SizedLRUCache(RANKING_CACHE_BYTES)
+        updated._features = new_features
+        if self.backend == 'sparse':
+            updated.similarity_matrix = SparseSimilarity(new_features, self.similarity_matrix.block_rows)
+        else:
+            new_ids = df['id'].astype(str).tolist() if 'id' in df.columns else [str(i) for i in range(new_size)]
+            updated.similarity_matrix = self._patched_similarity(new_features, positions, new_ids)
+            updated.neighbor_index = self._patched_neighbor_index(updated.similarity_matrix, positions)
+        updated._create_id_index()
+        updated.filter_index = FilterIndex.from_frame(df)
+        updated.records = ItemRecords.from_frame(df, self.records.fields)
+        return updated
+    
+    def _load_features(self):
+        """Feature matrix and weighting spec written by the build step"""
+        features_path = self._data_path(FEATURES_FILE)
+        if self._features is None:
+            if self.backend == 'sparse':
+                self._features = self.similarity_matrix.features
+            elif os.path.exists(features_path):
+                self._features = sp.load_npz(features_path).tocsr()
+            else:
+                raise ValueError(f"Incremental updates need the feature matrix at {features_path}; "
+                                 "run data_processing.build_similarity")
+        if self._feature_spec is None:
+            self._feature_spec = load_feature_spec(self._data_path(FEATURE_SPEC_FILE))
+        return self._features, self._feature_spec
+    
+    def _merge_items(self, items: pd.DataFrame, ids: List[str], positions: np.ndarray) -> pd.DataFrame:
+        """Catalog frame with the item rows replaced or appended at their positions"""
+        columns = [column for column in self.df.columns if column != 'id']
+        frame = items.drop(columns='id').reindex(columns=columns)
+        frame.index = positions
+        dtypes = self.df.dtypes[columns]
+        defaults = {column: '' if pd.api.types.is_string_dtype(dtype) else 0 for column, dtype in dtypes.items()}
+        frame = frame.fillna(defaults).astype(dtypes.to_dict())
+        
+        df = pd.concat([self.df.drop(index=positions[positions < len(self.df)]), frame]).sort_index()
+        df.index = pd.RangeIndex(len(df))
+        
+        # Without an id column a game's id is its row number; keep explicit ids otherwise
+        if 'id' in self.df.columns or any(game_id != str(position) for game_id, position in zip(ids, positions)):
+            existing = (self.df['id'].astype(str).tolist() if 'id' in self.df.columns
+                        else [str(i) for i in range(len(self.df))])
+            all_ids = existing + [''] * (len(df) - len(existing))
+            for game_id, position in zip(ids, positions):
+                all_ids[position] = game_id
+            df = df.drop(columns='id', errors='ignore')
+            df.insert(0, 'id', all_ids)
+        return df
+    
+    def _patched_similarity(self, features: sp.csr_matrix, positions: np.ndarray, ids: List[str]) -> SimilarityStore:
+        """Copy of the dense matrix with the rows and columns of `positions` recomputed
+        
+        Entry (i, j) is always features[j] . features[i], the same kernel and
+        operand order as the build step, so patched values equal rebuilt ones.
+        The copy is written block by block to a file in the data directory and
+        memory-mapped read-only, so it is shared like the original store. The
+        file is unlinked right away and disappears once the model is dropped.
+        """
+        fd, path = tempfile.mkstemp(prefix='patched_', suffix='.sim', dir=self.data_dir)
+        os.close(fd)
+        try:
+            store = self.similarity_matrix.resized(path, ids)
+            size = features.shape[0]
+            changed = features[positions]
+            for start in range(0, size, BATCH_ROW_BLOCK * 16):
+                stop = min(start + BATCH_ROW_BLOCK * 16, size)
+                store.data[start:stop, positions] = store._encode(
+                    np.asarray(changed @ features[start:stop].toarray().T).T
+                )
+            store.write_rows_at(positions, np.asarray(features @ changed.toarray().T).T)
+            store.flush()
+            return SimilarityStore.open(path)
+        finally:
+            os.remove(path)
+    
+    def _patched_neighbor_index(self, similarity: SimilarityStore, positions: np.ndarray) -> NeighborIndex:
+        """Neighbor index for the patched matrix, re-ranking only rows the change can affect"""
+        old_index = self.neighbor_index
+        size = similarity.shape[0]
+        k = min(NEIGHBOR_COUNT, size - 1)
+        if old_index.k < k:
+            # The old lists were complete for a smaller catalog; rank everything again
+            return NeighborIndex.build(similarity, k)
+        
+        ids = np.empty((size, k), dtype=np.int32)
+        scores = np.empty((size, k), dtype=np.float32)
+        ids[:old_index.size] = old_index.ids[:, :k]
+        scores[:old_index.size] = old_index.scores[:, :k]
+        
+        # Changed games, and games whose old list holds a changed game (its score may
+        # have dropped), need a full re-rank. Every other list can only gain changed games.
+        stale = np.isin(old_index.ids[:, :k], positions[positions < old_index.size]).any(axis=1)
+        full_rows = np.union1d(positions, np.flatnonzero(stale))
+        merge_rows = np.setdiff1d(np.arange(old_index.size), full_rows)
+        
+        for start in range(0, len(full_rows), BATCH_ROW_BLOCK):
+            rows = full_rows[start:start + BATCH_ROW_BLOCK]
+            ids[rows], scores[rows] = NeighborIndex.rank_rows(similarity[rows], rows, k)
+        
+        for start in range(0, len(merge_rows), BATCH_ROW_BLOCK * 16):
+            rows = merge_rows[start:start + BATCH_ROW_BLOCK * 16]
+            candidates = np.concatenate([ids[rows], np.broadcast_to(positions, (len(rows), len(positions)))], axis=1)
+            candidate_scores = similarity[rows[:, None], candidates]
+            candidate_scores[np.isnan(candidate_scores)] = -np.inf
+            order = np.lexsort((candidates, -candidate_scores), axis=1)[:, :k]
+            ids[rows] = np.take_along_axis(candidates, order, axis=1)
+            scores[rows] = np.take_along_axis(candidate_scores, order, axis=1)
+        
+        return NeighborIndex(ids, scores, NeighborIndex.fingerprint(similarity))
@@ -0,0 +1,142 @@
+import argparse
+import os
+import zlib
+from typing import Optional
+
+import numpy as np
+
+from ranking import top_k
+
+# Rows of the similarity matrix hashed into its fingerprint
+FINGERPRINT_ROWS = 8
+
+
+class NeighborIndex:
+    """Precomputed top-K neighbors for every row of a similarity matrix
+
+    Row i of `ids` holds the K most similar items to item i (itself excluded),
+    ranked by score descending and then by index, and row i of `scores` holds
+    the matching similarity values. Both arrays are contiguous so a lookup is
+    a single slice instead of a sort over the whole catalog. `source` is the
+    fingerprint of the matrix the index was ranked from, so an index is never
+    served next to a matrix (or a rounding of it) that ranks differently.
+    """
+
+    def __init__(self, ids: np.ndarray, scores: np.ndarray, source: Optional[str] = None):
+        self.ids = np.ascontiguousarray(ids, dtype=np.int32)
+        self.scores = np.ascontiguousarray(scores, dtype=np.float32)
+        self.source = source
+
+    @property
+    def size(self) -> int:
+        """Number of items (rows) covered by the index"""
+        return self.ids.shape[0]
+
+    @property
+    def k(self) -> int:
+        """Number of neighbors stored per item"""
+        return self.ids.shape[1]
+
+    @property
+    def is_complete(self) -> bool:
+        """True when every row lists all other items, so no fallback is ever needed"""
+        return self.k >= self.size - 1
+
+    def neighbors(self, index: int) -> np.ndarray:
+        """Ranked neighbor indices of a single item"""
+        return self.ids[index]
+
+    @staticmethod
+    def fingerprint(similarity) -> str:
+        """Storage dtype, size and a checksum of a few rows of a similarity matrix
+
+        Rows are read as served (as float64, de-quantized), so the same values
+        give the same fingerprint whether they come from a store or an array.
+        """
+        size = similarity.shape[0]
+        rows = np.unique(np.linspace(0, size - 1, min(FINGERPRINT_ROWS, size)).astype(np.int64))
+        values = np.ascontiguousarray(similarity[rows], dtype=np.float64)
+        return f"{np.dtype(similarity.dtype).name}:{size}:{zlib.crc32(values.tobytes()):08x}"
+
+    @classmethod
+    def build(cls, similarity, k: int, block_size: int = 512) -> "NeighborIndex":
+        """Build the index from a square similarity matrix, one row block at a time
+
+        Args:
+            similarity: N x N array-like supporting row slicing
+            k: Number of neighbors to keep per item (capped at N - 1)
+            block_size: Number of rows ranked per vectorized step
+
+        Returns:
+            The populated NeighborIndex
+        """
+        size = similarity.shape[0]
+        k = max(min(k, size - 1), 0)
+        ids = np.empty((size, k), dtype=np.int32)
+        scores = np.empty((size, k), dtype=np.float32)
+
+        for start in range(0, size, block_size):
+            stop = min(start + block_size, size)
+            ids[start:stop], scores[start:stop] = cls.rank_block(similarity[start:stop], start, k)
+
+        return cls(ids, scores, cls.fingerprint(similarity))
+
+    @staticmethod
+    def rank_block(block: np.ndarray, start: int, k: int):
+        """Rank the neighbors of a block of consecutive rows starting at row `start`
+
+        Returns:
+            (ids, scores) arrays of shape (rows in block, k)
+        """
+        return NeighborIndex.rank_rows(block, np.arange(start, start + len(block)), k)
+
+    @staticmethod
+    def rank_rows(block: np.ndarray, rows: np.ndarray, k: int):
+        """Rank the neighbors of arbitrary rows, given their full similarity rows
+
+        Returns:
+            (ids, scores) arrays of shape (len(rows), k)
+        """
+        block = np.array(block, dtype=np.float64)
+        block[np.isnan(block)] = -np.inf
+        # An item is never its own neighbor
+        block[np.arange(block.shape[0]), rows] = -np.inf
+
+        selected = top_k(block, k)
+        return selected, np.take_along_axis(block, selected, axis=1)
+
+    def save(self, path: str):
+        """Write the index next to the similarity matrix so it can be shipped with it"""
+        np.savez(path, ids=self.ids, scores=self.scores, source=np.array(self.source or ''))
+
+    @classmethod
+    def load(cls, path: str) -> "NeighborIndex":
+        """Read an index written by `save`; `source` is None for indexes saved without one"""
+        with np.load(path) as data:
+            source = str(data['source']) if 'source' in data.files else ''
+            return cls(data['ids'], data['scores'], source or None)
+
+
+def main():
+    import pandas as pd
+    from similarity_store import SimilarityStore
+
+    parser = argparse.ArgumentParser(description="Precompute the top-K neighbor index for a similarity matrix")
+    parser.add_argument('similarity', help="Path to the served matrix: games_similarity_matrix.sim, "
+                                           "or the .parquet when no store is used")
+    parser.add_argument('output', help="Path of the .npz index to write")
+    parser.add_argument('--k', type=int, default=100, help="Neighbors to keep per item")
+    args = parser.parse_args()
+
+    if args.similarity.endswith('.parquet'):
+        similarity = pd.read_parquet(args.similarity).to_numpy(dtype=np.float64)
+    else:
+        # Ranked at the store's precision, which is what the server ranks
+        similarity = SimilarityStore.open(args.similarity)
+    index = NeighborIndex.build(similarity, args.k)
+    index.save(args.output)
+    print(f"Saved {index.size} x {index.k} neighbor index to {os.path.abspath(args.output)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import copy
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import List
+
+from cache import SizedLRUCache
+from model import RANKING_CACHE_BYTES, RecommendationModel
+
+# Model inherited by each pool process when it is forked
+_worker_model = None
+
+
+def _init_worker(model: RecommendationModel):
+    """Runs once in every pool process, with the model inherited through fork"""
+    global _worker_model
+    # The parent's cache lock may have been held by another thread at fork time
+    _worker_model = copy.copy(model)
+    _worker_model.ranking_cache = SizedLRUCache(RANKING_CACHE_BYTES)
+    _worker_model._df_lock = threading.Lock()
+
+
+def _noop():
+    return None
+
+
+def _call_model(method: str, args: tuple):
+    return getattr(_worker_model, method)(*args)
+
+
+class ModelProcessPool:
+    """Process pool whose workers are forked from a loaded model
+
+    The model is never pickled: every worker inherits the parent's arrays
+    copy-on-write (memory-mapped stores are shared by the OS page cache), so
+    only the query arguments and the result lists cross process boundaries.
+    This lets the GIL-bound ranking and merge loops run on several cores.
+    A pool serves one model, so a new pool is created whenever the model changes.
+    The workers are forked while the pool is created, so create it from the
+    event loop thread rather than from a request thread.
+    """
+
+    def __init__(self, model: RecommendationModel, processes: int):
+        self.model = model
+        self.processes = processes
+        self._executor = ProcessPoolExecutor(
+            max_workers=processes,
+            mp_context=multiprocessing.get_context('fork'),
+            initializer=_init_worker,
+            initargs=(model,),
+        )
+        # The executor forks every worker on its first submit; do it now instead of
+        # from whichever request thread submits first while others hold locks
+        self._executor.submit(_noop).result()
+
+    def call(self, method: str, *args):
+        """Run a RecommendationModel method in a pool process and wait for the result
+
+        Falls back to the calling thread when the pool was shut down by a model
+        swap or lost a worker.
+        """
+        try:
+            return self._executor.submit(_call_model, method, args).result()
+        except RuntimeError:
+            return getattr(self.model, method)(*args)
+
+    def predict_batch(self, queries: List[dict]) -> List[List[int]]:
+        """Split a batch into one chunk per process and answer the chunks in parallel"""
+        chunk_size = -(-len(queries) // self.processes)
+        try:
+            futures = [
+                self._executor.submit(_call_model, 'predict_batch', (queries[start:start + chunk_size],))
+                for start in range(0, len(queries), chunk_size)
+            ]
+            return [result for future in futures for result in future.result()]
+        except RuntimeError:
+            return self.model.predict_batch(queries)
+
+    def shutdown(self):
+        """Stop the workers once the calls already submitted have finished"""
+        self._executor.shutdown(wait=False)
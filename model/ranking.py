@@ -0,0 +1,76 @@
+import numpy as np
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Select the k best columns of each row without sorting the whole row
+
+    Ordering is by score descending, with ties broken by the lower column index
+    first, so the result is deterministic no matter which path produced it.
+
+    Args:
+        scores: 1-D score vector or 2-D matrix (one query per row). Excluded
+            columns should already be set to -inf.
+        k: Number of columns to select per row
+
+    Returns:
+        2-D int64 array of shape (rows, min(k, columns)) with the selected
+        column indices in ranked order. Callers drop entries whose score is -inf.
+    """
+    scores = np.atleast_2d(scores)
+    rows, columns = scores.shape
+    k = min(k, columns)
+    if k <= 0:
+        return np.empty((rows, 0), dtype=np.int64)
+
+    if k < columns:
+        # argpartition is O(columns) per row; only the k survivors get sorted
+        candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        candidates = np.broadcast_to(np.arange(columns), (rows, columns)).copy()
+
+    values = np.take_along_axis(scores, candidates, axis=1)
+    order = np.lexsort((candidates, -values), axis=1)
+    candidates = np.take_along_axis(candidates, order, axis=1)
+
+    if k < columns:
+        # argpartition picks arbitrary members of a tie at the cut-off; redo
+        # the (rare) rows where a lower-index tied column was left out
+        threshold = np.take_along_axis(values, order[:, -1:], axis=1)[:, 0]
+        tied_total = (scores == threshold[:, None]).sum(axis=1)
+        tied_kept = (values == threshold[:, None]).sum(axis=1)
+        for row in np.flatnonzero((tied_total > tied_kept) & np.isfinite(threshold)):
+            candidates[row] = _exact_top_k(scores[row], k, threshold[row])
+
+    return candidates
+
+
+def _exact_top_k(row: np.ndarray, k: int, threshold: float) -> np.ndarray:
+    """Resolve a tie at the cut-off of a single row using index order"""
+    above = np.flatnonzero(row > threshold)
+    tied = np.flatnonzero(row == threshold)[:k - len(above)]
+    selected = np.concatenate([above, tied])
+    return selected[np.lexsort((selected, -row[selected]))]
+
+
+def combine_scores(rows: np.ndarray, weights, aggregate: str) -> np.ndarray:
+    """Combine seed similarity rows (seeds x items) into one score vector
+
+    'mean' and 'max' reduce over the seeds, anything else is the weighted sum.
+    Columns are combined independently, so a block of columns gives the same
+    scores as the full rows. NaN scores become -inf so they are ranked last.
+    """
+    if aggregate == 'mean':
+        scores = rows.mean(axis=0)
+    elif aggregate == 'max':
+        scores = rows.max(axis=0)
+    else:
+        scores = np.asarray(weights, dtype=np.float64) @ rows
+
+    scores[np.isnan(scores)] = -np.inf
+    return scores
+
+
+def ranked_row(scores: np.ndarray, k: int) -> np.ndarray:
+    """Top-k of a single score vector with the -inf (excluded) entries dropped"""
+    selected = top_k(scores, k)[0]
+    return selected[np.isfinite(scores[selected])]
@@ -1,13 +1,27 @@
-from fastapi import FastAPI, Query, Depends, HTTPException, Request
+from fastapi import FastAPI, Query, Depends, Header, HTTPException, Request
 from fastapi.concurrency import run_in_threadpool
-from typing import List, Optional, Dict, Set, Tuple, Union
+from typing import Any, List, Optional, Dict, Set, Tuple, Union
 import pandas as pd
 import numpy as np
-from functools import lru_cache
 from contextlib import asynccontextmanager
+from collections import OrderedDict
+import asyncio
+import base64
+import hashlib
+import json
 import logging
+import math
+import os
+import random
+import signal
 import time
 from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.responses import JSONResponse, PlainTextResponse, Response
+
+try:
+    import orjson
+except ImportError:  # optional, only makes detailed responses faster to serialize
+    orjson = None
 
 # Configure logging
 logging.basicConfig(
@@ -16,68 +30,268 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-from model import RecommendationModel
+from model import RecommendationModel, AGGREGATIONS
+from cache import MISSING, SizedLRUCache
+from exclusion_sets import ExclusionSet, ExclusionSets
+from user_profiles import UserProfile, UserProfiles
+from filter_index import genre_key, tag_key
+import metrics
+from process_pool import ModelProcessPool
 
-# Global variable to store the model
+# Global variable to store the model. Requests read it once and keep that
+# reference, so swapping in a reloaded model never affects requests in flight.
 model_instance = None
+# Bookkeeping for hot reloads and incremental updates
+model_state = {"version": 0, "loaded_at": None, "ready": False, "reload_in_progress": False, "last_error": None}
+# Serializes reloads and item updates so one never overwrites the other
+admin_lock = asyncio.Lock()
+# Admin endpoints require this token in the X-Admin-Token header when set
+ADMIN_TOKEN = os.environ.get("MODEL_ADMIN_TOKEN")
+
+# Largest number of independent queries accepted by one batch call
+MAX_BATCH_QUERIES = 200
+
+# Finished recommendation lists keyed on normalized queries, bounded by memory
+RESULT_CACHE_BYTES = int(float(os.environ.get("MODEL_RESULT_CACHE_MB", 32)) * 2 ** 20)
+result_cache = SizedLRUCache(RESULT_CACHE_BYTES)
+
+# Longest a request waits on an identical request already in flight before computing
+# its own answer (0 disables coalescing)
+SINGLE_FLIGHT_TIMEOUT = float(os.environ.get("MODEL_SINGLE_FLIGHT_TIMEOUT", 2.0))
+
+# Processes forked from the loaded model for multi-seed and batch queries (0 disables the pool)
+PROCESS_POOL_SIZE = int(os.environ.get("MODEL_PROCESS_POOL", 0))
+process_pool: Optional[ModelProcessPool] = None
+# Uvicorn worker processes started by serve(); each holds its own copy of the served model
+worker_processes = 1
+
+# Memory budget for named exclusion sets (N/8 bytes each), kept across reloads
+EXCLUSION_SETS_BYTES = int(float(os.environ.get("MODEL_EXCLUSION_SETS_MB", 64)) * 2 ** 20)
+exclusion_sets: Optional[ExclusionSets] = None
+# Longest accepted exclusion set name
+MAX_EXCLUSION_SET_NAME = 128
+
+# Memory budget for user profiles (4 bytes per catalog row each), least recently used evicted first
+USER_PROFILES_BYTES = int(float(os.environ.get("MODEL_USER_PROFILES_MB", 64)) * 2 ** 20)
+# Weight of each purchase relative to the next one in a user profile, so recent games count most
+PROFILE_DECAY = float(os.environ.get("MODEL_PROFILE_DECAY", 0.9))
+# Newest purchases that shape a user profile (all owned games are still excluded)
+PROFILE_DEPTH = int(os.environ.get("MODEL_PROFILE_DEPTH", 200))
+user_profiles: Optional[UserProfiles] = None
+# Longest accepted user id
+MAX_USER_ID = 128
+
+# Most popular seeds ranked before a model starts serving (0 disables warm-up)
+WARMUP_SEEDS = int(os.environ.get("MODEL_WARMUP_SEEDS", 0))
+
+# Requests per minute allowed per client on the prediction endpoints (0 disables rate limiting,
+# e.g. for load tests)
+RATE_LIMIT_CALLS = int(os.environ.get("MODEL_RATE_LIMIT", 100))
+
+# Fraction of requests answered with a Server-Timing header listing their stage durations
+TIMING_SAMPLE_RATE = float(os.environ.get("MODEL_TIMING_SAMPLE_RATE", 0))
+
+class SingleFlight:
+    """Shares one computation between identical requests that overlap in time
+    
+    The result cache only helps once the first request has finished, so a burst
+    of identical requests would otherwise each take a threadpool thread to
+    compute the same answer. Here the first request for a key (the leader)
+    computes it and the others (followers) await its future. Followers wait at
+    most `timeout` seconds, then compute on their own, so one slow computation
+    cannot stall every request behind it. Runs on the event loop only.
+    """
+    
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self._calls: Dict[Tuple, asyncio.Future] = {}
+        self.coalesced = 0
+        self.timeouts = 0
+    
+    async def run(self, key: Tuple, func):
+        """Await `func()`, or the identical call already in flight for `key`"""
+        if self.timeout <= 0:
+            return await func()
+        future = self._calls.get(key)
+        if future is not None:
+            self.coalesced += 1
+            metrics.COALESCED_REQUESTS.inc(outcome="shared")
+            try:
+                # Shielded so a follower timing out does not cancel the leader
+                return await asyncio.wait_for(asyncio.shield(future), self.timeout)
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                metrics.COALESCED_REQUESTS.inc(outcome="timeout")
+            except asyncio.CancelledError:
+                # The leader's client went away; anything else cancels this request itself
+                if not future.cancelled():
+                    raise
+            return await func()
+        
+        future = asyncio.get_running_loop().create_future()
+        # Mark the exception as retrieved when no follower was waiting for it
+        future.add_done_callback(lambda done: done.cancelled() or done.exception())
+        self._calls[key] = future
+        try:
+            result = await func()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as error:
+            future.set_exception(error)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._calls[key]
+    
+    def stats(self) -> Dict[str, int]:
+        return {"coalesced": self.coalesced, "timeouts": self.timeouts, "in_flight": len(self._calls)}
+
+single_flight = SingleFlight(SINGLE_FLIGHT_TIMEOUT)
+
+class MetricsMiddleware(BaseHTTPMiddleware):
+    """Records end-to-end latency per route and, for a sample of requests, the stage timings
+    
+    Latency is labelled by route template rather than raw path, so unknown paths
+    cannot blow up the number of series. Sampled requests get a Server-Timing
+    header with every stage recorded while serving them.
+    """
+    def __init__(self, app, sample_rate: float = 0.0):
+        super().__init__(app)
+        self.sample_rate = sample_rate
+    
+    async def dispatch(self, request: Request, call_next):
+        started = time.perf_counter()
+        timings = {} if self.sample_rate and random.random() < self.sample_rate else None
+        token = metrics.request_timings.set(timings)
+        try:
+            response = await call_next(request)
+        finally:
+            metrics.request_timings.reset(token)
+        elapsed = time.perf_counter() - started
+        
+        route = request.scope.get("route")
+        path = getattr(route, "path", "unmatched")
+        metrics.REQUEST_SECONDS.observe(elapsed, path=path, status=response.status_code)
+        if timings is not None:
+            timings["total"] = elapsed
+            response.headers["Server-Timing"] = metrics.server_timing(timings)
+        return response
 
 # Rate limiting middleware
 class RateLimitMiddleware(BaseHTTPMiddleware):
-    def __init__(self, app, calls: int = 100, period: int = 60):
+    """Per-client token buckets with amortized O(1) work per request
+    
+    Each (route budget, client IP) pair gets a bucket holding up to `calls`
+    tokens that refills at calls/period per second. Buckets live in an LRU
+    OrderedDict: idle buckets (which would be full again anyway) are evicted
+    from the front, and the total is capped at `max_clients`.
+    
+    `routes` maps a path prefix to its own (calls, period) budget, or to None
+    to skip limiting; the longest matching prefix wins and anything unmatched
+    uses the default budget.
+    """
+    def __init__(self, app, calls: int = 100, period: int = 60,
+                 routes: Optional[Dict[str, Optional[Tuple[int, int]]]] = None, max_clients: int = 10000):
         super().__init__(app)
         self.calls = calls
         self.period = period
-        self.request_history = {}
-        
+        self.max_clients = max_clients
+        # Longest prefix first so the most specific budget matches
+        self.routes = sorted((routes or {}).items(), key=lambda route: -len(route[0]))
+        self.buckets: "OrderedDict[Tuple[str, str], List[float]]" = OrderedDict()
+    
+    def _budget(self, path: str) -> Tuple[str, Optional[Tuple[int, int]]]:
+        for prefix, budget in self.routes:
+            if path.startswith(prefix):
+                return prefix, budget
+        return "", (self.calls, self.period)
+    
     async def dispatch(self, request: Request, call_next):
-        client_ip = request.client.host
-        current_time = time.time()
+        started = time.perf_counter()
+        prefix, budget = self._budget(request.url.path)
+        if budget is None:
+            return await call_next(request)
         
-        # Clean up old entries
-        self.request_history = {
-            ip: timestamps for ip, timestamps in self.request_history.items()
-            if timestamps and timestamps[-1] > current_time - self.period
-        }
+        calls, period = budget
+        rate = calls / period
+        now = time.monotonic()
+        key = (prefix, request.client.host if request.client else "")
         
-        # Check if client has history
-        if client_ip not in self.request_history:
-            self.request_history[client_ip] = []
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = [float(calls), now]
+        else:
+            self.buckets.move_to_end(key)
+            bucket[0] = min(calls, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
         
-        # Check rate limit
-        client_history = self.request_history[client_ip]
-        if len(client_history) >= self.calls:
-            oldest_allowed = current_time - self.period
-            if client_history[0] > oldest_allowed:
-                return HTTPException(
-                    status_code=429, 
-                    detail=f"Rate limit exceeded. Maximum {self.calls} calls per {self.period} seconds."
-                )
-            # Remove older requests outside the window
-            while client_history and client_history[0] <= oldest_allowed:
-                client_history.pop(0)
+        # Evict from the least recently used end: idle buckets first, then the overflow
+        while self.buckets:
+            oldest_key, oldest = next(iter(self.buckets.items()))
+            if oldest_key != key and (now - oldest[1] >= period or len(self.buckets) > self.max_clients):
+                self.buckets.popitem(last=False)
+            else:
+                break
         
-        # Add current request timestamp
-        client_history.append(current_time)
+        if bucket[0] < 1:
+            retry_after = math.ceil((1 - bucket[0]) / rate)
+            return JSONResponse(
+                status_code=429,
+                content={"detail": f"Rate limit exceeded. Maximum {calls} calls per {period} seconds."},
+                headers={"Retry-After": str(retry_after)}
+            )
+        bucket[0] -= 1
+        metrics.observe_stage("rate_limit", time.perf_counter() - started)
         
         # Process the request
         return await call_next(request)
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    # Load the model at startup
-    global model_instance
+async def start_model():
+    """Load and warm up the model after the server is up, then report ready"""
     try:
-        model_instance = RecommendationModel()
-        logger.info("Model loaded successfully during application startup!")
+        if model_instance is None:
+            new_model = await run_in_threadpool(RecommendationModel)
+            await run_in_threadpool(lambda: new_model.warm_up(WARMUP_SEEDS))
+            swap_model(new_model)
+            logger.info("Model loaded successfully during application startup!")
+        model_state["ready"] = True
     except Exception as e:
+        model_state["last_error"] = str(e)
         logger.error(f"Failed to load model: {str(e)}")
-        raise
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global model_instance, process_pool
+    if model_instance is not None and PROCESS_POOL_SIZE > 0:
+        # Preloaded (and warmed) by a pre-forking parent; each forked worker gets its own
+        # pool, forked here before any request thread runs
+        process_pool = ModelProcessPool(model_instance, PROCESS_POOL_SIZE)
+    # Load in the background so /live answers while the model loads; /ready turns
+    # 200 once it is loaded and warm
+    startup = asyncio.get_running_loop().create_task(start_model())
+    
+    # SIGHUP reloads the model from disk, like POST /admin/reload
+    if hasattr(signal, "SIGHUP"):
+        loop = asyncio.get_running_loop()
+        try:
+            loop.add_signal_handler(signal.SIGHUP, lambda: loop.create_task(reload_model()))
+        except (RuntimeError, ValueError):
+            # Signals can only be handled when the app runs in the main thread
+            pass
     
     yield
     
     # Clean up resources when the application shuts down
+    startup.cancel()
     try:
+        model_state["ready"] = False
         model_instance = None
+        if process_pool is not None:
+            process_pool.shutdown()
+            process_pool = None
         logger.info("Model resources released during application shutdown!")
     except Exception as e:
         logger.error(f"Error during shutdown: {str(e)}")
@@ -90,38 +304,329 @@ app = FastAPI(
     lifespan=lifespan
 )
 
-# Add rate limiting - 100 requests per minute
-app.add_middleware(RateLimitMiddleware, calls=100, period=60)
+# Add rate limiting - 100 requests per minute by default, with health probes on their own budget
+if RATE_LIMIT_CALLS > 0:
+    app.add_middleware(RateLimitMiddleware, calls=RATE_LIMIT_CALLS, period=60,
+                       routes={"/health": (600, 60), "/live": None, "/ready": None, "/metrics": None})
+# Added last so it runs first and also times rate-limited requests
+app.add_middleware(MetricsMiddleware, sample_rate=TIMING_SAMPLE_RATE)
 
 def get_model():
     if model_instance is None:
         raise HTTPException(status_code=503, detail="Model not loaded yet")
     return model_instance
 
-# Enhanced cache for common predictions - now supports multiple IDs/indices
-@lru_cache(maxsize=1000)
-def cached_predict_by_id(ids_tuple: Tuple[str, ...], n: int, excluded_ids_tuple: Optional[Tuple[str, ...]] = None):
-    model = get_model()
-    ids = list(ids_tuple)
-    excluded_ids = list(excluded_ids_tuple) if excluded_ids_tuple else None
+def swap_model(new_model: RecommendationModel, start_pool: bool = True):
+    """Atomically replace the served model and drop results cached for the old one
     
-    # Handle single ID case for backward compatibility
-    if len(ids) == 1:
-        return model.predict_by_id(ids[0], n, excluded_ids)
+    Exclusion sets are bitsets over catalog rows, so they are carried over to
+    the new model's rows by game id. User profiles keep their histories the
+    same way and rebuild their score vectors on first use.
+    """
+    global model_instance, process_pool, exclusion_sets, user_profiles
+    old_model, model_instance = model_instance, new_model
+    if exclusion_sets is None or old_model is None:
+        exclusion_sets = ExclusionSets(new_model.size, EXCLUSION_SETS_BYTES)
+        user_profiles = UserProfiles(new_model, USER_PROFILES_BYTES, PROFILE_DECAY, PROFILE_DEPTH)
     else:
-        return model.predict_by_id(ids, n, excluded_ids)
+        exclusion_sets = exclusion_sets.remapped(old_model.id_to_index.ids, new_model.id_to_index)
+        user_profiles = user_profiles.remapped(old_model.id_to_index.ids, new_model)
+    result_cache.clear()
+    if PROCESS_POOL_SIZE > 0 and start_pool:
+        # Pool processes hold the model they were forked with, so they are replaced too
+        old_pool, process_pool = process_pool, ModelProcessPool(new_model, PROCESS_POOL_SIZE)
+        if old_pool is not None:
+            old_pool.shutdown()
+    model_state["version"] += 1
+    model_state["loaded_at"] = time.time()
+    metrics.MODEL_VERSION.set(model_state["version"])
+    metrics.MODEL_ITEMS.set(new_model.size)
+    metrics.MODEL_LOAD_SECONDS.set(new_model.load_seconds)
+    for component, size in new_model.memory_usage().items():
+        metrics.MODEL_BYTES.set(size, component=component)
+    logger.info(f"Serving model version {model_state['version']} with {new_model.size} items")
 
-@lru_cache(maxsize=1000)
-def cached_predict_by_index(indices_tuple: Tuple[int, ...], n: int, excluded_ids_tuple: Optional[Tuple[str, ...]] = None):
-    model = get_model()
-    indices = list(indices_tuple)
-    excluded_ids = list(excluded_ids_tuple) if excluded_ids_tuple else None
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    if ADMIN_TOKEN and x_admin_token != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+def require_single_worker():
+    """Refuse endpoints whose state lives in one worker process when serve() forked several"""
+    if worker_processes > 1:
+        raise HTTPException(status_code=409, detail="Not available with several worker processes: each worker "
+                                                    "would keep its own copy and the others would not see it")
+
+async def run_timed(func):
+    """run_in_threadpool, recording how long the call waited for a free thread"""
+    queued = time.perf_counter()
     
-    # Handle single index case for backward compatibility
-    if len(indices) == 1:
-        return model.predict_by_index(indices[0], n, excluded_ids)
+    def call():
+        metrics.observe_stage("threadpool_wait", time.perf_counter() - queued)
+        return func()
+    return await run_in_threadpool(call)
+
+def collect_cache_metrics():
+    """Copy the caches' own counters into the metrics registry before a scrape"""
+    caches = {"results": result_cache}
+    if model_instance is not None:
+        caches["rankings"] = model_instance.ranking_cache
+    if user_profiles is not None:
+        caches["user_profiles"] = user_profiles
+    for name, cache in caches.items():
+        stats = cache.stats()
+        metrics.CACHE_HITS.set(stats["hits"], cache=name)
+        metrics.CACHE_MISSES.set(stats["misses"], cache=name)
+        metrics.CACHE_EVICTIONS.set(stats["evictions"], cache=name)
+        metrics.CACHE_BYTES.set(stats["bytes"], cache=name)
+    if exclusion_sets is not None:
+        metrics.EXCLUSION_SETS.set(len(exclusion_sets))
+        metrics.EXCLUSION_SET_BYTES.set(exclusion_sets.nbytes)
+
+metrics.COLLECTORS.append(collect_cache_metrics)
+
+def canonical_query(seeds: Tuple, excluded_ids: Optional[Tuple[str, ...]], aggregate: str,
+                    weights: Optional[Tuple[float, ...]]):
+    """Normalize a query so equivalent requests share one cache entry
+    
+    Exclusions are a set, so they are sorted and deduplicated. Round-robin keeps
+    the seed order (it decides the interleaving) but drops repeated seeds, which
+    the merge ignores anyway. Combined scores do not depend on the seed order,
+    so seeds are sorted (with their weights); 'max' also drops repeats, while
+    'mean' and 'weighted' keep them since they change the result.
+    """
+    excluded = tuple(sorted(set(excluded_ids))) if excluded_ids else ()
+    if aggregate == 'round_robin':
+        seeds = tuple(dict.fromkeys(seeds))
+    elif aggregate == 'max':
+        seeds = tuple(sorted(set(seeds)))
+    elif aggregate == 'weighted' and weights is not None:
+        pairs = sorted(zip(seeds, weights))
+        seeds = tuple(seed for seed, _ in pairs)
+        weights = tuple(weight for _, weight in pairs)
+    else:
+        seeds = tuple(sorted(seeds))
+    return seeds, excluded, weights
+
+def result_key(by: str, seeds: Tuple, n: int, excluded_ids: Optional[Tuple[str, ...]], aggregate: str,
+               weights: Optional[Tuple[float, ...]], filters: Optional[Tuple],
+               exclusion_set: Optional[ExclusionSet], diversity: Optional[float] = None) -> Tuple:
+    """Result cache key of a query, equal for every equivalent query
+    
+    A named exclusion set is keyed by its name and version, so its entries
+    repeat until the set changes.
+    """
+    seeds, excluded, weights = canonical_query(seeds, excluded_ids, aggregate, weights)
+    return (by, seeds, n, excluded, aggregate, weights, filters, exclusion_set.key if exclusion_set else None,
+            diversity)
+
+def cached_predict(model: RecommendationModel, generation: int, by: str, seeds: Tuple, n: int,
+                   excluded_ids: Optional[Tuple[str, ...]] = None,
+                   aggregate: str = 'round_robin', weights: Optional[Tuple[float, ...]] = None,
+                   filters: Optional[Tuple] = None, exclusion_set: Optional[ExclusionSet] = None,
+                   diversity: Optional[float] = None) -> List[int]:
+    """Predict by 'id' or 'index' through the result cache
+    
+    `generation` is the result cache generation read together with `model`: if
+    the model is swapped while this runs, the stale result is not cached. The
+    expensive per-seed rankings are cached separately by the model, so a miss
+    here with the same seeds but other exclusions is still cheap.
+    """
+    key = result_key(by, seeds, n, excluded_ids, aggregate, weights, filters, exclusion_set, diversity)
+    _, seeds, _, excluded, _, weights, _, _, _ = key
+    result = result_cache.get(key)
+    if result is MISSING:
+        failures = model.backend_failures
+        method = "predict_by_id" if by == "id" else "predict_by_index"
+        args = (list(seeds), n, list(excluded) or None, aggregate, list(weights) if weights is not None else None,
+                filters_dict(filters), exclusion_set.bits if exclusion_set else None, diversity)
+        pool = process_pool
+        if pool is not None and pool.model is model and len(seeds) > 1:
+            # Multi-seed queries are the heavy ones, run them on another core
+            result = pool.call(method, *args)
+        else:
+            result = getattr(model, method)(*args)
+        if model.backend_failures == failures:
+            # Results missing a shard are not cached
+            result_cache.put(key, result, generation)
+    return list(result)
+
+def validate_aggregation(aggregate: str, weights: Optional[List[float]], seed_count: int) -> Optional[Tuple[float, ...]]:
+    """Check the multi-item aggregation options and return the weights as a cache-friendly tuple"""
+    if aggregate not in AGGREGATIONS:
+        raise HTTPException(status_code=400, detail=f"'aggregate' must be one of {list(AGGREGATIONS)}")
+    if weights is None:
+        return None
+    if aggregate != 'weighted':
+        raise HTTPException(status_code=400, detail="'weights' can only be used with aggregate=weighted")
+    if len(weights) != seed_count:
+        raise HTTPException(status_code=400, detail="'weights' must have one value per input item")
+    try:
+        return tuple(float(weight) for weight in weights)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="'weights' must be numbers")
+
+def validate_filters(model: RecommendationModel, genres: Any = None, tags: Any = None,
+                     min_price: Any = None, max_price: Any = None) -> Optional[Tuple]:
+    """Check the attribute filters against the catalog and return them as a canonical, cache-friendly tuple
+    
+    Genre and tag names are matched case-insensitively and their order does not
+    matter, so they are normalized and sorted. None means the query is unfiltered.
+    """
+    if not genres and not tags and min_price is None and max_price is None:
+        return None
+    for name, values in (("genres", genres), ("tags", tags)):
+        if values is not None and (not isinstance(values, list) or not all(isinstance(value, str) for value in values)):
+            raise HTTPException(status_code=400, detail=f"'{name}' must be a list of strings")
+    for name, value in (("min_price", min_price), ("max_price", max_price)):
+        if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float))):
+            raise HTTPException(status_code=400, detail=f"'{name}' must be a number")
+    try:
+        model.filter_index.validate(genres, tags, min_price, max_price)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return (
+        tuple(sorted({genre_key(genre) for genre in genres or ()})),
+        tuple(sorted({tag_key(tag) for tag in tags or ()})),
+        float(min_price) if min_price is not None else None,
+        float(max_price) if max_price is not None else None,
+    )
+
+def filters_dict(filters: Optional[Tuple]) -> Optional[Dict[str, Any]]:
+    """The model's filters argument for a tuple from validate_filters"""
+    if filters is None:
+        return None
+    genres, tags, min_price, max_price = filters
+    return {"genres": list(genres), "tags": list(tags), "min_price": min_price, "max_price": max_price}
+
+def validate_fields(model: RecommendationModel, detail: Any, fields: Any) -> Optional[Tuple[str, ...]]:
+    """Fields of a detailed response, or None for the plain list of indices
+    
+    Asking for 'fields' implies detail; detail alone returns every configured field.
+    """
+    if fields is None:
+        return tuple(model.records.fields) if detail is True else None
+    if not isinstance(fields, list) or not all(isinstance(field, str) for field in fields):
+        raise HTTPException(status_code=400, detail="'fields' must be a list of strings")
+    unknown = [field for field in fields if field not in model.records.columns]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields {unknown}, available: {model.records.fields}")
+    return tuple(dict.fromkeys(fields))
+
+def validate_diversity(diversity: Any) -> Optional[float]:
+    """The diversity trade-off as a float, or None when the ranking is left unchanged"""
+    if diversity is None:
+        return None
+    if isinstance(diversity, bool) or not isinstance(diversity, (int, float)) or not 0 <= diversity <= 1:
+        raise HTTPException(status_code=400, detail="'diversity' must be a number between 0 and 1")
+    return float(diversity) or None
+
+def validate_pagination(paginate: Any, cursor: Any) -> Tuple[bool, Optional[str]]:
+    """Check the pagination options of a request body"""
+    if paginate is not None and not isinstance(paginate, bool):
+        raise HTTPException(status_code=400, detail="'paginate' must be a boolean")
+    if cursor is not None and not isinstance(cursor, str):
+        raise HTTPException(status_code=400, detail="'cursor' must be a string")
+    return bool(paginate), cursor
+
+def serialize(payload: Any) -> bytes:
+    """JSON bytes of a detailed payload, with orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, separators=(",", ":")).encode()
+
+def json_response(body: bytes) -> Response:
+    """Send already serialized JSON, skipping the response model validation"""
+    return Response(body, media_type="application/json")
+
+def predict_response(model: RecommendationModel, generation: int, by: str, seeds: Tuple, n: int,
+                     excluded_ids: Optional[Tuple[str, ...]], aggregate: str, weights: Optional[Tuple[float, ...]],
+                     filters: Optional[Tuple], exclusion_set: Optional[ExclusionSet],
+                     fields: Optional[Tuple[str, ...]], diversity: Optional[float] = None) -> Union[List[int], bytes]:
+    """cached_predict, plus the id, score and fields of every recommendation (serialized) when `fields` is set"""
+    result = cached_predict(model, generation, by, seeds, n, excluded_ids, aggregate, weights, filters, exclusion_set,
+                            diversity)
+    if fields is None:
+        return result
+    return serialize(model.describe(result, list(seeds), fields, by, aggregate,
+                                    list(weights) if weights is not None else None))
+
+def cursor_query(by: str, seeds: Tuple, aggregate: str, weights: Optional[Tuple[float, ...]]) -> str:
+    """Fingerprint of the rankings a cursor walks, so it is only accepted by the same query"""
+    seeds, _, weights = canonical_query(seeds, None, aggregate, weights)
+    return hashlib.blake2b(repr((by, seeds, aggregate, weights)).encode(), digest_size=8).hexdigest()
+
+def encode_cursor(version: int, query: str, offsets: List[int], turn: int) -> str:
+    payload = json.dumps({"v": version, "q": query, "o": offsets, "t": turn}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str, version: int, query: str) -> Tuple[List[int], int]:
+    """Offsets and round-robin turn saved in a cursor, checked against the query and model version"""
+    try:
+        state = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        offsets, turn = [int(offset) for offset in state["o"]], int(state["t"])
+        state_query, state_version = state["q"], state["v"]
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if state_query != query:
+        raise HTTPException(status_code=400, detail="The cursor belongs to another query")
+    if state_version != version:
+        raise HTTPException(status_code=400, detail="The cursor expired when the model changed; request the first page again")
+    return offsets, turn
+
+def page_response(model: RecommendationModel, version: int, by: str, seeds: Tuple, n: int,
+                  excluded_ids: Optional[Tuple[str, ...]], aggregate: str, weights: Optional[Tuple[float, ...]],
+                  filters: Optional[Tuple], exclusion_set: Optional[ExclusionSet],
+                  fields: Optional[Tuple[str, ...]], cursor: Optional[str]) -> bytes:
+    """One page of recommendations (described when `fields` is set) and the cursor of the next page"""
+    query = cursor_query(by, seeds, aggregate, weights)
+    offsets, turn = decode_cursor(cursor, version, query) if cursor is not None else (None, 0)
+    try:
+        items, offsets, turn = model.predict_page(
+            list(seeds), n, list(excluded_ids) if excluded_ids else None, aggregate,
+            list(weights) if weights is not None else None, filters_dict(filters),
+            exclusion_set.bits if exclusion_set else None, by, offsets, turn
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if fields is not None:
+        items = model.describe(items, list(seeds), fields, by, aggregate, list(weights) if weights is not None else None)
+    next_cursor = encode_cursor(version, query, offsets, turn) if offsets is not None else None
+    return serialize({"items": items, "next_cursor": next_cursor})
+
+async def coalesced_predict(model: RecommendationModel, generation: int, by: str, seeds: Tuple, n: int,
+                            excluded_ids: Optional[Tuple[str, ...]], aggregate: str,
+                            weights: Optional[Tuple[float, ...]], filters: Optional[Tuple],
+                            exclusion_set: Optional[ExclusionSet], fields: Optional[Tuple[str, ...]],
+                            paginate: bool = False, cursor: Optional[str] = None, diversity: Optional[float] = None):
+    """predict_response (page_response when paginating) in the threadpool, shared with identical requests in flight"""
+    key = (generation, fields) + result_key(by, seeds, n, excluded_ids, aggregate, weights, filters, exclusion_set,
+                                            diversity)
+    if paginate or cursor is not None:
+        if diversity is not None:
+            # Each page would be re-ranked on its own, so pages would not concatenate to one list
+            raise HTTPException(status_code=400, detail="'diversity' cannot be combined with pagination")
+        version = model_state["version"]
+        key += ("page", version, cursor)
+        compute = lambda: page_response(model, version, by, seeds, n, excluded_ids, aggregate, weights, filters,
+                                        exclusion_set, fields, cursor)
     else:
-        return model.predict_by_index(indices, n, excluded_ids)
+        compute = lambda: predict_response(model, generation, by, seeds, n, excluded_ids, aggregate, weights,
+                                           filters, exclusion_set, fields, diversity)
+    result = await single_flight.run(key, lambda: run_timed(compute))
+    # Followers share the payload, but every request gets its own response object
+    return json_response(result) if isinstance(result, bytes) else list(result)
+
+def get_exclusion_set(name: Optional[str]) -> Optional[ExclusionSet]:
+    """The current version of a named exclusion set, read together with the model"""
+    if name is None:
+        return None
+    if not isinstance(name, str):
+        raise HTTPException(status_code=400, detail="'exclusion_set' must be a string")
+    require_single_worker()
+    exclusion_set = exclusion_sets.get(name) if exclusion_sets is not None else None
+    if exclusion_set is None:
+        raise HTTPException(status_code=404, detail=f"Exclusion set '{name}' not found")
+    return exclusion_set
 
 @app.get("/")
 def read_root():
@@ -132,13 +637,34 @@ async def predict_by_id(
     id: Optional[str] = Query(None, description="Single input ID to find similar items"), 
     ids: Optional[List[str]] = Query(None, description="Multiple input IDs to find similar items (round-robin recommendations)"),
     n: int = Query(5, description="Number of similar items to return"),
-    excluded_ids: Optional[List[str]] = Query(None, description="IDs to exclude from recommendations")
+    excluded_ids: Optional[List[str]] = Query(None, description="IDs to exclude from recommendations"),
+    aggregate: str = Query("round_robin", description="How to combine multiple IDs: round_robin, mean, max or weighted"),
+    weights: Optional[List[float]] = Query(None, description="Per-ID weights for aggregate=weighted"),
+    genres: Optional[List[str]] = Query(None, description="Only recommend games having all of these genres"),
+    tags: Optional[List[str]] = Query(None, description="Only recommend games having all of these tags"),
+    min_price: Optional[float] = Query(None, description="Only recommend games costing at least this much (in cents)"),
+    max_price: Optional[float] = Query(None, description="Only recommend games costing at most this much (in cents)"),
+    exclusion_set: Optional[str] = Query(None, description="Name of a registered exclusion set whose games are excluded"),
+    detail: bool = Query(False, description="Return {index, id, score, ...fields} objects instead of bare indices"),
+    fields: Optional[List[str]] = Query(None, description="Catalog fields to include (implies detail; default: all configured)"),
+    paginate: bool = Query(False, description="Return {items, next_cursor} so further pages can be requested"),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page (implies paginate)"),
+    diversity: Optional[float] = Query(None, description="Between 0 (default) and 1: trade relevance for variety among the recommendations")
 ):
     """
     Get recommendations based on one or more game IDs.
     
     Use either 'id' for single item or 'ids' for multiple items.
-    When using multiple IDs, recommendations are returned in round-robin fashion.
+    When using multiple IDs, recommendations are returned in round-robin fashion
+    unless 'aggregate' asks for a single combined ranking. 'genres', 'tags',
+    'min_price' and 'max_price' restrict the recommendations to matching games,
+    and 'exclusion_set' excludes a registered set (see PUT /exclusion_sets/{name}).
+    With 'detail' (or 'fields') every recommendation is returned as an object
+    with its index, id, similarity score and catalog fields. With 'paginate'
+    the response is {"items": [...], "next_cursor": ...}; pass the cursor back
+    with the same query to get the next n items (null once there are no more).
+    'diversity' re-ranks the best candidates so near-duplicates of games
+    already recommended move down (not available with pagination).
     """
     # Validate input - must provide either id or ids, but not both
     if id is not None and ids is not None:
@@ -162,26 +688,52 @@ async def predict_by_id(
             raise HTTPException(status_code=400, detail="IDs list cannot be empty")
         input_ids = tuple(ids)
     
+    weights_tuple = validate_aggregation(aggregate, weights, len(input_ids))
+    
     # Convert excluded_ids list to tuple for caching
     excluded_ids_tuple = tuple(excluded_ids) if excluded_ids else None
     
     # Run prediction in a threadpool to avoid blocking
-    return await run_in_threadpool(
-        lambda: cached_predict_by_id(input_ids, n, excluded_ids_tuple)
-    )
+    model, generation = get_model(), result_cache.generation
+    filters = validate_filters(model, genres, tags, min_price, max_price)
+    excluded_set = get_exclusion_set(exclusion_set)
+    record_fields = validate_fields(model, detail, fields)
+    return await coalesced_predict(model, generation, "id", input_ids, n, excluded_ids_tuple, aggregate, weights_tuple,
+                                   filters, excluded_set, record_fields, paginate, cursor, validate_diversity(diversity))
 
 @app.get("/model/predict_by_index", response_model=List[int])
 async def predict_by_index(
     index: Optional[int] = Query(None, description="Single dataframe index to find similar items"), 
     indices: Optional[List[int]] = Query(None, description="Multiple dataframe indices to find similar items (round-robin recommendations)"),
     n: int = Query(5, description="Number of similar items to return"),
-    excluded_ids: Optional[List[str]] = Query(None, description="IDs to exclude from recommendations")
+    excluded_ids: Optional[List[str]] = Query(None, description="IDs to exclude from recommendations"),
+    aggregate: str = Query("round_robin", description="How to combine multiple indices: round_robin, mean, max or weighted"),
+    weights: Optional[List[float]] = Query(None, description="Per-index weights for aggregate=weighted"),
+    genres: Optional[List[str]] = Query(None, description="Only recommend games having all of these genres"),
+    tags: Optional[List[str]] = Query(None, description="Only recommend games having all of these tags"),
+    min_price: Optional[float] = Query(None, description="Only recommend games costing at least this much (in cents)"),
+    max_price: Optional[float] = Query(None, description="Only recommend games costing at most this much (in cents)"),
+    exclusion_set: Optional[str] = Query(None, description="Name of a registered exclusion set whose games are excluded"),
+    detail: bool = Query(False, description="Return {index, id, score, ...fields} objects instead of bare indices"),
+    fields: Optional[List[str]] = Query(None, description="Catalog fields to include (implies detail; default: all configured)"),
+    paginate: bool = Query(False, description="Return {items, next_cursor} so further pages can be requested"),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page (implies paginate)"),
+    diversity: Optional[float] = Query(None, description="Between 0 (default) and 1: trade relevance for variety among the recommendations")
 ):
     """
     Get recommendations based on one or more dataframe indices.
     
     Use either 'index' for single item or 'indices' for multiple items.
-    When using multiple indices, recommendations are returned in round-robin fashion.
+    When using multiple indices, recommendations are returned in round-robin fashion
+    unless 'aggregate' asks for a single combined ranking. 'genres', 'tags',
+    'min_price' and 'max_price' restrict the recommendations to matching games,
+    and 'exclusion_set' excludes a registered set (see PUT /exclusion_sets/{name}).
+    With 'detail' (or 'fields') every recommendation is returned as an object
+    with its index, id, similarity score and catalog fields. With 'paginate'
+    the response is {"items": [...], "next_cursor": ...}; pass the cursor back
+    with the same query to get the next n items (null once there are no more).
+    'diversity' re-ranks the best candidates so near-duplicates of games
+    already recommended move down (not available with pagination).
     """
     # Validate input - must provide either index or indices, but not both
     if index is not None and indices is not None:
@@ -205,18 +757,24 @@ async def predict_by_index(
             raise HTTPException(status_code=400, detail="Indices list cannot be empty")
         input_indices = tuple(indices)
     
+    weights_tuple = validate_aggregation(aggregate, weights, len(input_indices))
+    
     # Convert excluded_ids list to tuple for caching
     excluded_ids_tuple = tuple(excluded_ids) if excluded_ids else None
     
     # Run prediction in a threadpool to avoid blocking
-    return await run_in_threadpool(
-        lambda: cached_predict_by_index(input_indices, n, excluded_ids_tuple)
-    )
+    model, generation = get_model(), result_cache.generation
+    filters = validate_filters(model, genres, tags, min_price, max_price)
+    excluded_set = get_exclusion_set(exclusion_set)
+    record_fields = validate_fields(model, detail, fields)
+    return await coalesced_predict(model, generation, "index", input_indices, n, excluded_ids_tuple, aggregate,
+                                   weights_tuple, filters, excluded_set, record_fields, paginate, cursor,
+                                   validate_diversity(diversity))
 
 # Additional convenience endpoints for bulk operations
 @app.post("/model/predict_by_id_bulk", response_model=List[int])
 async def predict_by_id_bulk(
-    request: Dict[str, Union[List[str], int, List[str]]]
+    request: Dict[str, Union[bool, List[str], int, List[str], str, List[float], float]]
 ):
     """
     POST endpoint for bulk ID-based predictions.
@@ -225,13 +783,22 @@ async def predict_by_id_bulk(
     {
         "ids": ["id1", "id2", "id3"],
         "n": 10,
-        "excluded_ids": ["excluded1", "excluded2"]  // optional
+        "excluded_ids": ["excluded1", "excluded2"],  // optional
+        "aggregate": "mean",  // optional: round_robin (default), mean, max or weighted
+        "weights": [1.0, 0.5, 0.5],  // optional, with aggregate=weighted
+        "genres": ["RPG"], "tags": ["Open World"], "min_price": 0, "max_price": 1999,  // optional filters
+        "exclusion_set": "user-42-library",  // optional, a registered exclusion set
+        "detail": true, "fields": ["name", "price"],  // optional, objects instead of bare indices
+        "paginate": true, "cursor": "...",  // optional, {items, next_cursor} pages
+        "diversity": 0.3  // optional, between 0 and 1: trade relevance for variety
     }
     """
     try:
         ids = request.get("ids")
         n = request.get("n", 5)
         excluded_ids = request.get("excluded_ids")
+        aggregate = request.get("aggregate", "round_robin")
+        weights = request.get("weights")
         
         if not ids or not isinstance(ids, list):
             raise HTTPException(status_code=400, detail="'ids' must be a non-empty list")
@@ -239,21 +806,31 @@ async def predict_by_id_bulk(
         if not isinstance(n, int) or n <= 0:
             raise HTTPException(status_code=400, detail="'n' must be a positive integer")
         
+        weights_tuple = validate_aggregation(aggregate, weights, len(ids))
+        
         # Convert to tuples for caching
         ids_tuple = tuple(ids)
         excluded_ids_tuple = tuple(excluded_ids) if excluded_ids else None
         
-        return await run_in_threadpool(
-            lambda: cached_predict_by_id(ids_tuple, n, excluded_ids_tuple)
-        )
+        model, generation = get_model(), result_cache.generation
+        filters = validate_filters(model, request.get("genres"), request.get("tags"),
+                                   request.get("min_price"), request.get("max_price"))
+        excluded_set = get_exclusion_set(request.get("exclusion_set"))
+        record_fields = validate_fields(model, request.get("detail"), request.get("fields"))
+        paginate, cursor = validate_pagination(request.get("paginate"), request.get("cursor"))
+        diversity = validate_diversity(request.get("diversity"))
+        return await coalesced_predict(model, generation, "id", ids_tuple, n, excluded_ids_tuple, aggregate,
+                                       weights_tuple, filters, excluded_set, record_fields, paginate, cursor, diversity)
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error in predict_by_id_bulk: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
 @app.post("/model/predict_by_index_bulk", response_model=List[int])
 async def predict_by_index_bulk(
-    request: Dict[str, Union[List[int], int, List[str]]]
+    request: Dict[str, Union[bool, List[int], int, List[str], str, List[float], float]]
 ):
     """
     POST endpoint for bulk index-based predictions.
@@ -262,32 +839,413 @@ async def predict_by_index_bulk(
     {
         "indices": [1, 2, 3],
         "n": 10,
-        "excluded_ids": ["excluded1", "excluded2"]  // optional
+        "excluded_ids": ["excluded1", "excluded2"],  // optional
+        "aggregate": "mean",  // optional: round_robin (default), mean, max or weighted
+        "weights": [1.0, 0.5, 0.5],  // optional, with aggregate=weighted
+        "genres": ["RPG"], "tags": ["Open World"], "min_price": 0, "max_price": 1999,  // optional filters
+        "exclusion_set": "user-42-library",  // optional, a registered exclusion set
+        "detail": true, "fields": ["name", "price"],  // optional, objects instead of bare indices
+        "paginate": true, "cursor": "...",  // optional, {items, next_cursor} pages
+        "diversity": 0.3  // optional, between 0 and 1: trade relevance for variety
     }
     """
     try:
         indices = request.get("indices")
         n = request.get("n", 5)
         excluded_ids = request.get("excluded_ids")
+        aggregate = request.get("aggregate", "round_robin")
+        weights = request.get("weights")
         
         if not indices or not isinstance(indices, list):
             raise HTTPException(status_code=400, detail="'indices' must be a non-empty list")
         
+        if not all(isinstance(index, int) for index in indices):
+            raise HTTPException(status_code=400, detail="'indices' must be integers")
+        
         if not isinstance(n, int) or n <= 0:
             raise HTTPException(status_code=400, detail="'n' must be a positive integer")
         
+        weights_tuple = validate_aggregation(aggregate, weights, len(indices))
+        
         # Convert to tuples for caching
         indices_tuple = tuple(indices)
         excluded_ids_tuple = tuple(excluded_ids) if excluded_ids else None
         
-        return await run_in_threadpool(
-            lambda: cached_predict_by_index(indices_tuple, n, excluded_ids_tuple)
-        )
+        model, generation = get_model(), result_cache.generation
+        filters = validate_filters(model, request.get("genres"), request.get("tags"),
+                                   request.get("min_price"), request.get("max_price"))
+        excluded_set = get_exclusion_set(request.get("exclusion_set"))
+        record_fields = validate_fields(model, request.get("detail"), request.get("fields"))
+        paginate, cursor = validate_pagination(request.get("paginate"), request.get("cursor"))
+        diversity = validate_diversity(request.get("diversity"))
+        return await coalesced_predict(model, generation, "index", indices_tuple, n, excluded_ids_tuple, aggregate,
+                                       weights_tuple, filters, excluded_set, record_fields, paginate, cursor, diversity)
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error in predict_by_index_bulk: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
+@app.post("/model/predict_batch", response_model=List[List[int]])
+async def predict_batch(
+    request: Dict[str, Any]
+):
+    """
+    POST endpoint that answers many independent recommendation queries in one call.
+    
+    Request body should contain:
+    {
+        "queries": [
+            {"ids": ["id1", "id2"], "n": 10, "excluded_ids": ["excluded1"]},
+            {"indices": [3], "n": 5, "aggregate": "mean", "genres": ["RPG"], "max_price": 1999}
+        ]
+    }
+    Each query takes the same options as the single-query endpoints. The response
+    holds one recommendation list per query, in request order. Top-level
+    "detail": true (or "fields": [...]) returns objects instead of indices.
+    """
+    queries = request.get("queries")
+    if not queries or not isinstance(queries, list) or not all(isinstance(query, dict) for query in queries):
+        raise HTTPException(status_code=400, detail="'queries' must be a non-empty list of objects")
+    if len(queries) > MAX_BATCH_QUERIES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_QUERIES} queries per batch")
+    
+    model = get_model()
+    record_fields = validate_fields(model, request.get("detail"), request.get("fields"))
+    normalized = []
+    for position, query in enumerate(queries):
+        seeds_key = "ids" if "ids" in query else "indices"
+        seeds = query.get(seeds_key)
+        if ("ids" in query) == ("indices" in query) or not seeds or not isinstance(seeds, list):
+            raise HTTPException(
+                status_code=400,
+                detail=f"Query {position}: provide exactly one of 'ids' or 'indices' as a non-empty list"
+            )
+        if seeds_key == "indices" and not all(isinstance(seed, int) for seed in seeds):
+            raise HTTPException(status_code=400, detail=f"Query {position}: 'indices' must be integers")
+        n = query.get("n", 5)
+        if not isinstance(n, int) or n <= 0:
+            raise HTTPException(status_code=400, detail=f"Query {position}: 'n' must be a positive integer")
+        aggregate = query.get("aggregate", "round_robin")
+        weights = validate_aggregation(aggregate, query.get("weights"), len(seeds))
+        excluded_ids = query.get("excluded_ids")
+        try:
+            filters = validate_filters(model, query.get("genres"), query.get("tags"),
+                                       query.get("min_price"), query.get("max_price"))
+            excluded_set = get_exclusion_set(query.get("exclusion_set"))
+            diversity = validate_diversity(query.get("diversity"))
+        except HTTPException as e:
+            raise HTTPException(status_code=e.status_code, detail=f"Query {position}: {e.detail}")
+        
+        normalized.append({
+            seeds_key: [str(seed) for seed in seeds] if seeds_key == "ids" else seeds,
+            "n": n,
+            "excluded_ids": [str(game_id) for game_id in excluded_ids] if excluded_ids else None,
+            "aggregate": aggregate,
+            "weights": list(weights) if weights else None,
+            "filters": filters_dict(filters),
+            "exclusion_set": excluded_set.bits if excluded_set else None,
+            "diversity": diversity,
+        })
+    
+    pool = process_pool
+    
+    def answer():
+        if pool is not None and pool.model is model and len(normalized) > 1:
+            results = pool.predict_batch(normalized)
+        else:
+            results = model.predict_batch(normalized)
+        if record_fields is None:
+            return results
+        return serialize([
+            model.describe(result, query.get("ids") or query.get("indices"), record_fields,
+                           "id" if "ids" in query else "index", query["aggregate"], query["weights"])
+            for query, result in zip(normalized, results)
+        ])
+    result = await run_timed(answer)
+    return json_response(result) if isinstance(result, bytes) else result
+
+def exclusion_rows(model: RecommendationModel, request: Dict[str, Any]) -> Tuple[np.ndarray, int]:
+    """Catalog rows of the request's 'ids', plus how many ids are not in the catalog"""
+    ids = request.get("ids")
+    if not isinstance(ids, list) or not all(isinstance(game_id, (str, int)) for game_id in ids):
+        raise HTTPException(status_code=400, detail="'ids' must be a list of ids")
+    rows = model.id_to_index.lookup([str(game_id) for game_id in ids])
+    return rows[rows >= 0], int((rows < 0).sum())
+
+def validate_set_name(name: str):
+    if len(name) > MAX_EXCLUSION_SET_NAME:
+        raise HTTPException(status_code=400, detail=f"Exclusion set names are limited to {MAX_EXCLUSION_SET_NAME} characters")
+
+def describe_exclusion_set(exclusion_set: ExclusionSet, unknown_ids: int) -> Dict[str, Any]:
+    return {"name": exclusion_set.name, "version": exclusion_set.version, "count": exclusion_set.count,
+            "unknown_ids": unknown_ids}
+
+@app.put("/exclusion_sets/{name}", dependencies=[Depends(require_single_worker)])
+async def put_exclusion_set(name: str, request: Dict[str, Any]):
+    """
+    Create or replace a named exclusion set, such as a user's owned library.
+    
+    Request body: {"ids": ["10", "20", "30"]}
+    The set is stored as a bitset over catalog rows and can then be passed by
+    name as 'exclusion_set' to the prediction endpoints. Ids that are not in
+    the catalog are ignored (and counted in 'unknown_ids').
+    """
+    validate_set_name(name)
+    model, sets = get_model(), exclusion_sets
+    rows, unknown = exclusion_rows(model, request)
+    try:
+        return describe_exclusion_set(sets.put(name, rows), unknown)
+    except ValueError as e:
+        raise HTTPException(status_code=507, detail=str(e))
+
+@app.post("/exclusion_sets/{name}/add", dependencies=[Depends(require_single_worker)])
+async def add_to_exclusion_set(name: str, request: Dict[str, Any]):
+    """Add games to a named exclusion set (e.g. after a purchase), creating it if needed. Body: {"ids": [...]}"""
+    validate_set_name(name)
+    model, sets = get_model(), exclusion_sets
+    rows, unknown = exclusion_rows(model, request)
+    try:
+        return describe_exclusion_set(sets.add(name, rows), unknown)
+    except ValueError as e:
+        raise HTTPException(status_code=507, detail=str(e))
+
+@app.post("/exclusion_sets/{name}/remove", dependencies=[Depends(require_single_worker)])
+async def remove_from_exclusion_set(name: str, request: Dict[str, Any]):
+    """Remove games from a named exclusion set. Body: {"ids": [...]}"""
+    model, sets = get_model(), exclusion_sets
+    rows, unknown = exclusion_rows(model, request)
+    try:
+        return describe_exclusion_set(sets.remove(name, rows), unknown)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Exclusion set '{name}' not found")
+
+@app.get("/exclusion_sets/{name}", dependencies=[Depends(require_single_worker)])
+async def get_exclusion_set_ids(name: str):
+    """The games in a named exclusion set."""
+    model = get_model()
+    exclusion_set = get_exclusion_set(name)
+    return {"name": name, "version": exclusion_set.version, "count": exclusion_set.count,
+            "ids": model.id_to_index.ids[exclusion_set.rows(model.size)].tolist()}
+
+@app.delete("/exclusion_sets/{name}", dependencies=[Depends(require_single_worker)])
+async def delete_exclusion_set(name: str):
+    """Delete a named exclusion set."""
+    if exclusion_sets is None or not exclusion_sets.delete(name):
+        raise HTTPException(status_code=404, detail=f"Exclusion set '{name}' not found")
+    return {"deleted": name}
+
+def get_user_profiles() -> UserProfiles:
+    """The user profiles of the served model; use their `model` so both always match"""
+    get_model()
+    return user_profiles
+
+def validate_user_id(user_id: str):
+    if len(user_id) > MAX_USER_ID:
+        raise HTTPException(status_code=400, detail=f"User ids are limited to {MAX_USER_ID} characters")
+
+def describe_user_profile(profile: UserProfile, unknown_ids: int) -> Dict[str, Any]:
+    return {"user_id": profile.user_id, "version": profile.version, "count": len(profile.rows),
+            "unknown_ids": unknown_ids}
+
+@app.put("/users/{user_id}/history", dependencies=[Depends(require_single_worker)])
+async def put_user_history(user_id: str, request: Dict[str, Any]):
+    """
+    Create or replace a user's profile from their whole purchase history.
+    
+    Request body: {"ids": ["10", "20", "30"]}, oldest purchase first.
+    The profile is the sum of the games' similarity rows, each purchase
+    weighted MODEL_PROFILE_DECAY times the next one, over the
+    MODEL_PROFILE_DEPTH last games (a repeated id counts once, at its last
+    position), so recommending for the user is one top-k over it (see GET /users/{user_id}/recommendations).
+    Ids that are not in the catalog are ignored (and counted in 'unknown_ids').
+    """
+    validate_user_id(user_id)
+    profiles = get_user_profiles()
+    rows, unknown = exclusion_rows(profiles.model, request)
+    profile = await run_timed(lambda: profiles.put(user_id, rows))
+    return describe_user_profile(profile, unknown)
+
+@app.post("/users/{user_id}/purchases", dependencies=[Depends(require_single_worker)])
+async def add_user_purchases(user_id: str, request: Dict[str, Any]):
+    """Add purchases (oldest first) to a user's profile, creating it if needed. Body: {"ids": [...]}
+    
+    Only the similarity rows of the new games and of the games pushed out of
+    the MODEL_PROFILE_DEPTH window are read: the profile is decayed, the new
+    games added and the old ones subtracted. A game bought again counts once.
+    """
+    validate_user_id(user_id)
+    profiles = get_user_profiles()
+    rows, unknown = exclusion_rows(profiles.model, request)
+    profile = await run_timed(lambda: profiles.add(user_id, rows))
+    return describe_user_profile(profile, unknown)
+
+@app.get("/users/{user_id}/recommendations", response_model=List[int], dependencies=[Depends(require_single_worker)])
+async def recommend_for_user(
+    user_id: str,
+    n: int = Query(5, description="Number of recommendations to return"),
+    excluded_ids: Optional[List[str]] = Query(None, description="IDs to exclude from recommendations"),
+    genres: Optional[List[str]] = Query(None, description="Only recommend games having all of these genres"),
+    tags: Optional[List[str]] = Query(None, description="Only recommend games having all of these tags"),
+    min_price: Optional[float] = Query(None, description="Only recommend games costing at least this much (in cents)"),
+    max_price: Optional[float] = Query(None, description="Only recommend games costing at most this much (in cents)"),
+    exclusion_set: Optional[str] = Query(None, description="Name of a registered exclusion set whose games are excluded"),
+    detail: bool = Query(False, description="Return {index, id, score, ...fields} objects instead of bare indices"),
+    fields: Optional[List[str]] = Query(None, description="Catalog fields to include (implies detail; default: all configured)")
+):
+    """
+    Get recommendations for a user from their cached profile.
+    
+    The games they own are never recommended. Returns 404 when the user has
+    no profile (never created, or evicted to stay within MODEL_USER_PROFILES_MB):
+    send the history again with PUT /users/{user_id}/history. The filters,
+    'exclusion_set' and 'detail'/'fields' work as on /model/predict_by_index;
+    the score of a detailed recommendation is its profile score.
+    """
+    profiles = get_user_profiles()
+    model = profiles.model
+    filters = validate_filters(model, genres, tags, min_price, max_price)
+    excluded_set = get_exclusion_set(exclusion_set)
+    record_fields = validate_fields(model, detail, fields)
+    excluded_ids_list = list(excluded_ids) if excluded_ids else None
+    
+    def recommend():
+        profile = profiles.get(user_id)
+        if profile is None:
+            return None
+        result = model.predict_for_user(profile.scores, profile.rows, n, excluded_ids_list, filters_dict(filters),
+                                        excluded_set.bits if excluded_set else None)
+        if record_fields is None:
+            return result
+        # The profile score is the weighted similarity to the newest purchases
+        seeds = profile.rows[-profiles.depth:]
+        weights = profiles.decay ** np.arange(len(seeds) - 1, -1, -1, dtype=np.float64)
+        return serialize(model.describe(result, seeds.tolist(), record_fields, "index", "weighted", weights.tolist()))
+    result = await run_timed(recommend)
+    if result is None:
+        raise HTTPException(status_code=404, detail=f"User '{user_id}' has no profile")
+    return json_response(result) if isinstance(result, bytes) else result
+
+@app.get("/users/{user_id}", dependencies=[Depends(require_single_worker)])
+async def get_user_profile(user_id: str):
+    """The games in a user's profile, oldest purchase first."""
+    profiles = get_user_profiles()
+    profile = profiles.get(user_id, scores=False)
+    if profile is None:
+        raise HTTPException(status_code=404, detail=f"User '{user_id}' has no profile")
+    return {"user_id": user_id, "version": profile.version, "count": len(profile.rows),
+            "ids": profiles.model.id_to_index.ids[profile.rows].tolist()}
+
+@app.delete("/users/{user_id}", dependencies=[Depends(require_single_worker)])
+async def delete_user_profile(user_id: str):
+    """Delete a user's profile."""
+    if user_profiles is None or not user_profiles.delete(user_id):
+        raise HTTPException(status_code=404, detail=f"User '{user_id}' has no profile")
+    return {"deleted": user_id}
+
+async def reload_model():
+    """Load a fresh model from disk in a worker thread and swap it in when ready"""
+    async with admin_lock:
+        model_state["reload_in_progress"] = True
+        try:
+            backend = model_instance.backend if model_instance is not None else None
+            data_dir = model_instance.data_dir if model_instance is not None else None
+            new_model = await run_in_threadpool(lambda: RecommendationModel(backend, data_dir))
+            await run_in_threadpool(lambda: new_model.warm_up(WARMUP_SEEDS))
+            swap_model(new_model)
+            model_state["last_error"] = None
+        except Exception as e:
+            model_state["last_error"] = str(e)
+            logger.error(f"Model reload failed, still serving version {model_state['version']}: {str(e)}")
+        finally:
+            model_state["reload_in_progress"] = False
+
+@app.post("/admin/reload", status_code=202, dependencies=[Depends(require_admin)])
+async def admin_reload():
+    """
+    Reload the model from disk in the background.
+    
+    The current model keeps serving until the new one is fully loaded, then it is
+    swapped in atomically. Poll /admin/status for the new version. With several
+    worker processes the parent is signalled, which reloads every worker.
+    """
+    if worker_processes > 1 and hasattr(signal, "SIGHUP"):
+        os.kill(os.getppid(), signal.SIGHUP)
+        return {"status": "reloading", "version": model_state["version"]}
+    if admin_lock.locked():
+        raise HTTPException(status_code=409, detail="A reload or item update is already in progress")
+    asyncio.get_running_loop().create_task(reload_model())
+    return {"status": "reloading", "version": model_state["version"]}
+
+@app.post("/admin/items", dependencies=[Depends(require_admin)])
+async def admin_upsert_items(
+    request: Dict[str, List[Dict[str, Any]]]
+):
+    """
+    Add or update games without rebuilding the whole similarity matrix.
+    
+    Request body should contain processed feature rows (columns of processed_games.parquet):
+    {
+        "items": [
+            {"id": "1001", "name": "New Game", "price_scaled": -0.2, "genre_action": 1, "tags_fps": 0.4}
+        ]
+    }
+    Only the new rows/columns and the affected neighbor lists are computed.
+    Not available with several worker processes, where only the worker serving
+    the request would see the new items: rebuild the artifacts and send SIGHUP.
+    """
+    if worker_processes > 1:
+        raise HTTPException(status_code=409, detail="Item updates would only reach one of the worker processes; "
+                                                    "rebuild the data files and send SIGHUP to reload every worker")
+    items = request.get("items")
+    if not items or not isinstance(items, list) or not all(isinstance(item, dict) and "id" in item for item in items):
+        raise HTTPException(status_code=400, detail="'items' must be a non-empty list of objects with an 'id'")
+    
+    async with admin_lock:
+        model = get_model()
+        try:
+            updated = await run_in_threadpool(lambda: model.with_items(pd.DataFrame(items)))
+        except (ValueError, FileNotFoundError) as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        swap_model(updated)
+    return {"version": model_state["version"], "items_count": updated.size, "updated": len(items)}
+
+@app.get("/admin/status", dependencies=[Depends(require_admin)])
+async def admin_status():
+    """Version and reload state of the served model."""
+    return {**model_state, "model_loaded": model_instance is not None}
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Hit/miss/eviction counts and memory use of the result, per-seed ranking and user profile caches, and coalesced requests."""
+    stats = {"results": result_cache.stats(), "single_flight": single_flight.stats()}
+    if model_instance is not None:
+        stats["rankings"] = model_instance.ranking_cache.stats()
+    if user_profiles is not None:
+        stats["user_profiles"] = user_profiles.stats()
+    return stats
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    """Stage latencies, cache and model metrics in the Prometheus text format."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/live")
+async def liveness():
+    """Liveness probe: 200 while the process can still become or stay ready."""
+    if model_instance is None and model_state["last_error"]:
+        # The startup load failed and nothing will retry it, so restart the process
+        return JSONResponse(status_code=503, content={"status": "failed", "error": model_state["last_error"]})
+    return {"status": "alive"}
+
+@app.get("/ready")
+async def readiness():
+    """Readiness probe: 200 only once the model is loaded and warmed up."""
+    if not model_state["ready"] or model_instance is None:
+        return JSONResponse(status_code=503, content={"status": "loading"})
+    return {"status": "ready", "version": model_state["version"], "items_count": model_instance.size}
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint that also verifies the model is loaded."""
@@ -296,9 +1254,9 @@ async def health_check():
         return {
             "status": "healthy", 
             "model_loaded": True,
-            "items_count": len(model.df),
+            "items_count": model.size,
             "version": "2.0.0",
-            "features": ["single_item_recommendations", "multi_item_recommendations", "round_robin_mixing"]
+            "features": ["single_item_recommendations", "multi_item_recommendations", "round_robin_mixing", "score_aggregation", "batch_queries", "attribute_filters", "exclusion_sets", "detailed_responses", "cursor_pagination", "diversity_reranking", "user_profiles"]
         }
     except HTTPException:
         return {
@@ -308,6 +1266,101 @@ async def health_check():
             "version": "2.0.0"
         }
 
-if __name__ == "__main__":
+def serve(host: str = "0.0.0.0", port: int = 8000, workers: int = 1):
+    """Run the API, pre-forking `workers` processes that share one loaded model
+    
+    With several workers the model is loaded once in this process and the
+    workers are forked from it, so they share its arrays copy-on-write (and a
+    memory-mapped store through the page cache) instead of each loading a copy.
+    Every worker accepts connections on the same listening socket. The parent
+    restarts workers that die and forwards SIGTERM/SIGINT (shutdown) and SIGHUP
+    (reload from disk) to all of them. After a reload the parent loads the
+    current artifacts before forking a replacement, so it never serves an older
+    catalog than its siblings. POST /admin/reload signals the parent, and
+    /admin/items answers 409 since its update would not reach the other workers.
+    """
+    global worker_processes
+    import gc
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    
+    config = uvicorn.Config(app, host=host, port=port)
+    if workers <= 1:
+        uvicorn.Server(config).run()
+        return
+    
+    worker_processes = workers
+    
+    def load_model():
+        """Load the model that workers are forked from"""
+        model = RecommendationModel()
+        # Warm before forking so every worker shares the warmed pages
+        model.warm_up(WARMUP_SEEDS)
+        # Workers start their own process pools, a pool's queues cannot be shared
+        swap_model(model, start_pool=False)
+        # Keep the garbage collector from touching (and so copying) the shared objects
+        gc.freeze()
+    
+    load_model()
+    sock = config.bind_socket()
+    
+    forwarded = [signum for signum in (signal.SIGTERM, signal.SIGINT, getattr(signal, "SIGHUP", None)) if signum is not None]
+    
+    def start_worker() -> int:
+        pid = os.fork()
+        if pid == 0:
+            for signum in forwarded:
+                signal.signal(signum, signal.SIG_DFL)
+            try:
+                uvicorn.Server(config).run(sockets=[sock])
+            finally:
+                os._exit(0)
+        return pid
+    
+    children = {start_worker() for _ in range(workers)}
+    logger.info(f"Serving on {host}:{port} with {workers} worker processes")
+    stopping = False
+    # Set once the workers reloaded, so this process's model is older than theirs
+    stale = False
+    
+    def forward(signum, frame):
+        nonlocal stopping, stale
+        if signum != getattr(signal, "SIGHUP", None):
+            stopping = True
+        else:
+            stale = True
+        for pid in children:
+            os.kill(pid, signum)
+    
+    for signum in forwarded:
+        signal.signal(signum, forward)
+    
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        children.discard(pid)
+        if not stopping:
+            logger.error(f"Worker {pid} exited with status {status}, starting a replacement")
+            if stale:
+                stale = False
+                try:
+                    load_model()
+                except Exception as e:
+                    # The workers' reload most likely failed the same way, so they still serve this model too
+                    logger.error(f"Reloading the model before the restart failed: {str(e)}")
+            children.add(start_worker())
+    sock.close()
+
+if __name__ == "__main__":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Serve the recommendation API")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("MODEL_WORKERS", 1)),
+                        help="Worker processes forked from one loaded model")
+    args = parser.parse_args()
+    serve(args.host, args.port, args.workers)
\ No newline at end of file
@@ -0,0 +1,412 @@
+import argparse
+import multiprocessing
+import os
+import threading
+import time
+import weakref
+from multiprocessing.connection import Client, Listener
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+import scipy.sparse as sp
+
+import metrics
+from exclusion_sets import unpack
+from ranking import combine_scores, ranked_row
+from similarity_store import SimilarityStore
+
+# Operations a shard server answers
+SHARD_OPS = ('info', 'vectors', 'rows', 'scores', 'top_k', 'combined_top_k')
+# Seconds a timed-out or unreachable shard is skipped before it is tried again
+RETRY_INTERVAL = 5.0
+# Seconds to wait for every shard to answer when the coordinator starts
+STARTUP_TIMEOUT = 60.0
+
+
+def shard_bounds(size: int, count: int) -> List[int]:
+    """Row boundaries splitting `size` catalog rows into `count` contiguous shards"""
+    return [size * shard // count for shard in range(count + 1)]
+
+
+class Shard:
+    """Rows [start, stop) of the catalog, as held by one shard server
+
+    From a similarity store the shard keeps the columns of its rows (for every
+    seed row), so any seed's scores against its rows are a local read. From
+    the sparse feature matrix it keeps the feature vectors of its rows and
+    scores seeds by their vectors, which the coordinator gets from the seeds'
+    own shards. Scores come from the same kernels as SimilarityStore and
+    SparseSimilarity, and rows are ranked by score and then index, so merging
+    the local rankings of every shard gives exactly the single-process ranking.
+    """
+
+    def __init__(self, start: int, size: int, columns: Optional[SimilarityStore] = None,
+                 features: Optional[sp.csr_matrix] = None):
+        self.start = start
+        self.size = size
+        self.columns = columns
+        self.features = features
+        self.stop = start + (columns.shape[1] if columns is not None else features.shape[0])
+
+    @classmethod
+    def load(cls, path: str, shard: int, count: int) -> "Shard":
+        """Load one shard's part of a similarity store (.sim) or feature matrix (.npz)"""
+        if path.endswith('.npz'):
+            # An .npz file cannot be read in parts, so the full matrix is only held while slicing
+            features = sp.load_npz(path).tocsr()
+            size = features.shape[0]
+            bounds = shard_bounds(size, count)
+            features = sp.csr_matrix(features[bounds[shard]:bounds[shard + 1]], dtype=np.float64)
+            return cls(bounds[shard], size, features=features)
+        store = SimilarityStore.open(path)
+        bounds = shard_bounds(len(store), count)
+        columns = np.ascontiguousarray(store.data[:, bounds[shard]:bounds[shard + 1]])
+        return cls(bounds[shard], len(store),
+                   columns=SimilarityStore(columns, store.ids[bounds[shard]:bounds[shard + 1]], store.scale))
+
+    def info(self) -> dict:
+        return {
+            'start': self.start,
+            'stop': self.stop,
+            'size': self.size,
+            'kind': 'dense' if self.columns is not None else 'sparse',
+            'dimensions': self.features.shape[1] if self.features is not None else 0,
+        }
+
+    def vectors(self, rows: np.ndarray) -> sp.csr_matrix:
+        """Feature vectors of rows held by this (sparse) shard"""
+        return self.features[np.asarray(rows) - self.start]
+
+    def rows(self, seeds: np.ndarray, vectors: Optional[np.ndarray] = None) -> np.ndarray:
+        """Scores of every seed against this shard's rows, shape (seeds, rows)"""
+        if self.columns is not None:
+            return self.columns[np.asarray(seeds)]
+        return np.asarray(self.features @ vectors).T
+
+    def scores(self, seeds: np.ndarray, candidates: np.ndarray, vectors: Optional[np.ndarray] = None) -> np.ndarray:
+        """Scores of every seed against candidates held by this shard, shape (seeds, candidates)"""
+        local = np.asarray(candidates) - self.start
+        if self.columns is not None:
+            return self.columns[np.asarray(seeds)[:, None], local[None, :]]
+        return np.asarray(self.features[local] @ vectors).T
+
+    def top_k(self, seed: int, k: int, excluded: Optional[np.ndarray] = None, vectors: Optional[np.ndarray] = None):
+        """Local top-k of one seed, skipping the seed itself and the excluded rows
+
+        Returns:
+            (catalog rows, scores) in ranked order
+        """
+        scores = self.rows(np.array([seed]), vectors)[0]
+        scores[np.isnan(scores)] = -np.inf
+        if self.start <= seed < self.stop:
+            scores[seed - self.start] = -np.inf
+        return self._ranked(scores, k, excluded)
+
+    def combined_top_k(self, seeds: np.ndarray, weights: List[float], aggregate: str, k: int,
+                       excluded: Optional[np.ndarray] = None, vectors: Optional[np.ndarray] = None):
+        """Local top-k by the combined score of several seeds, as (catalog rows, scores)"""
+        scores = combine_scores(self.rows(seeds, vectors), weights, aggregate)
+        return self._ranked(scores, k, excluded)
+
+    def _ranked(self, scores: np.ndarray, k: int, excluded: Optional[np.ndarray]):
+        if excluded is not None:
+            scores[unpack(excluded, len(scores))] = -np.inf
+        local = ranked_row(scores, k)
+        return local + self.start, scores[local]
+
+
+def serve(shard: Shard, listener: Listener):
+    """Answer coordinator requests, one thread per connection"""
+    while True:
+        try:
+            connection = listener.accept()
+        except multiprocessing.AuthenticationError:
+            continue
+        threading.Thread(target=_answer, args=(shard, connection), daemon=True).start()
+
+
+def _answer(shard: Shard, connection):
+    with connection:
+        while True:
+            try:
+                op, args = connection.recv()
+            except (EOFError, OSError):
+                return
+            try:
+                if op not in SHARD_OPS:
+                    raise ValueError(f"Unknown shard operation '{op}'")
+                reply = ('ok', getattr(shard, op)(*args))
+            except Exception as e:
+                reply = ('error', f"{type(e).__name__}: {e}")
+            try:
+                connection.send(reply)
+            except OSError:
+                return
+
+
+def _run_local(path: str, shard: int, count: int, authkey: bytes, ready):
+    """Entry point of a local shard process: load the shard, report its address, then serve"""
+    try:
+        loaded = Shard.load(path, shard, count)
+        listener = Listener(family='AF_UNIX', authkey=authkey)
+    except Exception as e:
+        ready.send(('error', f"{type(e).__name__}: {e}"))
+        raise
+    ready.send(('ok', listener.address))
+    ready.close()
+    serve(loaded, listener)
+
+
+def _stop(processes: list):
+    for process in processes:
+        if process.is_alive():
+            process.terminate()
+    for process in processes:
+        process.join(timeout=1)
+
+
+class ShardedBackend:
+    """Similarity backend whose catalog rows are split across shard servers
+
+    Offers what the model uses from SimilarityStore and SparseSimilarity
+    (shape, row indexing, scores and top_k) plus combined_top_k, each answered
+    by sending the request to every shard at once and merging their partial
+    results. Shards return only their local top-k, so a ranking moves k rows
+    per shard instead of the full similarity row.
+
+    Every call waits at most `timeout` seconds. A shard that times out or
+    cannot be reached is left out of the result and skipped for RETRY_INTERVAL
+    seconds, so one slow shard does not stall every request. `failures` counts
+    the shard calls left out, so callers can avoid caching partial results.
+    """
+
+    def __init__(self, addresses: Sequence, authkey: Optional[bytes], timeout: float, processes: Sequence = ()):
+        self.addresses = list(addresses)
+        self.authkey = authkey
+        self.timeout = timeout
+        self.failures = 0
+        self._pid = None
+        self._down_until = [0.0] * len(self.addresses)
+        if processes:
+            # Local shard processes live as long as this backend
+            weakref.finalize(self, _stop, list(processes))
+
+        shards = range(len(self.addresses))
+        info = self._scatter({shard: ('info', ()) for shard in shards}, STARTUP_TIMEOUT)
+        if len(info) != len(self.addresses):
+            raise RuntimeError(f"Only {len(info)} of {len(self.addresses)} shards answered")
+        self.size = info[0]['size']
+        self.kind = info[0]['kind']
+        self.dimensions = info[0]['dimensions']
+        self.bounds = np.array([info[shard]['start'] for shard in shards] + [info[shards[-1]]['stop']])
+        if any(info[shard]['stop'] != self.bounds[shard + 1] or info[shard]['size'] != self.size for shard in shards) \
+                or self.bounds[0] != 0 or self.bounds[-1] != self.size:
+            raise RuntimeError("The shards do not split one catalog into consecutive row ranges")
+
+    @classmethod
+    def connect(cls, addresses: str, authkey: Optional[str], timeout: float) -> "ShardedBackend":
+        """Use shard servers that are already running, given as 'host:port,host:port' in shard order
+
+        Replies are unpickled, so shards are only reached with their shared key.
+        """
+        if not authkey:
+            raise ValueError("MODEL_SHARD_AUTHKEY must be set to the shard servers' key to use MODEL_SHARDS")
+        parsed = []
+        for address in addresses.split(','):
+            host, port = address.strip().rsplit(':', 1)
+            parsed.append((host, int(port)))
+        return cls(parsed, authkey.encode(), timeout)
+
+    @classmethod
+    def start_local(cls, path: str, count: int, timeout: float) -> "ShardedBackend":
+        """Fork `count` local shard processes, each loading its rows of the store or feature matrix at `path`"""
+        context = multiprocessing.get_context('fork')
+        authkey = os.urandom(32)
+        processes, receivers = [], []
+        try:
+            for shard in range(count):
+                receiver, sender = context.Pipe(duplex=False)
+                process = context.Process(target=_run_local, args=(path, shard, count, authkey, sender),
+                                          name=f'shard-{shard}', daemon=True)
+                process.start()
+                sender.close()
+                processes.append(process)
+                receivers.append(receiver)
+            # The shards load in parallel
+            addresses = []
+            for shard, receiver in enumerate(receivers):
+                try:
+                    status, value = receiver.recv()
+                except EOFError:
+                    status, value = 'error', "process exited"
+                if status != 'ok':
+                    raise RuntimeError(f"Shard {shard} failed to load {path}: {value}")
+                addresses.append(value)
+            return cls(addresses, authkey, timeout, processes)
+        except BaseException:
+            _stop(processes)
+            raise
+
+    @property
+    def shape(self):
+        return (self.size, self.size)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __getitem__(self, key) -> np.ndarray:
+        """Full similarity rows for one index or an array of indices, assembled from the shards"""
+        single = np.ndim(key) == 0
+        seeds = np.atleast_1d(np.asarray(key, dtype=np.int64))
+        vectors = self._vectors(seeds)
+        replies = self._scatter({shard: ('rows', (seeds, vectors)) for shard in range(len(self.addresses))})
+        rows = np.full((len(seeds), self.size), np.nan)
+        for shard, values in replies.items():
+            rows[:, self.bounds[shard]:self.bounds[shard + 1]] = values
+        return rows[0] if single else rows
+
+    def scores(self, seeds: np.ndarray, candidates: np.ndarray) -> np.ndarray:
+        """Similarities of the candidates to each seed, shape (seeds, candidates)"""
+        seeds = np.asarray(seeds, dtype=np.int64)
+        candidates = np.asarray(candidates, dtype=np.int64)
+        owners = self._owners(candidates)
+        vectors = self._vectors(seeds)
+        replies = self._scatter({
+            shard: ('scores', (seeds, candidates[owners == shard], vectors)) for shard in np.unique(owners).tolist()
+        })
+        scores = np.full((len(seeds), len(candidates)), np.nan)
+        for shard, values in replies.items():
+            scores[:, owners == shard] = values
+        return scores
+
+    def top_k(self, index: int, k: int, exclude_mask: Optional[np.ndarray] = None) -> np.ndarray:
+        """Merge every shard's local top-k for one seed, skipping the seed itself and excluded rows"""
+        vectors = self._vectors(np.array([index]))
+        return self._merge(self._scatter({
+            shard: ('top_k', (index, k, self._excluded(exclude_mask, shard), vectors))
+            for shard in range(len(self.addresses))
+        }), k)
+
+    def combined_top_k(self, indices: List[int], weights: List[float], aggregate: str, k: int,
+                       exclude_mask: Optional[np.ndarray] = None) -> np.ndarray:
+        """Merge every shard's local top-k by the mean, max or weighted score of several seeds"""
+        seeds = np.asarray(indices, dtype=np.int64)
+        vectors = self._vectors(seeds)
+        return self._merge(self._scatter({
+            shard: ('combined_top_k', (seeds, list(weights), aggregate, k, self._excluded(exclude_mask, shard), vectors))
+            for shard in range(len(self.addresses))
+        }), k)
+
+    @staticmethod
+    def _merge(replies: Dict[int, tuple], k: int) -> np.ndarray:
+        """Top k of the shards' ranked (rows, scores), by score descending and then by row"""
+        if not replies:
+            return np.empty(0, dtype=np.int64)
+        rows = np.concatenate([rows for rows, _ in replies.values()])
+        scores = np.concatenate([scores for _, scores in replies.values()])
+        return rows[np.lexsort((rows, -scores))[:k]].astype(np.int64)
+
+    def _owners(self, rows: np.ndarray) -> np.ndarray:
+        return np.searchsorted(self.bounds, rows, side='right') - 1
+
+    def _excluded(self, exclude_mask: Optional[np.ndarray], shard: int) -> Optional[np.ndarray]:
+        """The shard's part of the exclusion mask as a packed bitset, None when nothing there is excluded"""
+        if exclude_mask is None:
+            return None
+        part = exclude_mask[self.bounds[shard]:self.bounds[shard + 1]]
+        return np.packbits(part) if part.any() else None
+
+    def _vectors(self, seeds: np.ndarray) -> Optional[np.ndarray]:
+        """Dense feature vectors (features x seeds) of the seeds for sparse shards, None for dense ones
+
+        A seed whose shard does not answer gets NaN features, so it scores NaN (ranked last).
+        """
+        if self.kind == 'dense':
+            return None
+        owners = self._owners(seeds)
+        replies = self._scatter({shard: ('vectors', (seeds[owners == shard],)) for shard in np.unique(owners).tolist()})
+        vectors = np.full((self.dimensions, len(seeds)), np.nan)
+        for shard, values in replies.items():
+            vectors[:, owners == shard] = values.toarray().T
+        return vectors
+
+    def _connections(self) -> List[list]:
+        """Idle connections per shard; a forked child starts without the parent's"""
+        if self._pid != os.getpid():
+            self._lock = threading.Lock()
+            self._idle = [[] for _ in self.addresses]
+            self._pid = os.getpid()
+        return self._idle
+
+    def _scatter(self, requests: Dict[int, tuple], timeout: Optional[float] = None) -> Dict[int, object]:
+        """Send every shard its request, then collect the replies that arrive before the deadline"""
+        with metrics.stage('shard_scatter'):
+            idle = self._connections()
+            deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+            sent = {}
+            for shard, request in requests.items():
+                if self._down_until[shard] > time.monotonic():
+                    self._failed(shard, 'skipped')
+                    continue
+                try:
+                    with self._lock:
+                        connection = idle[shard].pop() if idle[shard] else None
+                    if connection is None:
+                        connection = Client(self.addresses[shard], authkey=self.authkey)
+                    connection.send(request)
+                except (OSError, EOFError, multiprocessing.AuthenticationError) as e:
+                    self._failed(shard, 'unavailable', e)
+                    continue
+                sent[shard] = connection
+
+            replies = {}
+            for shard, connection in sent.items():
+                try:
+                    if not connection.poll(max(deadline - time.monotonic(), 0)):
+                        raise TimeoutError(f"no answer within {self.timeout if timeout is None else timeout}s")
+                    status, value = connection.recv()
+                except (OSError, EOFError) as e:
+                    # A late answer must never be read as the answer to the next request
+                    connection.close()
+                    self._failed(shard, 'timeout' if isinstance(e, TimeoutError) else 'unavailable', e)
+                    continue
+                with self._lock:
+                    idle[shard].append(connection)
+                if status == 'ok':
+                    replies[shard] = value
+                else:
+                    self._failed(shard, 'error', value)
+            return replies
+
+    def _failed(self, shard: int, reason: str, error=None):
+        with self._lock:
+            self.failures += 1
+        metrics.SHARD_FAILURES.inc(shard=str(shard), reason=reason)
+        if reason in ('timeout', 'unavailable'):
+            self._down_until[shard] = time.monotonic() + RETRY_INTERVAL
+        if reason != 'skipped':
+            print(f"Shard {shard} left out of the result ({reason}): {error}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve one shard of the catalog to a model with MODEL_BACKEND=sharded")
+    parser.add_argument('path', help="Similarity store (.sim) or feature matrix (games_features.npz)")
+    parser.add_argument('--shard', type=int, required=True, help="Index of this shard, from 0")
+    parser.add_argument('--shards', type=int, required=True, help="Total number of shards")
+    parser.add_argument('--host', default='127.0.0.1', help="Interface to listen on")
+    parser.add_argument('--port', type=int, default=6100, help="Port to listen on")
+    args = parser.parse_args()
+
+    # Shared with the coordinator, which must use the same MODEL_SHARD_AUTHKEY. Requests are
+    # unpickled, so without a key anyone reaching the port could run code in this process
+    authkey = os.environ.get('MODEL_SHARD_AUTHKEY')
+    if not authkey:
+        parser.error("set MODEL_SHARD_AUTHKEY to a secret shared with the coordinator")
+    shard = Shard.load(args.path, args.shard, args.shards)
+    listener = Listener((args.host, args.port), authkey=authkey.encode())
+    print(f"Serving rows {shard.start}-{shard.stop} of {shard.size} on {args.host}:{args.port}")
+    serve(shard, listener)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+import argparse
+import json
+import os
+import struct
+from typing import List, Optional
+
+import numpy as np
+
+from ranking import ranked_row
+
+# File layout: MAGIC | version (u32) | header length (u32) | JSON header | padding | row-major data
+MAGIC = b'SIMSTORE'
+VERSION = 1
+ALIGNMENT = 64
+SUPPORTED_DTYPES = ('float64', 'float32', 'float16', 'int8')
+# Cosine similarities live in [-1, 1], so int8 uses one fixed scale for the whole matrix
+INT8_SCALE = 1.0 / 127
+
+
+class SimilarityStore:
+    """Square similarity matrix backed by a NumPy array or a read-only memory map
+
+    Indexing returns float64 rows (de-quantized when the data is stored as int8),
+    so the store can be used anywhere a dense ndarray of scores was used before.
+    When opened from disk every process maps the same file, and the OS shares
+    the pages between them instead of each worker holding its own copy.
+    """
+
+    def __init__(self, data: np.ndarray, ids: List[str], scale: Optional[float] = None):
+        self.data = data
+        self.ids = ids
+        self.scale = scale
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    @property
+    def dtype(self) -> np.dtype:
+        """Storage dtype (the dtype returned by indexing is always float64)"""
+        return self.data.dtype
+
+    def __len__(self) -> int:
+        return self.data.shape[0]
+
+    def __getitem__(self, key) -> np.ndarray:
+        # Always a private copy, callers are free to mask the returned scores
+        values = np.array(self.data[key], dtype=np.float64)
+        if self.scale is not None:
+            values *= self.scale
+        return values
+
+    def scores(self, seeds: np.ndarray, candidates: np.ndarray) -> np.ndarray:
+        """Similarities of the candidates to each seed, shape (seeds, candidates)"""
+        return self[np.asarray(seeds)[:, None], np.asarray(candidates)[None, :]]
+
+    def top_k(self, index: int, k: int, exclude_mask: Optional[np.ndarray] = None) -> np.ndarray:
+        """Partial selection over one full row, skipping the item itself and excluded rows"""
+        scores = self[index]
+        scores[np.isnan(scores)] = -np.inf
+        scores[index] = -np.inf
+        if exclude_mask is not None:
+            scores[exclude_mask] = -np.inf
+        return ranked_row(scores, k)
+
+    @classmethod
+    def from_array(cls, values: np.ndarray, ids: List[str]) -> "SimilarityStore":
+        """Wrap an in-memory matrix, e.g. one read from the legacy parquet file"""
+        return cls(np.asarray(values), list(ids))
+
+    @classmethod
+    def open(cls, path: str) -> "SimilarityStore":
+        """Memory-map a store file read-only"""
+        header, offset = _read_header(path)
+        data = np.memmap(path, dtype=header['dtype'], mode='r', offset=offset, shape=tuple(header['shape']))
+        return cls(data, header['ids'], header.get('scale'))
+
+    @classmethod
+    def create(cls, path: str, ids: List[str], dtype: str = 'float32') -> "SimilarityStore":
+        """Create an empty store on disk that can be filled one row block at a time
+
+        Use `write_rows` to fill it and `flush` when done.
+        """
+        if dtype not in SUPPORTED_DTYPES:
+            raise ValueError(f"Unsupported dtype '{dtype}', expected one of {SUPPORTED_DTYPES}")
+        ids = [str(game_id) for game_id in ids]
+        size = len(ids)
+        header = {
+            'dtype': dtype,
+            'shape': [size, size],
+            'ids': ids,
+            'scale': INT8_SCALE if dtype == 'int8' else None,
+        }
+        offset = _write_header(path, header)
+        data = np.memmap(path, dtype=dtype, mode='r+', offset=offset, shape=(size, size))
+        return cls(data, ids, header['scale'])
+
+    def write_rows(self, start: int, values: np.ndarray):
+        """Store a block of float rows starting at row `start`, quantizing if needed"""
+        values = self._encode(values)
+        self.data[start:start + values.shape[0]] = values
+
+    def write_rows_at(self, rows: np.ndarray, values: np.ndarray):
+        """Store float rows at arbitrary row positions"""
+        self.data[rows] = self._encode(values)
+
+    def write_columns(self, columns: np.ndarray, values: np.ndarray):
+        """Store float values (rows x len(columns)) into the given columns of every row"""
+        self.data[:, columns] = self._encode(values)
+
+    def _encode(self, values: np.ndarray) -> np.ndarray:
+        values = np.asarray(values, dtype=np.float64)
+        if self.scale is not None:
+            values = np.clip(np.rint(values / self.scale), -127, 127)
+        return values.astype(self.data.dtype)
+
+    def resized(self, path: str, ids: List[str], block_rows: int = 1024) -> "SimilarityStore":
+        """Writable copy in a new store file, with the same dtype and scale, grown to `ids`
+
+        The data is copied one row block at a time, so the matrix is never held
+        in memory. New cells are zero.
+        """
+        store = SimilarityStore.create(path, ids, self.data.dtype.name)
+        old_size = len(self)
+        for start in range(0, old_size, block_rows):
+            stop = min(start + block_rows, old_size)
+            store.data[start:stop, :old_size] = self.data[start:stop]
+        return store
+
+    def flush(self):
+        if isinstance(self.data, np.memmap):
+            self.data.flush()
+
+
+def _write_header(path: str, header: dict) -> int:
+    """Write the file header, size the file for the data and return the data offset"""
+    header_bytes = json.dumps(header).encode('utf-8')
+    prefix = MAGIC + struct.pack('<II', VERSION, len(header_bytes))
+    offset = len(prefix) + len(header_bytes)
+    offset += -offset % ALIGNMENT
+    size = header['shape'][0]
+    data_bytes = size * size * np.dtype(header['dtype']).itemsize
+
+    with open(path, 'wb') as f:
+        f.write(prefix)
+        f.write(header_bytes)
+        f.write(b'\0' * (offset - len(prefix) - len(header_bytes)))
+        f.truncate(offset + data_bytes)
+    return offset
+
+
+def _read_header(path: str):
+    """Parse the file header and return it with the data offset"""
+    with open(path, 'rb') as f:
+        magic = f.read(len(MAGIC))
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a similarity store file")
+        version, header_length = struct.unpack('<II', f.read(8))
+        if version != VERSION:
+            raise ValueError(f"Unsupported similarity store version {version}")
+        header = json.loads(f.read(header_length).decode('utf-8'))
+    offset = len(MAGIC) + 8 + header_length
+    offset += -offset % ALIGNMENT
+    return header, offset
+
+
+def convert_parquet(parquet_path: str, output_path: str, dtype: str = 'float32', batch_size: int = 1024) -> SimilarityStore:
+    """Convert games_similarity_matrix.parquet into a store file
+
+    The parquet file is streamed in row batches, so the full float64 matrix
+    never has to be held in memory.
+    """
+    import pyarrow.parquet as pq
+
+    parquet_file = pq.ParquetFile(parquet_path)
+    # Row labels are not data columns; column labels carry the same game ids
+    columns = [name for name in parquet_file.schema_arrow.names if not name.startswith('__index_level_')]
+    store = SimilarityStore.create(output_path, columns, dtype)
+
+    start = 0
+    for batch in parquet_file.iter_batches(batch_size=batch_size, columns=columns):
+        block = np.column_stack([column.to_numpy(zero_copy_only=False) for column in batch.columns])
+        store.write_rows(start, block)
+        start += block.shape[0]
+
+    if start != len(columns):
+        raise ValueError(f"Similarity matrix is not square: {start} rows, {len(columns)} columns")
+    store.flush()
+    return store
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert the parquet similarity matrix into a memory-mappable store")
+    parser.add_argument('parquet', help="Path to games_similarity_matrix.parquet")
+    parser.add_argument('output', help="Path of the store file to write")
+    parser.add_argument('--dtype', choices=SUPPORTED_DTYPES, default='float32', help="Storage dtype")
+    args = parser.parse_args()
+
+    store = convert_parquet(args.parquet, args.output, args.dtype)
+    size_mb = os.path.getsize(args.output) / 2 ** 20
+    print(f"Saved {len(store)} x {len(store)} {args.dtype} store ({size_mb:.1f} MB) to {os.path.abspath(args.output)}")
+
+
+if __name__ == "__main__":
+    main()
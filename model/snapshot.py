@@ -0,0 +1,82 @@
+import argparse
+import os
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from id_index import IdIndex
+
+SNAPSHOT_VERSION = 1
+# Column used to pick the most popular seeds for warm-up
+POPULARITY_COLUMN = 'ccu'
+
+
+class CatalogSnapshot:
+    """Everything the model needs to serve, without reading the catalog frame
+
+    Holds the id -> row index (ids in row order plus their sorted order) and a
+    popularity score per row. It is saved as an uncompressed .npz next to the
+    catalog, with the catalog's row count and file size so a snapshot left over
+    from an older catalog is detected and ignored.
+    """
+
+    def __init__(self, id_index: IdIndex, popularity: np.ndarray):
+        self.id_index = id_index
+        self.popularity = np.asarray(popularity, dtype=np.float64)
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> "CatalogSnapshot":
+        id_column = df.index if 'id' not in df.columns else df['id']
+        popularity = df[POPULARITY_COLUMN].fillna(0) if POPULARITY_COLUMN in df.columns else np.zeros(len(df))
+        return cls(IdIndex(np.asarray(id_column).astype(str)), np.asarray(popularity, dtype=np.float64))
+
+    @classmethod
+    def from_catalog(cls, catalog_path: str) -> "CatalogSnapshot":
+        """Build the snapshot from the catalog file, reading only the columns it needs"""
+        import pyarrow.parquet as pq
+
+        names = pq.read_schema(catalog_path).names
+        columns = [column for column in ('id', POPULARITY_COLUMN) if column in names]
+        return cls.from_frame(pd.read_parquet(catalog_path, columns=columns))
+
+    def save(self, path: str, catalog_path: str):
+        rows, file_size = _fingerprint(catalog_path)
+        np.savez(path, version=SNAPSHOT_VERSION, catalog_rows=rows, catalog_bytes=file_size,
+                 ids=self.id_index.ids, order=self.id_index.order, popularity=self.popularity)
+
+    @classmethod
+    def load(cls, path: str, catalog_path: str) -> Optional["CatalogSnapshot"]:
+        """Read a snapshot, or return None when it is missing or does not match the catalog"""
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            if int(data['version']) != SNAPSHOT_VERSION:
+                print(f"Ignoring snapshot {path} with unsupported version {int(data['version'])}")
+                return None
+            if (int(data['catalog_rows']), int(data['catalog_bytes'])) != _fingerprint(catalog_path):
+                print(f"Ignoring stale snapshot at {path}")
+                return None
+            return cls(IdIndex(data['ids'], data['order']), data['popularity'])
+
+
+def _fingerprint(catalog_path: str):
+    """Row count (from the parquet footer only) and size of the catalog file"""
+    import pyarrow.parquet as pq
+
+    return pq.read_metadata(catalog_path).num_rows, os.path.getsize(catalog_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write the startup snapshot for a processed catalog")
+    parser.add_argument('catalog', help="Path to processed_games.parquet")
+    parser.add_argument('output', help="Path of the .npz snapshot to write")
+    args = parser.parse_args()
+
+    snapshot = CatalogSnapshot.from_catalog(args.catalog)
+    snapshot.save(args.output, args.catalog)
+    print(f"Saved snapshot of {len(snapshot.id_index)} games to {os.path.abspath(args.output)}")
+
+
+if __name__ == "__main__":
+    main()
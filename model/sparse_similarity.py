@@ -0,0 +1,97 @@
+import heapq
+from typing import Optional
+
+import numpy as np
+import scipy.sparse as sp
+
+from ranking import top_k
+
+# Catalog rows scored per sparse-dense product when ranking a single seed
+BLOCK_ROWS = 8192
+
+
+class SparseSimilarity:
+    """Cosine similarities computed on demand from the weighted sparse feature matrix
+
+    The rows of `features` are the L2-normalized weighted feature vectors written
+    by the build step, so a dot product between two rows is their cosine
+    similarity. Nothing quadratic in the catalog size is ever stored. Scores are
+    computed with the same sparse-dense kernel the build step uses, so rankings
+    are identical to a float64 dense store built from the same features.
+    """
+
+    def __init__(self, features: sp.csr_matrix, block_rows: int = BLOCK_ROWS):
+        self.features = sp.csr_matrix(features, dtype=np.float64)
+        self.block_rows = block_rows
+
+    @classmethod
+    def load(cls, path: str) -> "SparseSimilarity":
+        return cls(sp.load_npz(path))
+
+    @property
+    def shape(self):
+        size = self.features.shape[0]
+        return (size, size)
+
+    def __len__(self) -> int:
+        return self.features.shape[0]
+
+    def __getitem__(self, key) -> np.ndarray:
+        """Full similarity rows for one index, a slice or an array of indices"""
+        seeds = self._dense_seeds(key)
+        rows = np.asarray(self.features @ seeds).T
+        return rows[0] if np.ndim(key) == 0 and not isinstance(key, slice) else rows
+
+    def _dense_seeds(self, key) -> np.ndarray:
+        """Seed feature vectors as dense columns (features x seeds)"""
+        if np.ndim(key) == 0 and not isinstance(key, slice):
+            key = [key]
+        return self.features[key].toarray().T
+
+    def scores(self, seeds: np.ndarray, candidates: np.ndarray) -> np.ndarray:
+        """Similarities of the candidates to each seed, shape (seeds, candidates)
+
+        Only the candidate rows are multiplied, with the same kernel as full rows.
+        """
+        return np.asarray(self.features[np.asarray(candidates)] @ self._dense_seeds(np.asarray(seeds))).T
+
+    def top_k(self, index: int, k: int, exclude_mask: Optional[np.ndarray] = None) -> np.ndarray:
+        """Rank the catalog for one seed block by block, keeping a running top-k heap
+
+        Args:
+            index: Seed row
+            k: Number of results
+            exclude_mask: Optional boolean mask of rows that must not be returned
+
+        Returns:
+            Up to k row indices, by score descending and then by index
+        """
+        if k <= 0:
+            return np.empty(0, dtype=np.int64)
+        seed = self._dense_seeds(index)
+        # Min-heap of (score, -index): the root is the worst of the current best k
+        heap = []
+
+        for start in range(0, self.features.shape[0], self.block_rows):
+            stop = min(start + self.block_rows, self.features.shape[0])
+            scores = np.asarray(self.features[start:stop] @ seed)[:, 0]
+            scores[np.isnan(scores)] = -np.inf
+            if exclude_mask is not None:
+                scores[exclude_mask[start:stop]] = -np.inf
+            if start <= index < stop:
+                scores[index - start] = -np.inf
+
+            for position in top_k(scores, k)[0]:
+                score = scores[position]
+                if score == -np.inf:
+                    break
+                entry = (score, -(start + int(position)))
+                if len(heap) < k:
+                    heapq.heappush(heap, entry)
+                elif entry > heap[0]:
+                    heapq.heapreplace(heap, entry)
+                else:
+                    # Block candidates are ranked, so the rest cannot enter either
+                    break
+
+        return np.array([-negative_index for _, negative_index in sorted(heap, reverse=True)], dtype=np.int64)
@@ -0,0 +1,23 @@
+import os
+import sys
+
+import pytest
+
+# The model modules import each other by their flat names, as when run from model/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Enough games that the 100-neighbor index does not cover whole rankings
+CATALOG_SIZE = 400
+
+
+@pytest.fixture(scope='session')
+def catalog_dir(tmp_path_factory):
+    """Artifacts of a default (float32) build of a synthetic catalog"""
+    from benchmarks.synthetic_catalog import generate_catalog
+    from data_processing.build_similarity import build
+
+    directory = tmp_path_factory.mktemp('catalog')
+    csv_path = os.path.join(directory, 'raw_catalog.csv')
+    generate_catalog(CATALOG_SIZE, seed=0).to_csv(csv_path, index=False)
+    build(csv_path, str(directory))
+    return str(directory)
@@ -0,0 +1,35 @@
+import os
+
+import numpy as np
+
+from neighbor_index import NeighborIndex
+from similarity_store import SimilarityStore
+
+
+def test_build_ranks_the_stored_values(catalog_dir):
+    store = SimilarityStore.open(os.path.join(catalog_dir, 'games_similarity_matrix.sim'))
+    index = NeighborIndex.load(os.path.join(catalog_dir, 'games_neighbors.npz'))
+    assert store.dtype == np.float32
+    for row in range(len(store)):
+        expected = store.top_k(row, index.k)
+        assert index.neighbors(row)[:len(expected)].tolist() == expected.tolist(), f"row {row}"
+
+
+def test_index_from_another_precision_is_rebuilt(catalog_dir, tmp_path):
+    from model import NEIGHBOR_INDEX_FILE, RecommendationModel
+
+    served = RecommendationModel('dense', catalog_dir)
+    shipped = NeighborIndex.load(os.path.join(catalog_dir, NEIGHBOR_INDEX_FILE))
+    assert served.neighbor_index.source == shipped.source
+
+    # Same rankings, but recorded as ranked from a float64 copy of the matrix
+    copied = tmp_path / 'catalog'
+    copied.mkdir()
+    for name in os.listdir(catalog_dir):
+        os.link(os.path.join(catalog_dir, name), copied / name)
+    os.unlink(copied / NEIGHBOR_INDEX_FILE)
+    float64 = np.array(served.similarity_matrix[np.arange(served.size)], dtype=np.float64)
+    NeighborIndex(shipped.ids, shipped.scores, NeighborIndex.fingerprint(float64)).save(str(copied / NEIGHBOR_INDEX_FILE))
+
+    model = RecommendationModel('dense', str(copied))
+    assert model.neighbor_index.source == shipped.source
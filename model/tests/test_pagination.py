@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+
+from model import RecommendationModel
+
+
+@pytest.fixture(scope='module')
+def model(catalog_dir):
+    return RecommendationModel('dense', catalog_dir)
+
+
+def walk_pages(model, seeds, page_size, **query):
+    """Every page of a query, concatenated"""
+    result, offsets, turn = [], None, 0
+    while True:
+        page, offsets, turn = model.predict_page(seeds, page_size, offsets=offsets, turn=turn, **query)
+        result.extend(page)
+        if offsets is None:
+            return result
+
+
+@pytest.mark.parametrize('aggregate', ['round_robin', 'mean', 'weighted'])
+def test_pages_concatenate_to_one_prediction(model, aggregate):
+    rng = np.random.default_rng(0)
+    ids = model.id_to_index.ids
+    for _ in range(40):
+        seeds = rng.choice(model.size, rng.integers(1, 4), replace=False).tolist()
+        excluded = ids[rng.choice(model.size, rng.integers(0, 30), replace=False)].tolist()
+        weights = rng.uniform(0.5, 2, len(seeds)).tolist() if aggregate == 'weighted' else None
+        # Some queries are filtered, which ranks the seed rows with the filter mask applied
+        filters = {'genres': [str(rng.choice(model.filter_index.genres))]} if rng.random() < 0.3 else None
+        query = dict(excluded_ids=excluded, aggregate=aggregate, weights=weights, filters=filters)
+        pages = walk_pages(model, seeds, int(rng.integers(5, 40)), **query)
+        assert len(pages) == len(set(pages))
+        assert pages == model.predict_by_index(seeds, len(pages) + 1, **query)
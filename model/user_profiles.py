@@ -0,0 +1,213 @@
+import threading
+from collections import OrderedDict
+from typing import Iterator, Optional, Tuple
+
+import numpy as np
+
+from id_index import IdIndex
+
+# Similarity rows read at once while building a profile, bounding its temporary memory
+ROW_BLOCK = 64
+
+
+def _latest_unique(rows: np.ndarray) -> np.ndarray:
+    """Each row once, at its last position, keeping the order"""
+    reversed_rows = rows[::-1]
+    _, first = np.unique(reversed_rows, return_index=True)
+    return reversed_rows[np.sort(first)][::-1]
+
+
+class UserProfile:
+    """One user's purchase history and its recency-weighted score vector
+
+    `rows` holds each owned game once, in the order they were last bought.
+    `scores` is the sum of the similarity rows of the `depth` last ones, the
+    newest weighted 1 and each older one `decay` times its successor, so recommending
+    is a single top-k over it instead of one ranking per owned game. Instances
+    are never modified: a purchase creates a new profile with a new version.
+    `scores` is None when it has to be rebuilt from the history (after the
+    model changed, or when a shard was missing while it was computed).
+    """
+    __slots__ = ('user_id', 'version', 'rows', 'scores')
+
+    def __init__(self, user_id: str, version: int, rows: np.ndarray, scores: Optional[np.ndarray]):
+        self.user_id = user_id
+        self.version = version
+        self.rows = rows
+        self.scores = scores
+
+    @property
+    def nbytes(self) -> int:
+        return self.rows.nbytes + (self.scores.nbytes if self.scores is not None else 0)
+
+
+class UserProfiles:
+    """Profiles of the users of one model, least recently used evicted beyond a memory budget
+
+    A profile costs 4 bytes per catalog row plus 4 per owned game. Only the
+    `depth` most recently bought games shape the vector, but every owned game
+    is excluded from the recommendations. A game bought again moves to the
+    newest position and still counts once.
+    """
+
+    def __init__(self, model, max_bytes: int, decay: float, depth: int):
+        self.model = model
+        self.max_bytes = max_bytes
+        self.decay = decay
+        self.depth = depth
+        self._profiles: "OrderedDict[str, UserProfile]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        # Versions are never reused, even by a profile deleted and created again
+        self._next_version = 1
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._profiles)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self._profiles))
+
+    @property
+    def nbytes(self) -> int:
+        return self._bytes
+
+    def _weighted_sum(self, rows: np.ndarray, weights: np.ndarray) -> Tuple[np.ndarray, bool]:
+        """Weighted sum of similarity rows, and whether every shard answered"""
+        failures = self.model.backend_failures
+        scores = np.zeros(self.model.size)
+        for start in range(0, len(rows), ROW_BLOCK):
+            block = self.model.similarity_matrix[rows[start:start + ROW_BLOCK]]
+            scores += weights[start:start + ROW_BLOCK] @ np.nan_to_num(block, nan=0.0)
+        return scores, self.model.backend_failures == failures
+
+    def _scores(self, rows: np.ndarray) -> Tuple[np.ndarray, bool]:
+        """Decayed sum of the similarity rows of the window (newest last in `rows`), and whether every shard answered"""
+        rows = rows[-self.depth:]
+        scores, complete = self._weighted_sum(rows, self.decay ** np.arange(len(rows) - 1, -1, -1, dtype=np.float64))
+        return scores.astype(np.float32), complete
+
+    def _added_scores(self, current: Optional[UserProfile], rows: np.ndarray, history: np.ndarray) -> Optional[np.ndarray]:
+        """Vector after buying `rows`, updated from the current one when the window only shifts
+
+        The current vector is decayed, the new games added and the games pushed
+        out of the window subtracted with the weight they would have had. A game
+        bought again from within the window reorders the older ones, so the
+        vector is then left to be rebuilt on the next read.
+        """
+        if current is None or len(rows) >= self.depth:
+            scores, complete = self._scores(history)
+            return scores if complete else None
+        window = current.rows[-self.depth:]
+        if current.scores is None or np.isin(rows, window).any():
+            return None
+        dropped = window[:max(0, len(window) + len(rows) - self.depth)]
+        weights = np.concatenate([
+            self.decay ** np.arange(len(rows) - 1, -1, -1, dtype=np.float64),
+            -self.decay ** (len(rows) + np.arange(len(window) - 1, len(window) - 1 - len(dropped), -1, dtype=np.float64)),
+        ])
+        delta, complete = self._weighted_sum(np.concatenate([rows, dropped]), weights)
+        if not complete:
+            return None
+        return (current.scores * self.decay ** len(rows) + delta).astype(np.float32)
+
+    def _store(self, user_id: str, rows: np.ndarray, scores: Optional[np.ndarray]) -> UserProfile:
+        """Swap in a new version of the profile and evict beyond the budget; callers hold the lock"""
+        profile = UserProfile(user_id, self._next_version, rows, scores)
+        self._next_version += 1
+        previous = self._profiles.pop(user_id, None)
+        if previous is not None:
+            self._bytes -= previous.nbytes
+        self._profiles[user_id] = profile
+        self._bytes += profile.nbytes
+        self._evict()
+        return profile
+
+    def _evict(self):
+        """Drop the least recently used profiles until within budget, keeping the newest; callers hold the lock"""
+        while self._bytes > self.max_bytes and len(self._profiles) > 1:
+            _, evicted = self._profiles.popitem(last=False)
+            self._bytes -= evicted.nbytes
+            self.evictions += 1
+
+    def put(self, user_id: str, rows: np.ndarray) -> UserProfile:
+        """Create or replace a profile from the user's whole history, oldest game first"""
+        rows = _latest_unique(np.asarray(rows, dtype=np.int32))
+        scores, complete = self._scores(rows)
+        with self._lock:
+            return self._store(user_id, rows, scores if complete else None)
+
+    def add(self, user_id: str, rows: np.ndarray) -> UserProfile:
+        """Record purchases (oldest first), updating the vector instead of rebuilding it"""
+        rows = _latest_unique(np.asarray(rows, dtype=np.int32))
+        while True:
+            with self._lock:
+                current = self._profiles.get(user_id)
+            history = rows if current is None else _latest_unique(np.concatenate([current.rows, rows]))
+            scores = self._added_scores(current, rows, history)
+            with self._lock:
+                # Start over if another request replaced the profile meanwhile
+                if self._profiles.get(user_id) is current:
+                    return self._store(user_id, history, scores)
+
+    def get(self, user_id: str, scores: bool = True) -> Optional[UserProfile]:
+        """The user's profile, with its score vector rebuilt when needed unless `scores` is False"""
+        with self._lock:
+            profile = self._profiles.get(user_id)
+            if profile is None:
+                self.misses += 1
+                return None
+            self._profiles.move_to_end(user_id)
+            self.hits += 1
+        if profile.scores is not None or not scores:
+            return profile
+        scores, complete = self._scores(profile.rows)
+        rebuilt = UserProfile(user_id, profile.version, profile.rows, scores)
+        if complete:
+            with self._lock:
+                # Unless a purchase replaced the profile in the meantime
+                if self._profiles.get(user_id) is profile:
+                    self._profiles[user_id] = rebuilt
+                    self._bytes += scores.nbytes
+                    self._evict()
+        # A vector missing a shard is served this once, but not stored
+        return rebuilt
+
+    def delete(self, user_id: str) -> bool:
+        with self._lock:
+            profile = self._profiles.pop(user_id, None)
+            if profile is None:
+                return False
+            self._bytes -= profile.nbytes
+            return True
+
+    def remapped(self, old_ids: np.ndarray, model) -> "UserProfiles":
+        """The same histories for another model, matching games by id
+
+        Used when the served model changes, since its similarities differ and
+        games can move to other rows. Games missing from the new catalog are
+        dropped, and every vector is rebuilt on the profile's next read.
+        """
+        new_index: IdIndex = model.id_to_index
+        remapped = UserProfiles(model, self.max_bytes, self.decay, self.depth)
+        with self._lock:
+            remapped._next_version = self._next_version
+            for user_id, profile in self._profiles.items():
+                rows = new_index.lookup(old_ids[profile.rows])
+                remapped._store(user_id, rows[rows >= 0].astype(np.int32), None)
+        return remapped
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._profiles),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }